@@ -0,0 +1,114 @@
+"""Wall time of a batch exported to several formats per file.
+
+The Doc2X API is replaced by an in-process transport: parsing takes `--parse`
+seconds, each conversion `--convert` seconds, and like the real API the result
+endpoint only reports the latest conversion of a uid. Run it against two
+checkouts to compare them:
+
+    python benchmarks/multi_format.py --files 20 --formats md,docx,tex
+"""
+
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+
+import httpx
+
+
+class Doc2XTransport(httpx.AsyncBaseTransport):
+    """Answer the Doc2X v2 endpoints used by `pdf2file`"""
+
+    def __init__(self, parse_time: float, convert_time: float):
+        self.parse_time = parse_time
+        self.convert_time = convert_time
+        self.parsing = {}
+        self.converting = {}
+        self.requests = {}
+        self.count = 0
+
+    @staticmethod
+    def ok(data):
+        return httpx.Response(200, json={"code": "success", "data": data})
+
+    async def handle_async_request(self, request):
+        path = request.url.path
+        self.requests[path] = self.requests.get(path, 0) + 1
+        await request.aread()
+        if path.endswith("/v2/parse/preupload"):
+            self.count += 1
+            uid = f"uid{self.count}"
+            return self.ok({"uid": uid, "url": f"https://oss.bench/{uid}"})
+        if request.url.host == "oss.bench":
+            self.parsing[path.strip("/")] = time.monotonic()
+            return httpx.Response(200)
+        if path.endswith("/v2/parse/status"):
+            started = self.parsing[request.url.params["uid"]]
+            elapsed = time.monotonic() - started
+            if elapsed < self.parse_time:
+                progress = int(100 * elapsed / self.parse_time)
+                return self.ok({"status": "processing", "progress": progress})
+            page = {"md": "\\(x\\)", "page_idx": 0, "page_width": 1, "page_height": 1}
+            return self.ok({"status": "success", "result": {"pages": [page]}})
+        if path.endswith("/v2/convert/parse"):
+            body = json.loads(request.content)
+            self.converting[body["uid"]] = (body["to"], time.monotonic())
+            return self.ok({"status": "processing", "url": ""})
+        if path.endswith("/v2/convert/parse/result"):
+            uid = request.url.params["uid"]
+            to, started = self.converting[uid]
+            if time.monotonic() - started < self.convert_time:
+                return self.ok({"status": "processing", "url": ""})
+            return self.ok({"status": "success", "url": f"https://dl.bench/{uid}.{to}"})
+        if request.url.host == "dl.bench":
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, "w") as z:
+                z.writestr("output.md", "\\(x\\)")
+            return httpx.Response(200, content=buf.getvalue())
+        return httpx.Response(404)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--formats", default="md,docx,tex")
+    parser.add_argument("--thread", type=int, default=10)
+    parser.add_argument("--parse", type=float, default=1, help="seconds per parse")
+    parser.add_argument(
+        "--convert", type=float, default=1, help="seconds per conversion"
+    )
+    args = parser.parse_args()
+
+    from pdfdeal import Doc2X
+
+    transport = Doc2XTransport(args.parse, args.convert)
+
+    sample = os.path.join(os.path.dirname(__file__), "..", "tests", "pdf", "sample.pdf")
+    client = Doc2X(apikey="sk-bench", thread=args.thread, transport=transport)
+    with tempfile.TemporaryDirectory() as output:
+        start = time.monotonic()
+        success, failed, has_error = client.pdf2file(
+            [sample] * args.files,
+            output_names=[f"file{i}" for i in range(args.files)],
+            output_path=output,
+            output_format=args.formats,
+        )
+        elapsed = time.monotonic() - start
+    print(
+        json.dumps(
+            {
+                "files": args.files,
+                "formats": args.formats,
+                "seconds": round(elapsed, 2),
+                "has_error": has_error,
+                "convert_requests": transport.requests.get("/api/v2/convert/parse", 0),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
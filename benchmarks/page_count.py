@@ -0,0 +1,77 @@
+"""Time to count the pages of a large batch of PDFs.
+
+The `tests/pdf` fixtures (and any PDF given with `--pdf`) are copied `--copies`
+times into a temporary folder, then counted with pypdf, with the fast path and
+again with the memo warm:
+
+    python benchmarks/page_count.py --copies 1000
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pypdf import PdfReader
+
+
+def pypdf_count(path):
+    with open(path, "rb") as f:
+        return len(PdfReader(f).pages)
+
+
+def timed(func, paths, workers):
+    start = time.monotonic()
+    with ThreadPoolExecutor(workers) as pool:
+        counts = list(pool.map(func, paths))
+    return round(time.monotonic() - start, 3), counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--copies", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pdf", action="append", default=[])
+    args = parser.parse_args()
+
+    from pdfdeal.Doc2X.Pages import PageCountMemo, get_pdf_page_count
+
+    tests = os.path.join(os.path.dirname(__file__), "..", "tests", "pdf")
+    sources = []
+    for path in (
+        glob.glob(os.path.join(tests, "**", "*.pdf"), recursive=True) + args.pdf
+    ):
+        try:
+            pypdf_count(path)
+            sources.append(path)
+        except Exception:
+            pass
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = []
+        for i in range(args.copies):
+            for j, source in enumerate(sources):
+                path = os.path.join(folder, f"{i}_{j}.pdf")
+                shutil.copyfile(source, path)
+                paths.append(path)
+        memo = PageCountMemo(os.path.join(folder, "pages.sqlite"))
+
+        def count(path):
+            return get_pdf_page_count(path, limit=None, memo=memo)
+
+        results = {"files": len(paths)}
+        results["pypdf"], expected = timed(pypdf_count, paths, args.workers)
+        results["fast"], counts = timed(count, paths, args.workers)
+        assert counts == expected
+        results["memo"], counts = timed(count, paths, args.workers)
+        assert counts == expected
+        memo.close()
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
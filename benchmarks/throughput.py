@@ -0,0 +1,121 @@
+"""Makespan, requests and peak memory of `pdf2file_back` on large batches.
+
+The Doc2X API is replaced by the mock server of the tests (`tests/mock_doc2x.py`):
+each page parses in `--page-seconds` (log-normal, `--sigma`), every API call
+answers in `--latency` seconds, and at most `--capacity` pages are parsed at the
+same time for each API key, like the real API. `--keys` shards the batch over
+several keys. Each batch size runs in a fresh interpreter so
+the peak RSS of one does not hide the next:
+
+    python benchmarks/throughput.py --files 100,1000,10000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tests.mock_doc2x import ENDPOINTS, MockDoc2X, lognormal, synthetic_pdfs  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def child(args, paths):
+    from pdfdeal import Doc2X
+    from pdfdeal.Doc2X.Poll import FixedPoll
+
+    base = peak_rss_mb()
+    latency = lognormal(args.latency, args.sigma) if args.latency else None
+    server = MockDoc2X(
+        seconds_per_page=lognormal(args.page_seconds, args.sigma),
+        convert_seconds=lognormal(args.convert_seconds, args.sigma),
+        latency=dict.fromkeys(ENDPOINTS, latency) if latency else None,
+        page_capacity=args.capacity,
+        rps=args.rps,
+    )
+    client = Doc2X(
+        apikey=[f"sk-bench{i}" for i in range(args.keys)],
+        transport=server,
+        thread=args.thread,
+        max_pages=args.capacity,
+        poll_rps=args.poll_rps,
+        poll_policy=FixedPoll(args.poll) if args.poll else None,
+    )
+    with tempfile.TemporaryDirectory() as output:
+        start = time.monotonic()
+        success, failed, has_error = asyncio.run(
+            client.pdf2file_back(paths, output_path=output, output_format="md")
+        )
+        makespan = time.monotonic() - start
+    pages = sum(f.pages for f in server.files.values() if f.error is None)
+    print(
+        json.dumps(
+            {
+                "files": len(paths),
+                "failed": sum(1 for f in failed if f["path"]),
+                "pages": pages,
+                "makespan": round(makespan, 2),
+                "pages_per_second": round(pages / makespan, 1),
+                "rss_mb": round(peak_rss_mb() - base, 1),
+                **server.stats(),
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", default="100,1000", help="Batch sizes to run")
+    parser.add_argument("--pages", default="1-20", help="Page count range per file")
+    parser.add_argument("--page-seconds", type=float, default=0.02)
+    parser.add_argument("--convert-seconds", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.01, help="API latency")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Latency spread")
+    parser.add_argument("--capacity", type=int, default=1000, help="Pages in flight")
+    parser.add_argument("--rps", type=float, default=0, help="API rate limit")
+    parser.add_argument("--keys", type=int, default=1, help="API keys to shard over")
+    parser.add_argument("--thread", type=int, default=20, help="Files per key")
+    parser.add_argument("--poll-rps", type=float, default=10)
+    parser.add_argument("--poll", type=float, default=0, help="Fixed poll interval")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--folder", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sizes = [int(n) for n in args.files.split(",")]
+
+    if args.child:
+        paths = [os.path.join(args.folder, f"file{i}.pdf") for i in range(sizes[0])]
+        child(args, paths)
+        return
+
+    low, high = (int(n) for n in args.pages.split("-"))
+    with tempfile.TemporaryDirectory() as folder:
+        synthetic_pdfs(folder, max(sizes), pages=(low, high))
+        options = [
+            f"--{name.replace('_', '-')}={value}"
+            for name, value in vars(args).items()
+            if name not in ("files", "child", "folder")
+        ]
+        for size in sizes:
+            out = subprocess.run(
+                [sys.executable, __file__, *options, f"--files={size}"]
+                + ["--child", "--folder", folder],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            print(out.stdout.strip().splitlines()[-1], flush=True)
+
+
+if __name__ == "__main__":
+    main()
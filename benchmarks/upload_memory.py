@@ -0,0 +1,114 @@
+"""Peak memory of a PDF upload, whole-file read vs. streamed from disk.
+
+Each mode runs in a fresh interpreter so the peak RSS (`ru_maxrss`) of one does
+not hide the other. No network is used, the server is a transport which drains
+the request body.
+
+    python benchmarks/upload_memory.py --size 200 --uploads 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import httpx
+
+
+class DrainTransport(httpx.AsyncBaseTransport):
+    """Consume the request body chunk by chunk and answer like the Doc2X API"""
+
+    def __init__(self):
+        self.received = 0
+
+    async def handle_async_request(self, request):
+        async for chunk in request.stream:
+            self.received += len(chunk)
+        return httpx.Response(200, json={"code": "success", "data": {"uid": "bench"}})
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+async def upload(mode: str, path: str, uploads: int, chunk_size: int) -> int:
+    from pdfdeal.Doc2X.ConvertV2 import upload_pdf
+
+    transport = DrainTransport()
+    async with httpx.AsyncClient(transport=transport) as client:
+
+        async def read_whole():
+            # The behaviour before streaming uploads
+            with open(path, "rb") as f:
+                file = f.read()
+            await client.post("https://bench/v2/parse/pdf", content=file)
+
+        async def streamed():
+            await upload_pdf(
+                "sk-bench", path, "never", client=client, chunk_size=chunk_size
+            )
+
+        job = read_whole if mode == "read" else streamed
+        await asyncio.gather(*[job() for _ in range(uploads)])
+    return transport.received
+
+
+def child(mode: str, path: str, uploads: int, chunk_size: int):
+    base = peak_rss_mb()
+    received = asyncio.run(upload(mode, path, uploads, chunk_size))
+    print(
+        json.dumps({"mode": mode, "received": received, "rss_mb": peak_rss_mb() - base})
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=200, help="File size in MB")
+    parser.add_argument("--uploads", type=int, default=4, help="Concurrent uploads")
+    parser.add_argument("--chunk", type=int, default=1024 * 1024, help="Chunk size")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.path, args.uploads, args.chunk)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "big.pdf")
+        with open(path, "wb") as f:
+            for _ in range(args.size):
+                f.write(os.urandom(1024 * 1024))
+        for mode in ["read", "stream"]:
+            out = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--child",
+                    mode,
+                    "--path",
+                    path,
+                    "--uploads",
+                    str(args.uploads),
+                    "--chunk",
+                    str(args.chunk),
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            print(
+                f"{mode:>6}: {args.uploads} x {args.size}MB uploaded, "
+                f"peak RSS +{result['rss_mb']:.1f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
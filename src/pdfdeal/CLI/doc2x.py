@@ -1,11 +1,80 @@
 import argparse
 import os
-from pdfdeal import Doc2X
+import sys
+
+
+def serve_main(argv):
+    """`doc2x serve`: convert the jobs submitted to a local HTTP API until stopped"""
+    parser = argparse.ArgumentParser(
+        prog="doc2x serve",
+        description="Run a conversion worker with a durable job queue and a local HTTP API",
+    )
+    parser.add_argument(
+        "-k",
+        "--api_key",
+        help="The API key of Doc2X, several keys can be separated by commas, if not set, will use the global setting",
+        required=False,
+    )
+    parser.add_argument(
+        "--root",
+        help="The folder of the job queue, outputs and uploaded files, default is './doc2x-serve'",
+        default="./doc2x-serve",
+    )
+    parser.add_argument(
+        "--host",
+        help="The address to listen on, default is 127.0.0.1, the API has no authentication",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--port", help="The port to listen on, default is 8765", type=int, default=8765
+    )
+    parser.add_argument(
+        "--max_jobs",
+        help="The number of jobs converted at the same time, default is 100",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--thread",
+        help="The thread limit of request, DO NOT set if you don't know",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "--max_pages",
+        help="The maximum number of pages to process at same time, default is 1000, DO NOT set if you don't know",
+        type=int,
+        default=1000,
+    )
+    args = parser.parse_args(argv)
+
+    api_key = args.api_key or os.getenv("DOC2X_APIKEY")
+    if not api_key:
+        parser.error("No API key, set --api_key or DOC2X_APIKEY")
+
+    import logging
+
+    from pdfdeal import Doc2X
+    from pdfdeal.Doc2X.Serve import serve
+
+    logging.getLogger("pdfdeal.serve").addHandler(logging.StreamHandler())
+    logging.getLogger("pdfdeal.serve").setLevel(logging.INFO)
+    Client = Doc2X(apikey=api_key, thread=args.thread, max_pages=args.max_pages)
+    serve(
+        Client,
+        root=args.root,
+        host=args.host,
+        port=args.port,
+        max_jobs=args.max_jobs,
+    )
 
 
 def main():
+    if sys.argv[1:2] == ["serve"]:
+        return serve_main(sys.argv[2:])
     parser = argparse.ArgumentParser(
-        description="Using doc2x to deal with pictures or pdfs"
+        description="Using doc2x to deal with pictures or pdfs",
+        epilog="Run `doc2x serve --help` for the long-running worker with a job queue.",
     )
     parser.add_argument("filename", help="PDF file/folder", nargs="?")
     parser.add_argument(
@@ -87,6 +156,8 @@ def main():
 
     format = args.format if args.format else "md_dollar"
 
+    from pdfdeal import Doc2X
+
     Client = Doc2X(apikey=api_key, thread=thread, max_pages=max_pages, debug=True)
 
     if args.graphrag:
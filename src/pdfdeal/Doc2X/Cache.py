@@ -0,0 +1,265 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import List, Optional, Tuple, Union
+
+from .ConvertV2 import reserve_path
+
+logger = logging.getLogger("pdfdeal.cache")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def default_cache_dir() -> str:
+    return os.path.join(os.path.expanduser("~"), ".cache", "pdfdeal", "results")
+
+
+def file_digest(pdf_path: str, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """The SHA-256 of a file, read in chunks"""
+    sha = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ResultCache:
+    """Content-addressed on-disk cache of parse results and downloaded files.
+
+    Entries are keyed by the SHA-256 of the PDF bytes and the `convert` flag. The
+    texts and locations are stored as gzip compressed JSON, converted files (already
+    zip or docx archives) are stored as they are. An sqlite index keeps the size and
+    last use of each entry, the least recently used entries are evicted once the
+    cache grows over `max_size` bytes.
+
+    All methods block on disk I/O, call them from an executor inside the event loop.
+    """
+
+    def __init__(self, cache_dir: str = None, max_size: int = 2 * 1024**3) -> None:
+        """
+        Args:
+            cache_dir (str, optional): Where to keep the cache. Defaults to `~/.cache/pdfdeal/results`.
+            max_size (int, optional): The maximum size of the cache in bytes. Defaults to 2GB.
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(self.cache_dir, "index.sqlite"), check_same_thread=False
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(pdf_path: str, convert: bool, digest: str = None) -> str:
+        """The cache key of a file
+
+        Args:
+            pdf_path (str): The pdf file path
+            convert (bool): The `convert` flag the file is parsed with
+            digest (str, optional): The SHA-256 of the file if already known. Defaults to None.
+
+        Returns:
+            str: The key
+        """
+        return f"{digest or file_digest(pdf_path)}-{int(bool(convert))}"
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _artifact_path(self, key: str, fmt: str) -> str:
+        return os.path.join(self._entry_dir(key), f"artifact.{fmt}")
+
+    def _touch(self, key: str) -> None:
+        size = 0
+        entry_dir = self._entry_dir(key)
+        for name in os.listdir(entry_dir):
+            size += os.path.getsize(os.path.join(entry_dir, name))
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries (key, size, last_used) VALUES (?, ?, ?)",
+            (key, size, time.time()),
+        )
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, List[str], List[dict]]]:
+        """Look up the parse result of a file, counting a hit or a miss
+
+        Args:
+            key (str): The key from `key()`
+
+        Returns:
+            Optional[Tuple[str, List[str], List[dict]]]: The uid, texts and locations, or None if not cached
+        """
+        entry = self.lookup(key)
+        return None if entry is None else entry[:3]
+
+    def lookup(
+        self, key: str
+    ) -> Optional[Tuple[str, List[str], List[dict], Optional[list]]]:
+        """Like `get`, with the ids of the API keys which uploaded the uid
+
+        Returns:
+            Optional[Tuple[str, List[str], List[dict], Optional[list]]]: The uid, texts, locations and key ids (None if not stored), or None if not cached
+        """
+        with self._lock:
+            try:
+                with gzip.open(
+                    os.path.join(self._entry_dir(key), "result.json.gz"), "rt"
+                ) as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping broken cache entry {key}: {e}")
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+            self.hits += 1
+            return data["uid"], data["texts"], data["locations"], data.get("keys")
+
+    def put(
+        self,
+        key: str,
+        uid: str,
+        texts: List[str],
+        locations: List[dict],
+        key_ids: Union[str, List[str]] = None,
+    ) -> None:
+        """Store the parse result of a file
+
+        Args:
+            key (str): The key from `key()`
+            uid (str): The uid of the file
+            texts (List[str]): The texts of each page
+            locations (List[dict]): The locations of each page
+            key_ids (str | List[str], optional): The ids of the API keys which uploaded the uid, a uid only converts with its own key. Defaults to None.
+        """
+        with self._lock:
+            entry_dir = self._entry_dir(key)
+            os.makedirs(entry_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(suffix=".part", dir=entry_dir)
+            data = {"uid": uid, "texts": texts, "locations": locations}
+            if key_ids is not None:
+                data["keys"] = key_ids
+            try:
+                with gzip.open(os.fdopen(fd, "wb"), "wt") as f:
+                    json.dump(data, f)
+                os.replace(temp_path, os.path.join(entry_dir, "result.json.gz"))
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            self._touch(key)
+            self._evict()
+
+    def put_artifact(self, key: str, fmt: str, file_path: str) -> None:
+        """Keep a copy of a converted file, the parse result must be cached already
+
+        Args:
+            key (str): The key from `key()`
+            fmt (str): The output format the file was converted to
+            file_path (str): The downloaded file
+        """
+        with self._lock:
+            entry_dir = self._entry_dir(key)
+            if not os.path.isdir(entry_dir):
+                return
+            fd, temp_path = tempfile.mkstemp(suffix=".part", dir=entry_dir)
+            os.close(fd)
+            try:
+                shutil.copyfile(file_path, temp_path)
+                os.replace(temp_path, self._artifact_path(key, fmt))
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            self._touch(key)
+            self._evict()
+
+    def restore_artifact(
+        self, key: str, fmt: str, output_path: str, output_name: str
+    ) -> Optional[str]:
+        """Copy a cached converted file to the output folder, named like `download_file` would
+
+        Args:
+            key (str): The key from `key()`
+            fmt (str): The output format
+            output_path (str): The output folder
+            output_name (str): The file name, can include subdirectories
+
+        Returns:
+            Optional[str]: The path of the copied file, or None if the format is not cached
+        """
+        with self._lock:
+            source = self._artifact_path(key, fmt)
+            if not os.path.exists(source):
+                return None
+            target_path = os.path.join(output_path, output_name)
+            target_dir = os.path.dirname(target_path)
+            os.makedirs(target_dir, exist_ok=True)
+            file_path = reserve_path(
+                target_dir,
+                os.path.splitext(os.path.basename(target_path))[0],
+                "docx" if fmt == "docx" else "zip",
+            )
+            shutil.copyfile(source, file_path)
+            self._db.execute(
+                "UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+            return file_path
+
+    def invalidate(self, key: str) -> None:
+        """Drop an entry, e.g. once its uid is no longer known to the server"""
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._db.commit()
+
+    @property
+    def size(self) -> int:
+        """The total size of the cached entries in bytes"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()[0]
+
+    def _evict(self) -> None:
+        total = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        if total <= self.max_size:
+            return
+        for key, size in self._db.execute(
+            "SELECT key, size FROM entries ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_size:
+                break
+            logger.debug(f"Evicting cache entry {key} ({size} bytes)")
+            self._remove(key)
+            total -= size
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -1,25 +1,136 @@
+import asyncio
 import httpx
 import json
 import os
 import re
+import tempfile
+import zipfile
+from contextlib import asynccontextmanager
 from typing import Tuple
-from .Exception import RateLimit, FileError, RequestError, async_retry, code_check
+from .Exception import RateLimit, FileError, RequestError, code_check
+from .Retry import parse_retry_after, retried
+from .Stats import record_bytes, timed
+from .Trace import annotate, traced
 import logging
 from .Types import OutputFormat
 
 Base_URL = "https://v2.doc2x.noedgeai.com/api"
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# Fenced code blocks, code spans and escaped backslashes, kept as they are, or a formula delimiter
+FORMULA_DELIMITER = re.compile(
+    r"^ {0,3}(?P<fence>`{3,}|~{3,})[^\n]*\n.*?(?:^ {0,3}(?P=fence)[^\n]*$|\Z)"
+    r"|(?P<ticks>`+)(?!`)(?:(?!\n[ \t]*\n).)+?(?<!`)(?P=ticks)(?!`)"
+    r"|\\\\"
+    r"|\\(?P<delimiter>[()\[\]])",
+    re.MULTILINE | re.DOTALL,
+)
+
 logger = logging.getLogger("pdfdeal.convertV2")
 
 
-@async_retry(timeout=200)
-async def upload_pdf(apikey: str, pdffile: str, oss_choose: str = "always") -> str:
+def new_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 30,
+    base_url: str = Base_URL,
+    transport: httpx.AsyncBaseTransport = None,
+) -> httpx.AsyncClient:
+    """Create a connection-pooled HTTP/2 client which can be shared by all API calls
+
+    Args:
+        max_connections (int, optional): The maximum number of concurrent connections. Defaults to 100.
+        max_keepalive_connections (int, optional): The maximum number of idle connections kept in the pool. Defaults to 20.
+        keepalive_expiry (float, optional): Seconds an idle connection is kept alive. Defaults to 30.
+        base_url (str, optional): The root of the v2 API, the API calls use paths relative to it. Defaults to `Base_URL`.
+        transport (httpx.AsyncBaseTransport, optional): Send the requests through this transport instead of the network, e.g. a mock server. Defaults to None.
+
+    Returns:
+        httpx.AsyncClient: The client, the caller is responsible for closing it
+    """
+    return httpx.AsyncClient(
+        base_url=base_url,
+        transport=transport,
+        timeout=httpx.Timeout(120),
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+    )
+
+
+@asynccontextmanager
+async def use_client(client: httpx.AsyncClient = None, timeout: float = 120):
+    """Yield the shared client if given, otherwise a temporary one closed on exit"""
+    if client is not None:
+        yield client
+        return
+    async with httpx.AsyncClient(
+        base_url=Base_URL, timeout=httpx.Timeout(timeout), http2=True
+    ) as temp_client:
+        yield temp_client
+
+
+def open_pdf(pdffile: str):
+    """Open the pdf file for a streaming upload
+
+    Args:
+        pdffile (str): The pdf file path
+
+    Raises:
+        FileError: Open file error
+
+    Returns:
+        Tuple[BinaryIO, int]: The opened file and its exact size in bytes
+    """
+    try:
+        file = open(pdffile, "rb")
+    except Exception as e:
+        raise FileError(f"Open file error! {e}")
+    return file, os.fstat(file.fileno()).st_size
+
+
+async def iter_file(file, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """Read the opened file chunk by chunk off the event loop, so only one chunk is held in memory"""
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(None, file.read, chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def check_throttled(response: httpx.Response, trace_id: str = None) -> None:
+    """Raise `RateLimit` with the wait the server asked for if `response` is an HTTP 429"""
+    if response.status_code == 429:
+        raise RateLimit(
+            trace_id=trace_id,
+            retry_after=parse_retry_after(response.headers.get("retry-after")),
+        )
+
+
+@retried("upload")
+@traced("api.upload_pdf")
+async def upload_pdf(
+    apikey: str,
+    pdffile: str,
+    oss_choose: str = "always",
+    client: httpx.AsyncClient = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    slot: Tuple[str, str] = None,
+) -> str:
     """Upload pdf file to server and return the uid of the file
 
     Args:
         apikey (str): The key
         pdffile (str): The pdf file path
         oss_choose (str, optional): OSS upload preference. "always" for always using OSS, "auto" for using OSS only when the file size exceeds 100MB, "never" for never using OSS. Defaults to "always".
+        client (httpx.AsyncClient, optional): The shared client, a temporary one is used if not given. Defaults to None.
+        chunk_size (int, optional): The size of each chunk read from disk while streaming the file. Defaults to 1MB.
+        slot (Tuple[str, str], optional): A prefetched OSS upload slot, only used when uploading through OSS. Defaults to None.
 
     Raises:
         FileError: Input file size is too large
@@ -30,41 +141,43 @@ async def upload_pdf(apikey: str, pdffile: str, oss_choose: str = "always") -> s
     Returns:
         str: The uid of the file
     """
-    url = f"{Base_URL}/v2/parse/pdf"
+    url = "/v2/parse/pdf"
     if oss_choose == "always" or (
         oss_choose == "auto" and os.path.getsize(pdffile) >= 100 * 1024 * 1024
     ):
-        return await upload_pdf_big(apikey, pdffile)
+        return await upload_pdf_big(
+            apikey, pdffile, client=client, chunk_size=chunk_size, slot=slot
+        )
     elif oss_choose == "none" and os.path.getsize(pdffile) >= 100 * 1024 * 1024:
         logger.warning("Now not support PDF file > 300MB!")
         raise RequestError("parse_file_too_large")
-    try:
-        with open(pdffile, "rb") as f:
-            file = f.read()
-    except Exception as e:
-        raise FileError(f"Open file error! {e}")
-
-    async with httpx.AsyncClient(timeout=httpx.Timeout(120), http2=True) as client:
-        post_res = await client.post(
-            url,
-            headers={
-                "Authorization": f"Bearer {apikey}",
-                "Content-Type": "application/pdf",
-            },
-            content=file,
-        )
+    file, size = open_pdf(pdffile)
+    with file:
+        async with use_client(client, 120) as client:
+            post_res = await client.post(
+                url,
+                headers={
+                    "Authorization": f"Bearer {apikey}",
+                    "Content-Type": "application/pdf",
+                    "Content-Length": str(size),
+                },
+                content=iter_file(file, chunk_size),
+                timeout=httpx.Timeout(120),
+            )
+    record_bytes(sent=size)
     trace_id = post_res.headers.get("trace-id", "Failed to get trace-id ")
+    annotate(trace_id=trace_id, status=post_res.status_code, bytes=size)
     if post_res.status_code == 200:
         response_data = json.loads(post_res.content.decode("utf-8"))
         uid = response_data.get("data", {}).get("uid")
+        annotate(uid=uid)
 
         await code_check(
             code=response_data.get("code", response_data), uid=uid, trace_id=trace_id
         )
         return uid
 
-    if post_res.status_code == 429:
-        raise RateLimit(trace_id=trace_id)
+    check_throttled(post_res, trace_id)
     if post_res.status_code == 400:
         raise RequestError(error_code=post_res.text, trace_id=trace_id)
     elif post_res.status_code == 401:
@@ -74,60 +187,47 @@ async def upload_pdf(apikey: str, pdffile: str, oss_choose: str = "always") -> s
     )
 
 
-async def upload_pdf_big(apikey: str, pdffile: str) -> str:
-    """Upload big pdf file to server and return the uid of the file
+@retried("preupload")
+@traced("api.preupload")
+async def preupload(
+    apikey: str, filename: str, client: httpx.AsyncClient = None
+) -> Tuple[str, str]:
+    """Request a presigned OSS upload slot for a file
 
     Args:
         apikey (str): The key
-        pdffile (str): The pdf file path
+        filename (str): The name of the file to upload
+        client (httpx.AsyncClient, optional): The shared client, a temporary one is used if not given. Defaults to None.
 
     Raises:
-        FileError: Input file size is too large
-        FileError: Open file error
         RateLimit: Rate limit exceeded
-        Exception: Upload file error
+        RequestError: Failed to create the upload task
+        Exception: Request error
 
     Returns:
-        str: The uid of the file
+        Tuple[str, str]: The uid of the file and the presigned upload url
     """
-    if os.path.getsize(pdffile) >= 1024 * 1024 * 1024:
-        logger.warning("Not support PDF file > 1GB!")
-        raise RequestError("parse_file_too_large")
-    try:
-        file = {"file": open(pdffile, "rb")}
-    except Exception as e:
-        raise FileError(f"Open file error! {e}")
-
-    url = f"{Base_URL}/v2/parse/preupload"
-    filename = os.path.basename(pdffile)
-
-    async with httpx.AsyncClient(timeout=httpx.Timeout(15), http2=True) as client:
+    url = "/v2/parse/preupload"
+    async with use_client(client, 15) as client:
         post_res = await client.post(
             url,
             headers={"Authorization": f"Bearer {apikey}"},
             json={"file_name": filename},
+            timeout=httpx.Timeout(15),
         )
     trace_id = post_res.headers.get("trace-id")
+    annotate(trace_id=trace_id, status=post_res.status_code)
     if post_res.status_code == 200:
         response_data = json.loads(post_res.content.decode("utf-8"))
         uid = response_data.get("data", {}).get("uid")
+        annotate(uid=uid)
         await code_check(
             code=response_data.get("code", response_data),
             uid=uid,
             trace_id=trace_id,
         )
-        upload_data = response_data["data"]
-        upload_url = upload_data["url"]
-
-        async with httpx.AsyncClient(timeout=httpx.Timeout(180), http2=True) as client:
-            s3_res = await client.put(
-                url=upload_url,
-                files=file,
-            )
-        if s3_res.status_code == 200:
-            return uid
-        else:
-            raise Exception(f"Upload file to OSS error! {s3_res.text}")
+        return uid, response_data["data"]["url"]
+    check_throttled(post_res, trace_id)
     if post_res.status_code == 400:
         raise RequestError(error_code=post_res.text, trace_id=trace_id)
     elif post_res.status_code == 401:
@@ -137,6 +237,88 @@ async def upload_pdf_big(apikey: str, pdffile: str) -> str:
     )
 
 
+@retried("put_oss")
+@traced("api.put_oss")
+async def put_oss(
+    upload_url: str,
+    pdffile: str,
+    client: httpx.AsyncClient,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> httpx.Response:
+    """Stream the file to a presigned OSS url"""
+    file, size = open_pdf(pdffile)
+    with file:
+        response = await client.put(
+            url=upload_url,
+            headers={"Content-Length": str(size)},
+            content=iter_file(file, chunk_size),
+            timeout=httpx.Timeout(180),
+        )
+    record_bytes(sent=size)
+    annotate(status=response.status_code, bytes=size)
+    return response
+
+
+async def upload_pdf_big(
+    apikey: str,
+    pdffile: str,
+    client: httpx.AsyncClient = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    slot: Tuple[str, str] = None,
+) -> str:
+    """Upload big pdf file to server and return the uid of the file
+
+    Args:
+        apikey (str): The key
+        pdffile (str): The pdf file path
+        client (httpx.AsyncClient, optional): The shared client, a temporary one is used if not given. Defaults to None.
+        chunk_size (int, optional): The size of each chunk read from disk while streaming the file. Defaults to 1MB.
+        slot (Tuple[str, str], optional): A prefetched `(uid, url)` from `preupload`, a new one is requested if not given or if it no longer works. Defaults to None.
+
+    Raises:
+        FileError: Input file size is too large
+        FileError: Open file error
+        RateLimit: Rate limit exceeded
+        Exception: Upload file error
+
+    Returns:
+        str: The uid of the file
+    """
+    if os.path.getsize(pdffile) >= 1024 * 1024 * 1024:
+        logger.warning("Not support PDF file > 1GB!")
+        raise RequestError("parse_file_too_large")
+
+    async with use_client(client, 180) as client:
+        if slot is not None:
+            uid, upload_url = slot
+            s3_res = await put_oss(upload_url, pdffile, client, chunk_size)
+            if s3_res.status_code == 200:
+                return uid
+            logger.warning(
+                f"Prefetched upload slot for {pdffile} failed with {s3_res.status_code}, requesting a new one..."
+            )
+
+        uid, upload_url = await preupload(
+            apikey, os.path.basename(pdffile), client=client
+        )
+        s3_res = await put_oss(upload_url, pdffile, client, chunk_size)
+    if s3_res.status_code == 200:
+        return uid
+    raise Exception(f"Upload file to OSS error! {s3_res.text}")
+
+
+def dollar_formula(text: str) -> str:
+    """Replace the \\( \\) and \\[ \\] formula delimiters with $ and $$, outside of code and escaped backslashes"""
+
+    def replace(match: re.Match) -> str:
+        delimiter = match.group("delimiter")
+        if delimiter is None:
+            return match.group(0)
+        return "$" if delimiter in "()" else "$$"
+
+    return FORMULA_DELIMITER.sub(replace, text)
+
+
 async def decode_data(data: dict, convert: bool) -> Tuple[list, list]:
     """Decode the data
 
@@ -156,8 +338,7 @@ async def decode_data(data: dict, convert: bool) -> Tuple[list, list]:
     for page in data["result"]["pages"]:
         text = page.get("md", "")
         if convert:
-            text = re.sub(r"\\[()]", "$", text)
-            text = re.sub(r"\\[\[\]]", "$$", text)
+            text = dollar_formula(text)
         texts.append(text)
         locations.append(
             {
@@ -170,11 +351,13 @@ async def decode_data(data: dict, convert: bool) -> Tuple[list, list]:
     return texts, locations
 
 
-@async_retry()
+@retried("status")
+@traced("api.uid_status")
 async def uid_status(
     apikey: str,
     uid: str,
     convert: bool = False,
+    client: httpx.AsyncClient = None,
 ) -> Tuple[int, str, list, list]:
     """Get the status of the file
 
@@ -182,6 +365,7 @@ async def uid_status(
         apikey (str): The key
         uid (str): The uid of the file
         convert (bool, optional): Convert "[" and "[[" to "$" and "$$" or not. Defaults to False.
+        client (httpx.AsyncClient, optional): The shared client, a temporary one is used if not given. Defaults to None.
 
     Raises:
         RequestError: Failed to deal with file
@@ -190,12 +374,16 @@ async def uid_status(
     Returns:
         Tuple[int, str, list, list]: The progress, status, texts and locations
     """
-    url = f"{Base_URL}/v2/parse/status?uid={uid}"
-    async with httpx.AsyncClient(timeout=httpx.Timeout(30), http2=True) as client:
+    url = f"/v2/parse/status?uid={uid}"
+    async with use_client(client, 30) as client:
         response_data = await client.get(
-            url, headers={"Authorization": f"Bearer {apikey}"}
+            url,
+            headers={"Authorization": f"Bearer {apikey}"},
+            timeout=httpx.Timeout(30),
         )
     trace_id = response_data.headers.get("trace-id", "Failed to get trace-id ")
+    annotate(trace_id=trace_id, status=response_data.status_code)
+    check_throttled(response_data, trace_id)
     if response_data.status_code != 200:
         raise Exception(
             f"Get status error! Trace-id:{trace_id}:{response_data.status_code}:{response_data.text}"
@@ -227,9 +415,14 @@ async def uid_status(
         return progress, status, [], []
 
 
-@async_retry()
+@retried("convert")
+@traced("api.convert_parse")
 async def convert_parse(
-    apikey: str, uid: str, to: str, filename: str = None
+    apikey: str,
+    uid: str,
+    to: str,
+    filename: str = None,
+    client: httpx.AsyncClient = None,
 ) -> Tuple[str, str]:
     """Convert parsed file to specified format
 
@@ -238,6 +431,7 @@ async def convert_parse(
         uid (str): The uid of the parsed file
         to (str): Export format, supports: md|tex|docx|md_dollar
         filename (str, optional): Output filename for md/tex (without extension). Defaults to None.
+        client (httpx.AsyncClient, optional): The shared client, a temporary one is used if not given. Defaults to None.
 
     Raises:
         ValueError: If 'to' is not a valid format
@@ -247,7 +441,7 @@ async def convert_parse(
     Returns:
         Tuple[str, str]: A tuple containing the status and URL of the converted file
     """
-    url = f"{Base_URL}/v2/convert/parse"
+    url = "/v2/convert/parse"
 
     to = OutputFormat(to)
     if isinstance(to, OutputFormat):
@@ -259,11 +453,16 @@ async def convert_parse(
     if to == "md_dollar":
         payload["formula_mode"] = "dollar"
         payload["to"] = "md"
-    async with httpx.AsyncClient(timeout=httpx.Timeout(30), http2=True) as client:
+    async with use_client(client, 30) as client:
         response_data = await client.post(
-            url, json=payload, headers={"Authorization": f"Bearer {apikey}"}
+            url,
+            json=payload,
+            headers={"Authorization": f"Bearer {apikey}"},
+            timeout=httpx.Timeout(30),
         )
     trace_id = response_data.headers.get("trace-id", "Failed to get trace-id ")
+    annotate(trace_id=trace_id, status=response_data.status_code, format=to)
+    check_throttled(response_data, trace_id)
     if response_data.status_code != 200:
         raise Exception(
             f"Conversion request failed: Trace-id:{trace_id}:{response_data.status_code}:{response_data.text}"
@@ -285,13 +484,17 @@ async def convert_parse(
         )
 
 
-@async_retry()
-async def get_convert_result(apikey: str, uid: str) -> Tuple[str, str]:
+@retried("result")
+@traced("api.get_convert_result")
+async def get_convert_result(
+    apikey: str, uid: str, client: httpx.AsyncClient = None
+) -> Tuple[str, str]:
     """Get the result of a conversion task
 
     Args:
         apikey (str): The API key
         uid (str): The uid of the conversion task
+        client (httpx.AsyncClient, optional): The shared client, a temporary one is used if not given. Defaults to None.
 
     Raises:
         RequestError: If the request fails
@@ -300,15 +503,20 @@ async def get_convert_result(apikey: str, uid: str) -> Tuple[str, str]:
     Returns:
         Tuple[str, str]: A tuple containing the status and URL of the converted file
     """
-    url = f"{Base_URL}/v2/convert/parse/result"
+    url = "/v2/convert/parse/result"
 
     params = {"uid": uid}
 
-    async with httpx.AsyncClient(timeout=httpx.Timeout(30), http2=True) as client:
+    async with use_client(client, 30) as client:
         response = await client.get(
-            url, params=params, headers={"Authorization": f"Bearer {apikey}"}
+            url,
+            params=params,
+            headers={"Authorization": f"Bearer {apikey}"},
+            timeout=httpx.Timeout(30),
         )
     trace_id = response.headers.get("trace-id", "Failed to get trace-id ")
+    annotate(trace_id=trace_id, status=response.status_code)
+    check_throttled(response, trace_id)
     if response.status_code != 200:
         raise Exception(
             f"Get conversion result failed: Trace-id:{trace_id}:{response.status_code}:{response.text}"
@@ -329,9 +537,40 @@ async def get_convert_result(apikey: str, uid: str) -> Tuple[str, str]:
         )
 
 
-@async_retry()
+def reserve_path(target_dir: str, filename: str, file_type: str) -> str:
+    """Claim a file name which is not used yet, adding `_1`, `_2`... if needed
+
+    The name is created with `O_EXCL`, so concurrent tasks (or processes) never get the same path.
+
+    Args:
+        target_dir (str): The folder of the file
+        filename (str): The file name without extension
+        file_type (str): The file extension
+
+    Returns:
+        str: The full path of the reserved (empty) file
+    """
+    counter = 0
+    while True:
+        suffix = f"_{counter}" if counter else ""
+        file_path = os.path.join(target_dir, f"{filename}{suffix}.{file_type}")
+        try:
+            fd = os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            counter += 1
+            continue
+        os.close(fd)
+        return file_path
+
+
+@retried("download")
+@traced("api.download")
 async def download_file(
-    url: str, file_type: str, target_folder: str, target_filename: str
+    url: str,
+    file_type: str,
+    target_folder: str,
+    target_filename: str,
+    client: httpx.AsyncClient = None,
 ) -> str:
     """
     Download a file from the given URL to the specified target folder with the given filename.
@@ -341,6 +580,7 @@ async def download_file(
         file_type (str): The type of file being downloaded (e.g., 'zip', 'docx').
         target_folder (str): The folder where the file should be saved.
         target_filename (str): The desired filename for the downloaded file, can include subdirectories.
+        client (httpx.AsyncClient, optional): The shared client, a temporary one is used if not given. Defaults to None.
 
     Raises:
         Exception: If there's an error creating the target folder or downloading the file.
@@ -356,16 +596,66 @@ async def download_file(
     filename = os.path.splitext(filename)[0]
     if file_type != "docx":
         file_type = "zip"
-    file_path = os.path.join(target_dir, f"{filename}.{file_type}")
-    counter = 1
-    while os.path.exists(file_path):
-        file_path = os.path.join(target_dir, f"{filename}_{counter}.{file_type}")
-        counter += 1
-
-    async with httpx.AsyncClient(timeout=httpx.Timeout(60), http2=True) as client:
-        response = await client.get(url)
-        response.raise_for_status()
-        with open(file_path, "wb") as f:
-            f.write(response.content)
 
+    # Stream into a hidden temp file next to the target, so the final rename is atomic
+    fd, temp_path = tempfile.mkstemp(
+        prefix=f".{filename}.", suffix=".part", dir=target_dir
+    )
+    received = 0
+    try:
+        with timed("download"), os.fdopen(fd, "wb") as f:
+            async with use_client(client, 60) as client:
+                async with client.stream(
+                    "GET", url, timeout=httpx.Timeout(60)
+                ) as response:
+                    check_throttled(response)
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        received += len(chunk)
+        record_bytes(received=received)
+        annotate(bytes=received)
+        file_path = reserve_path(target_dir, filename, file_type)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return file_path
+
+
+def md_to_dollar(md_zip: str, target_folder: str, target_filename: str) -> str:
+    """Make the `md_dollar` zip from the `md` zip of the same file, without another conversion
+
+    Args:
+        md_zip (str): The zip downloaded for the `md` format
+        target_folder (str): The folder where the file should be saved.
+        target_filename (str): The desired filename, can include subdirectories.
+
+    Returns:
+        str: The full path of the new zip
+    """
+    target_path = os.path.join(target_folder, target_filename)
+    target_dir = os.path.dirname(target_path)
+    filename = os.path.splitext(os.path.basename(target_path))[0]
+    os.makedirs(target_dir, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(
+        prefix=f".{filename}.", suffix=".part", dir=target_dir
+    )
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(md_zip) as source:
+            with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as target:
+                for info in source.infolist():
+                    data = source.read(info)
+                    if info.filename.endswith(".md"):
+                        data = dollar_formula(data.decode("utf-8")).encode("utf-8")
+                    target.writestr(info, data)
+        file_path = reserve_path(target_dir, filename, "zip")
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
     return file_path
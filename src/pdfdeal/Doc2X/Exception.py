@@ -1,15 +1,20 @@
 import asyncio
+import atexit
+import concurrent.futures
 from functools import wraps
+import os
 import time
+import queue
 import sys
+import threading
+import weakref
 from concurrent.futures import ThreadPoolExecutor
 import logging
-from httpx import RemoteProtocolError, ConnectError, ConnectTimeout
 
 
 async def code_check(code: str, uid: str = None, trace_id: str = None):
     if code in ["parse_page_limit_exceeded", "parse_concurrency_limit"]:
-        raise RateLimit(trace_id=trace_id)
+        raise RateLimit(trace_id=trace_id, code=code)
     if code in RequestError.ERROR_CODES:
         raise RequestError(code, uid=uid, trace_id=trace_id)
     if code == "unauthorized":
@@ -21,10 +26,16 @@ async def code_check(code: str, uid: str = None, trace_id: str = None):
 class RateLimit(Exception):
     """
     Error when rate limit is reached.
+    `retry_after`: Seconds the server asked to wait, from the `Retry-After` header.
+    `code`: The capacity code if the API refused the task, None for an HTTP 429.
     """
 
-    def __init__(self, trace_id: str = None):
+    def __init__(
+        self, trace_id: str = None, retry_after: float = None, code: str = None
+    ):
         self.trace_id = trace_id
+        self.retry_after = retry_after
+        self.code = code
         super().__init__()
 
     def __str__(self):
@@ -95,72 +106,22 @@ def async_retry(max_retries=2, backoff_factor=2, timeout=60):
     """
     Decorator to retry an async function when an exception is raised.
     `max_retries`: Maximum number of retries.
-    `backoff_factor`: Factor to increase the wait time between retries.
+    `backoff_factor`: Factor to increase the longest wait between retries, the waits are jittered.
     `timeout`: Timeout in seconds for each function call.
-    """
 
-    def decorator(func):
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            for retries in range(max_retries + 1):
-                try:
-                    return await asyncio.wait_for(
-                        func(*args, **kwargs), timeout=timeout
-                    )
-                except asyncio.TimeoutError:
-                    if retries == max_retries:
-                        logging.exception(
-                            f"Function '{func.__name__}' timed out after {timeout} seconds"
-                        )
-                        raise
-                    logging.warning(
-                        f"Function '{func.__name__}' timed out, retrying..."
-                    )
-                except (
-                    RateLimit,
-                    FileError,
-                    RequestError,
-                    FileNotFoundError,
-                    ValueError,
-                ) as e:
-                    logging.error(
-                        f"Error in '{func.__name__}': {type(e).__name__} - {e}"
-                    )
-                    raise
-                except (RemoteProtocolError, ConnectError, ConnectTimeout) as e:
-                    if retries == max_retries:
-                        logging.error(
-                            f"Error in '{func.__name__}': {type(e).__name__} - {e}"
-                        )
-                        raise
-                    wait_time = backoff_factor**retries
-                    logging.warning(
-                        f"{type(e).__name__}, this is most likely a network link issue, if this problem occurs frequently check your network environment (e.g. turn off your VPN, check your DNS seeting), will retry in {wait_time} seconds..."
-                    )
-                    await asyncio.sleep(wait_time)
-                except Exception as e:
-                    if isinstance(e, RequestError):
-                        logging.error(str(e))
-                        raise
-                    elif isinstance(e, RateLimit):
-                        raise
-                    elif retries == max_retries:
-                        logging.exception(
-                            f"Error in '{func.__name__}': {type(e).__name__} - {e}"
-                        )
-                        raise
-                    wait_time = backoff_factor**retries
-                    logging.exception(
-                        f"Exception in '{func.__name__}': {type(e).__name__} - {e}"
-                    )
-                    logging.warning(
-                        f"Errors detected that may be resolved by retrying, will retrying in {wait_time} seconds..."
-                    )
-                    await asyncio.sleep(wait_time)
+    Kept for compatibility, the retries go through the retry budget of the running
+    client like `Retry.retried`, which is used by the API calls.
+    """
+    from .Retry import RetryPolicy, retried
 
-        return wrapper
-
-    return decorator
+    policy = RetryPolicy(
+        attempts=max_retries + 1,
+        base=1,
+        cap=max(1, backoff_factor**max_retries),
+        timeout=timeout,
+        throttled=False,
+    )
+    return retried(policy=policy)
 
 
 def nomal_retry(max_retries=3, backoff_factor=2):
@@ -198,8 +159,119 @@ def nomal_retry(max_retries=3, backoff_factor=2):
     return decorator
 
 
-def run_async(coro):
-    """This function is used to run async function in sync way. As `asyncio.run` not work in jupyter notebook.
+class BackgroundLoop:
+    """An event loop running in a daemon thread, shared by the synchronous API
+
+    Coroutines are submitted with `run_coroutine_threadsafe`, so any number of threads can
+    call it at the same time and the connection pools and limiters of the clients survive
+    between calls. Started on first use, closed at exit.
+    """
+
+    def __init__(self, name: str = "pdfdeal-loop") -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        # Objects with an `aclose` coroutine, closed on the loop before it stops
+        self._resources = weakref.WeakSet()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+                thread = threading.Thread(
+                    target=self._run, args=(loop, started), name=self.name, daemon=True
+                )
+                thread.start()
+                started.wait()
+                self._loop, self._thread = loop, thread
+            return self._loop
+
+    @staticmethod
+    def _run(loop, started) -> None:
+        asyncio.set_event_loop(loop)
+        loop.call_soon(started.set)
+        loop.run_forever()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Schedule `coro` on the loop and return a future of its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """Run `coro` on the loop and wait for its result"""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError(
+                "Can not wait for the background loop from inside it, await the coroutine instead."
+            )
+        future = self.submit(coro)
+        try:
+            return future.result()
+        except BaseException:
+            # E.g. KeyboardInterrupt while waiting, do not leave the batch running
+            future.cancel()
+            raise
+
+    def register(self, resource) -> None:
+        """Close `resource` (anything with an `aclose` coroutine) when the loop is closed"""
+        self._resources.add(resource)
+
+    def close(self, timeout: float = 10) -> None:
+        """Close the registered resources, cancel what is left and stop the thread"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+            resources = list(self._resources)
+            self._resources = weakref.WeakSet()
+        if loop is None:
+            return
+
+        async def shutdown():
+            for resource in resources:
+                try:
+                    await resource.aclose()
+                except Exception as e:
+                    logging.warning(f"Failed to close {resource!r}: {e}")
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await loop.shutdown_asyncgens()
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout)
+        except Exception as e:
+            logging.warning(f"Failed to shut down the background loop cleanly: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+
+    def _after_fork(self) -> None:
+        # The thread does not exist in a forked child, start a new one on first use
+        self._lock = threading.Lock()
+        self._loop = self._thread = None
+        self._resources = weakref.WeakSet()
+
+
+_background = BackgroundLoop()
+atexit.register(_background.close)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_background._after_fork)
+
+
+def background_loop() -> BackgroundLoop:
+    """The loop the synchronous API of this process runs on"""
+    return _background
+
+
+def run_in_new_loop(coro):
+    """Run `coro` in a new event loop of its own, also from a jupyter notebook where a loop is already running.
+
+    The legacy V1 client uses it, its batches create their own semaphores and clients
+    for each call and never share a loop.
 
     Args:
         coro (_type_): The function to run.
@@ -220,3 +292,74 @@ def run_async(coro):
                 return future.result()
     # Python
     return asyncio.run(coro)
+
+
+def run_async(coro):
+    """This function is used to run async function in sync way, also from a thread which already runs a loop like a jupyter notebook.
+
+    The coroutine runs on the background loop of the process, see `BackgroundLoop`.
+
+    Args:
+        coro (_type_): The function to run.
+
+    Returns:
+        _type_: The result of the function.
+    """
+    return _background.run(coro)
+
+
+def iter_async(agen):
+    """This function is used to iterate an async generator in sync way, it runs on the background loop of the process.
+
+    Items are handed over one at a time, so the generator is paused while the caller is busy with an item.
+
+    Args:
+        agen (AsyncGenerator): The async generator to iterate.
+
+    Yields:
+        _type_: The items of the generator.
+    """
+    items = queue.Queue(maxsize=1)
+    end = object()
+    finished = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    async def pump():
+        loop = asyncio.get_running_loop()
+        try:
+            async for item in agen:
+                await loop.run_in_executor(executor, items.put, (item, None))
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            await loop.run_in_executor(executor, items.put, (end, e))
+        else:
+            await loop.run_in_executor(executor, items.put, (end, None))
+        finally:
+            await agen.aclose()
+
+    async def start():
+        task = asyncio.ensure_future(pump())
+        task.add_done_callback(lambda _: finished.set())
+        return task
+
+    loop = _background.loop
+    task = asyncio.run_coroutine_threadsafe(start(), loop).result()
+    try:
+        while True:
+            item, error = items.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # The caller stopped early, cancel the generator and unblock a pending hand over
+        if not task.done():
+            loop.call_soon_threadsafe(task.cancel)
+        while not finished.is_set():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        executor.shutdown(wait=False)
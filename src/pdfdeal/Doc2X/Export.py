@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import tempfile
+import zipfile
+from typing import Dict, List
+from urllib.parse import urlparse
+
+import httpx
+
+from .ConvertV2 import dollar_formula, reserve_path, use_client
+
+logger = logging.getLogger("pdfdeal.export")
+
+# ![alt](url) or <img src="url" ...>, only remote images are fetched
+IMAGE_PATTERN = re.compile(
+    r'!\[[^\]]*\]\((https?://[^)\s]+)\)|<img\s[^>]*?src="(https?://[^"]+)"'
+)
+
+LOCAL_FORMATS = ("md", "md_dollar")
+
+
+def render_markdown(texts: List[str], fmt: str = "md") -> str:
+    """Join the markdown of each page into one document
+
+    Args:
+        texts (List[str]): The markdown of each page, as returned by `uid_status`
+        fmt (str, optional): `md` keeps the "\\(" "\\[" delimiters, `md_dollar` uses "$" and "$$". Defaults to "md".
+
+    Returns:
+        str: The markdown document
+    """
+    text = "\n\n".join(texts)
+    return dollar_formula(text) if fmt == "md_dollar" else text
+
+
+def image_name(url: str) -> str:
+    """The file name of a remote image inside `images/`, stable for the same url"""
+    ext = posixpath.splitext(urlparse(url).path)[1] or ".jpg"
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:16] + ext
+
+
+async def fetch_images(
+    text: str, client: httpx.AsyncClient = None, concurrency: int = 8
+) -> Dict[str, bytes]:
+    """Download the remote images referenced by a markdown document
+
+    Args:
+        text (str): The markdown document
+        client (httpx.AsyncClient, optional): The shared client, a temporary one is used if not given. Defaults to None.
+        concurrency (int, optional): The maximum number of images downloaded at the same time. Defaults to 8.
+
+    Returns:
+        Dict[str, bytes]: The content of each image which could be downloaded, by url
+    """
+    urls = []
+    for match in IMAGE_PATTERN.finditer(text):
+        url = match.group(1) or match.group(2)
+        if url not in urls:
+            urls.append(url)
+    if not urls:
+        return {}
+
+    semaphore = asyncio.Semaphore(concurrency)
+    images = {}
+
+    async def fetch(url):
+        async with semaphore:
+            try:
+                response = await client.get(url, timeout=httpx.Timeout(60))
+                response.raise_for_status()
+                images[url] = response.content
+            except Exception as e:
+                logger.warning(f"Failed to fetch image {url}, keeping the link: {e}")
+
+    async with use_client(client, 60) as client:
+        await asyncio.gather(*[fetch(url) for url in urls])
+    return images
+
+
+async def export_markdown(
+    texts: List[str],
+    fmt: str,
+    target_folder: str,
+    target_filename: str,
+    client: httpx.AsyncClient = None,
+    with_images: bool = True,
+) -> str:
+    """Build the `md` / `md_dollar` zip from the parse result, without a server conversion
+
+    The zip has the same layout as the one from `/v2/convert/parse`: `<name>.md` and
+    the referenced images under `images/`. Images which could not be fetched (or all
+    of them if `with_images` is False) keep their remote link.
+
+    Args:
+        texts (List[str]): The markdown of each page, as returned by `uid_status` without `convert`
+        fmt (str): `md` or `md_dollar`
+        target_folder (str): The folder where the file should be saved.
+        target_filename (str): The desired filename, can include subdirectories.
+        client (httpx.AsyncClient, optional): The shared client used to fetch images. Defaults to None.
+        with_images (bool, optional): Fetch the images into the zip. Defaults to True.
+
+    Returns:
+        str: The full path of the zip
+    """
+    if fmt not in LOCAL_FORMATS:
+        raise ValueError(f"{fmt} can not be exported locally")
+    text = render_markdown(texts, fmt)
+    images = await fetch_images(text, client) if with_images else {}
+    for url in images:
+        text = text.replace(url, f"images/{image_name(url)}")
+
+    target_path = os.path.join(target_folder, target_filename)
+    target_dir = os.path.dirname(target_path)
+    filename = os.path.splitext(os.path.basename(target_path))[0]
+    os.makedirs(target_dir, exist_ok=True)
+
+    def write():
+        fd, temp_path = tempfile.mkstemp(
+            prefix=f".{filename}.", suffix=".part", dir=target_dir
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as z:
+                    z.writestr(f"{filename}.md", text)
+                    for url, content in images.items():
+                        z.writestr(f"images/{image_name(url)}", content)
+            file_path = reserve_path(target_dir, filename, "zip")
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return file_path
+
+    return await asyncio.get_running_loop().run_in_executor(None, write)
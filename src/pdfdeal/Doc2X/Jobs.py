@@ -0,0 +1,233 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+STATES = (QUEUED, RUNNING, DONE, FAILED, CANCELLED)
+
+COLUMNS = (
+    "id",
+    "state",
+    "pdf",
+    "output_format",
+    "output_name",
+    "convert",
+    "priority",
+    "deadline",
+    "created",
+    "started",
+    "finished",
+    "attempts",
+    "result",
+    "error",
+)
+
+
+class Job:
+    """One file submitted to the worker, as stored in the queue"""
+
+    __slots__ = COLUMNS
+
+    def __init__(self, *values) -> None:
+        for name, value in zip(COLUMNS, values):
+            setattr(self, name, value)
+        self.convert = bool(self.convert)
+        self.result = json.loads(self.result) if self.result is not None else None
+        self.error = json.loads(self.error) if self.error is not None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in COLUMNS}
+
+
+class JobQueue:
+    """Durable queue of conversion jobs in sqlite.
+
+    Jobs survive a restart of the worker: `recover` puts the jobs which were
+    running back into the queue. Every method is a short transaction, so the
+    queue can be used from the HTTP threads and the worker at the same time.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): The sqlite file, created if missing
+        """
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, state TEXT, pdf TEXT, output_format TEXT, "
+            "output_name TEXT, convert INTEGER, priority INTEGER, deadline REAL, "
+            "created REAL, started REAL, finished REAL, attempts INTEGER, "
+            "result TEXT, error TEXT)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (state, priority, created)"
+        )
+        self._db.commit()
+
+    def submit(
+        self,
+        pdf: str,
+        output_format: str = "md_dollar",
+        output_name: str = None,
+        convert: bool = False,
+        priority: int = 0,
+        deadline: float = None,
+        job_id: str = None,
+    ) -> Job:
+        """Add a job to the queue
+
+        Args:
+            pdf (str): Path of the PDF file
+            output_format (str, optional): The format(s) to export, like `pdf2file`. Defaults to "md_dollar".
+            output_name (str, optional): The name of the output, the uid if not given. Defaults to None.
+            convert (bool, optional): See `pdf2file`. Defaults to False.
+            priority (int, optional): Higher is claimed and processed first. Defaults to 0.
+            deadline (float, optional): Soft deadline in seconds after the submission. Defaults to None.
+            job_id (str, optional): The id of the job, from `new_id`. Defaults to a new one.
+
+        Returns:
+            Job: The queued job
+        """
+        now = time.time()
+        values = (
+            job_id or self.new_id(),
+            QUEUED,
+            pdf,
+            output_format,
+            output_name,
+            int(convert),
+            priority,
+            None if deadline is None else now + deadline,
+            now,
+            None,
+            None,
+            0,
+            None,
+            None,
+        )
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO jobs VALUES ({', '.join('?' * len(COLUMNS))})", values
+            )
+            self._db.commit()
+        return Job(*values)
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return Job(*row) if row else None
+
+    def list(self, state: str = None, limit: int = 100) -> List[Job]:
+        """The latest jobs, of one state if given"""
+        query, args = "SELECT * FROM jobs", ()
+        if state is not None:
+            query, args = query + " WHERE state = ?", (state,)
+        with self._lock:
+            rows = self._db.execute(
+                query + " ORDER BY created DESC LIMIT ?", (*args, limit)
+            ).fetchall()
+        return [Job(*row) for row in rows]
+
+    def claim(self, limit: int) -> List[Job]:
+        """Move up to `limit` queued jobs to running, the highest priority and earliest deadline first"""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM jobs WHERE state = ? ORDER BY priority DESC, "
+                "deadline IS NULL, deadline, created LIMIT ?",
+                (QUEUED, limit),
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE jobs SET state = ?, started = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                [(RUNNING, now, row[0]) for row in rows],
+            )
+            self._db.commit()
+        jobs = [Job(*row) for row in rows]
+        for job in jobs:
+            job.state, job.started = RUNNING, now
+            job.attempts += 1
+        return jobs
+
+    def finish(self, job_id: str, result: Any, error: Any, failed: bool) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, finished = ?, result = ?, error = ? "
+                "WHERE id = ?",
+                (
+                    FAILED if failed else DONE,
+                    time.time(),
+                    json.dumps(result, ensure_ascii=False),
+                    json.dumps(error, ensure_ascii=False),
+                    job_id,
+                ),
+            )
+            self._db.commit()
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job which has not started yet
+
+        Returns:
+            bool: Whether the job was still queued
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = ?, finished = ? WHERE id = ? AND state = ?",
+                (CANCELLED, time.time(), job_id, QUEUED),
+            )
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    def requeue(self, job_ids: List[str]) -> None:
+        """Put running jobs back into the queue, e.g. when the worker stops"""
+        with self._lock:
+            self._db.executemany(
+                "UPDATE jobs SET state = ? WHERE id = ? AND state = ?",
+                [(QUEUED, job_id, RUNNING) for job_id in job_ids],
+            )
+            self._db.commit()
+
+    def recover(self) -> int:
+        """Put the jobs left running by a previous worker back into the queue
+
+        Returns:
+            int: The number of jobs recovered
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = ? WHERE state = ?", (QUEUED, RUNNING)
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        """The number of jobs in each state"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return {**dict.fromkeys(STATES, 0), **dict(rows)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("pdfdeal.journal")
+
+QUEUED = "queued"
+UPLOADED = "uploaded"
+PARSED = "parsed"
+CONVERTED = "converted"
+DOWNLOADED = "downloaded"
+FAILED = "failed"
+
+
+class FileState:
+    """What the journal knows about one file of a batch"""
+
+    __slots__ = ("uid", "key", "parsed", "pages", "urls", "paths")
+
+    def __init__(self) -> None:
+        self.uid: Optional[str] = None
+        # The id of the API key of the uid, only journaled when several keys are used
+        self.key = None
+        self.parsed = False
+        self.pages: Optional[int] = None
+        self.urls: Dict[str, str] = {}
+        self.paths: Dict[str, str] = {}
+
+    def apply(self, event: dict) -> None:
+        """Apply one journal record to the state"""
+        state = event.get("state")
+        if state == UPLOADED:
+            # A new upload replaces whatever the previous uid had reached
+            self.uid = event["uid"]
+            self.key = event.get("key")
+            self.parsed = False
+            self.urls.clear()
+            self.paths.clear()
+        elif state == PARSED:
+            self.uid = event.get("uid", self.uid)
+            self.key = event.get("key", self.key)
+            self.parsed = True
+            self.pages = event.get("pages")
+        elif state == CONVERTED:
+            self.urls[event["format"]] = event["url"]
+        elif state == DOWNLOADED:
+            self.paths[event["format"]] = event["path"]
+
+    def downloaded(self, fmt: str) -> Optional[str]:
+        """The downloaded file of a format, if it is still on disk"""
+        path = self.paths.get(fmt)
+        return path if path and os.path.exists(path) else None
+
+
+class BatchJournal:
+    """Append-only JSONL write-ahead journal of the state transitions of a batch.
+
+    Each line records one transition of one file: `queued`, `uploaded` (uid, key),
+    `parsed`, `converted` (format, url), `downloaded` (format, path) or `failed`.
+    `record` only puts the line on a queue, a background thread writes the queued
+    lines in batches every `flush_interval` seconds, so the event loop never waits
+    for the disk. A crash loses at most the last `flush_interval` of transitions,
+    which only means those stages are done again on resume.
+    """
+
+    def __init__(
+        self, path: str, resume: bool = False, flush_interval: float = 0.5
+    ) -> None:
+        """
+        Args:
+            path (str): The journal file
+            resume (bool, optional): Load the existing journal and append to it, instead of starting a new one. Defaults to False.
+            flush_interval (float, optional): Seconds between two batched writes. Defaults to 0.5.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.states: Dict[str, FileState] = load_journal(path) if resume else {}
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        if resume and self._file.tell() and not _ends_with_newline(path):
+            # Do not glue the first new line to a line cut off by the crash
+            self._file.write("\n")
+        self._queue = queue.SimpleQueue()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._write_loop, name="pdfdeal-journal", daemon=True
+        )
+        self._thread.start()
+
+    @staticmethod
+    def file_key(pdf_path: str) -> str:
+        return os.path.abspath(pdf_path)
+
+    def state(self, pdf_path: str) -> FileState:
+        """The state of a file loaded from the journal, empty if it was not in it"""
+        return self.states.get(self.file_key(pdf_path)) or FileState()
+
+    def record(self, pdf_path: str, state: str, **fields) -> None:
+        """Queue one state transition of a file, without blocking
+
+        Args:
+            pdf_path (str): The pdf file path
+            state (str): `queued`, `uploaded`, `parsed`, `converted`, `downloaded` or `failed`
+            **fields: The data of the transition, e.g. `uid`, `format`, `url`, `path` or `error`
+        """
+        event = {"t": round(time.time(), 3), "file": self.file_key(pdf_path)}
+        event["state"] = state
+        event.update(fields)
+        self._queue.put(event)
+
+    def _write_loop(self) -> None:
+        while True:
+            closing = self._closed.wait(self.flush_interval)
+            lines = []
+            while True:
+                try:
+                    event = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                lines.append(json.dumps(event, ensure_ascii=False) + "\n")
+            if lines:
+                try:
+                    self._file.writelines(lines)
+                    self._file.flush()
+                except OSError as e:
+                    logger.warning(f"Failed to write the journal {self.path}: {e}")
+            if closing:
+                return
+
+    def close(self) -> None:
+        """Write the remaining transitions and close the file"""
+        if self._file.closed:
+            return
+        self._closed.set()
+        self._thread.join()
+        self._file.close()
+
+
+def load_journal(path: str) -> Dict[str, FileState]:
+    """Replay a journal into the last known state of each file
+
+    Args:
+        path (str): The journal file, a missing file is an empty journal
+
+    Returns:
+        Dict[str, FileState]: The state of each file, by absolute path
+    """
+    states: Dict[str, FileState] = {}
+    try:
+        f = open(path, encoding="utf-8")
+    except FileNotFoundError:
+        return states
+    with f:
+        for number, line in enumerate(f, 1):
+            try:
+                event = json.loads(line)
+                states.setdefault(event["file"], FileState()).apply(event)
+            except (ValueError, KeyError):
+                # The last line may be cut off by a crash
+                logger.warning(f"Skipping broken line {number} of journal {path}")
+    return states
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
@@ -0,0 +1,159 @@
+import copy
+import hashlib
+import logging
+import time
+from typing import Dict, List, Union
+
+from .Exception import RequestError
+from .Limiter import AGING, ConcurrencyLimiter, PageBudget
+
+logger = logging.getLogger("pdfdeal.keys")
+
+
+def fingerprint(apikey: str) -> str:
+    """A short id of a key, safe to log and to write into a journal"""
+    return hashlib.sha256(apikey.encode("utf-8")).hexdigest()[:12]
+
+
+class ApiKey:
+    """One API key with its own concurrency limit and page budget"""
+
+    def __init__(
+        self, apikey: str, limiter: ConcurrencyLimiter, page_budget: PageBudget
+    ) -> None:
+        self.apikey = apikey
+        self.id = fingerprint(apikey)
+        self.limiter = limiter
+        self.page_budget = page_budget
+        # Why the key was taken out of rotation, None while it is used
+        self.disabled = None
+        self.uploads = 0
+        self.next_upload = 0.0
+
+    @property
+    def load(self) -> float:
+        """The share of the page budget and of the limiter which is taken or waited for"""
+        budget, limiter = self.page_budget, self.limiter
+        pages = (budget.used + budget.queued) / budget.capacity
+        files = (limiter.in_flight + limiter.waiting) / limiter.capacity
+        return pages + files
+
+    def reserve_upload(self, interval: float) -> float:
+        """Book the next upload slot of the key, uploads of every batch of the client are `interval` apart
+
+        Returns:
+            float: Seconds to wait for the slot
+        """
+        now = time.monotonic()
+        slot = max(now, self.next_upload)
+        self.next_upload = slot + interval
+        return slot - now
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "key": self.id,
+            "disabled": self.disabled,
+            "uploads": self.uploads,
+            "pages": self.page_budget.used,
+            **self.limiter.stats,
+        }
+
+
+class KeyPool:
+    """Several API keys used as one client.
+
+    New uploads go to the least loaded key still in rotation, every later call for
+    a uid goes to the key which uploaded it. A key out of quota leaves the rotation.
+    """
+
+    def __init__(
+        self,
+        apikeys: Union[str, List[str]],
+        limiter: ConcurrencyLimiter,
+        max_pages: int = 1000,
+        admission="fifo",
+        aging: float = AGING,
+    ) -> None:
+        """
+        Args:
+            apikeys (str | List[str]): The keys, a string may hold several separated by commas
+            limiter (ConcurrencyLimiter): The limiter of the first key, the others get a copy of it
+            max_pages (int, optional): The page budget of each key. Defaults to 1000.
+            admission (str | AdmissionPolicy, optional): The admission policy of the page budgets. Defaults to "fifo".
+            aging (float, optional): The priority aging of the page budgets. Defaults to 60.
+
+        Raises:
+            ValueError: If no key is given
+        """
+        if isinstance(apikeys, str):
+            apikeys = apikeys.split(",")
+        apikeys = list(dict.fromkeys(k.strip() for k in apikeys or [] if k.strip()))
+        if not apikeys:
+            raise ValueError("No apikey found")
+        self.keys = [
+            ApiKey(
+                apikey,
+                limiter if i == 0 else copy.deepcopy(limiter),
+                PageBudget(max_pages, admission, aging),
+            )
+            for i, apikey in enumerate(apikeys)
+        ]
+        self._uids: Dict[str, ApiKey] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def active(self) -> List[ApiKey]:
+        return [key for key in self.keys if key.disabled is None]
+
+    @property
+    def stats(self) -> List[dict]:
+        return [key.stats for key in self.keys]
+
+    def pick(self) -> ApiKey:
+        """The key a new upload should use
+
+        Raises:
+            RequestError: `parse_quota_limit` if every key is out of quota
+        """
+        active = self.active
+        if not active:
+            raise RequestError("parse_quota_limit")
+        return min(active, key=lambda key: key.load)
+
+    def bind(self, uid: str, key: ApiKey) -> None:
+        self._uids[uid] = key
+
+    def unbind(self, uid: Union[str, List[str]]) -> None:
+        """Forget the key of `uid`, or of each uid of a split file, once the file is done"""
+        for u in uid if isinstance(uid, list) else [uid]:
+            self._uids.pop(u, None)
+
+    def key_for(self, uid: str) -> ApiKey:
+        """The key which uploaded `uid`, the first key for a uid from elsewhere"""
+        return self._uids.get(uid, self.keys[0])
+
+    def ids(self, uid: Union[str, List[str]]) -> Union[str, List[str]]:
+        """The ids of the keys of `uid`, or of each uid of a split file"""
+        if isinstance(uid, list):
+            return [self.key_for(u).id for u in uid]
+        return self.key_for(uid).id
+
+    def restore(self, uid: Union[str, List[str]], ids: Union[str, List[str]]) -> None:
+        """Bind uids read back from a journal to the keys with the given ids"""
+        by_id = {key.id: key for key in self.keys}
+        uids = uid if isinstance(uid, list) else [uid]
+        ids = ids if isinstance(ids, list) else [ids]
+        for u, key_id in zip(uids, ids):
+            if key_id in by_id:
+                self.bind(u, by_id[key_id])
+
+    def disable(self, key: ApiKey, reason: str) -> None:
+        """Take `key` out of the rotation"""
+        if key.disabled is None:
+            key.disabled = reason
+            logger.warning(
+                f"API key {key.id} is out of rotation, {len(self.active)} key(s) left: {reason}"
+            )
@@ -0,0 +1,485 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# Seconds a waiter has to wait before it moves up one priority level
+AGING = 60
+# Queue wait times kept by a page budget, the oldest are dropped first
+MAX_WAIT_TIMES = 10000
+
+
+class _Waiter:
+    """A task waiting in one of the queues below"""
+
+    __slots__ = ("weight", "seq", "key", "future", "priority", "deadline", "since")
+
+    def __init__(self, weight, seq, key, future, priority=0, deadline=None):
+        self.weight = weight
+        self.seq = seq
+        self.key = key
+        self.future = future
+        self.priority = priority
+        self.deadline = deadline
+        self.since = time.monotonic()
+
+    def level(self, now: float, aging: float) -> int:
+        """The priority, raised by one for every `aging` seconds waited so nothing starves"""
+        if not aging:
+            return self.priority
+        return self.priority + int((now - self.since) / aging)
+
+    def rank(self, now: float, aging: float) -> tuple:
+        """Sort key, the most urgent waiter first: highest level, earliest deadline, first come"""
+        deadline = float("inf") if self.deadline is None else self.deadline
+        return (-self.level(now, aging), deadline, self.seq)
+
+
+def _most_urgent(waiters: list, aging: float) -> list:
+    """The waiters of the highest priority level, by deadline then arrival"""
+    now = time.monotonic()
+    ranked = sorted(waiters, key=lambda w: w.rank(now, aging))
+    top = ranked[0].level(now, aging)
+    return [w for w in ranked if w.level(now, aging) == top]
+
+
+class ConcurrencyLimiter:
+    """Limit the number of files processed at the same time.
+
+    This one keeps a fixed limit. Subclass it and override `on_success` /
+    `on_rate_limit` to adjust `limit` from the feedback of the API.
+    Waiters get a free slot by priority, then deadline, then arrival.
+    """
+
+    def __init__(self, limit: int = 5, aging: float = AGING) -> None:
+        """
+        Args:
+            limit (int, optional): The maximum number of files in flight. Defaults to 5.
+            aging (float, optional): Seconds of waiting after which a waiter moves up one priority level, 0 to disable. Defaults to 60.
+        """
+        self.limit = limit
+        self.aging = aging
+        self.in_flight = 0
+        self.peak = 0
+        self.successes = 0
+        self.rate_limits = 0
+        self._waiters = []
+        self._seq = 0
+
+    @property
+    def capacity(self) -> int:
+        """The number of slots currently available in total"""
+        return max(1, int(self.limit))
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def stats(self) -> dict:
+        """Live statistics of the limiter"""
+        return {
+            "limit": self.capacity,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "peak": self.peak,
+            "successes": self.successes,
+            "rate_limits": self.rate_limits,
+        }
+
+    async def acquire(self, priority: int = 0, deadline: float = None) -> None:
+        """Wait for a free slot
+
+        Args:
+            priority (int, optional): Higher goes first. Defaults to 0.
+            deadline (float, optional): `time.monotonic()` by which the file should be done, earlier goes first within a priority. Defaults to None.
+        """
+        if not self._waiters and self.in_flight < self.capacity:
+            self._take()
+            return
+        self._seq += 1
+        waiter = _Waiter(
+            1,
+            self._seq,
+            None,
+            asyncio.get_running_loop().create_future(),
+            priority,
+            deadline,
+        )
+        self._waiters.append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self) -> None:
+        """Give back a slot taken by `acquire`"""
+        self.in_flight -= 1
+        self._wake()
+
+    def _take(self) -> None:
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < self.capacity:
+            waiter = _most_urgent(self._waiters, self.aging)[0]
+            self._waiters.remove(waiter)
+            if not waiter.future.done():
+                self._take()
+                waiter.future.set_result(None)
+
+    def on_success(self, latency: float = None) -> None:
+        """Called when a file is parsed successfully
+
+        Args:
+            latency (float, optional): Seconds from upload to parsed, per page if the page count is known. Defaults to None.
+        """
+        self.successes += 1
+
+    def on_rate_limit(self) -> None:
+        """Called when the API reports `RateLimit` / `parse_concurrency_limit`"""
+        self.rate_limits += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class AIMDLimiter(ConcurrencyLimiter):
+    """Additive-increase / multiplicative-decrease concurrency limit.
+
+    Every success adds `increase / limit`, so the limit grows by about `increase`
+    per round of files. A rate limit multiplies it by `decrease`, at most once per
+    `cooldown` seconds since one overload is usually reported by many files at once.
+    Successes much slower than the fastest seen do not increase the limit, as the
+    server is already queueing.
+    """
+
+    def __init__(
+        self,
+        initial: int = 5,
+        min_limit: int = 1,
+        max_limit: int = 100,
+        increase: float = 1,
+        decrease: float = 0.5,
+        cooldown: float = 5,
+        latency_factor: float = 2,
+        aging: float = AGING,
+    ) -> None:
+        """
+        Args:
+            initial (int, optional): The starting limit. Defaults to 5.
+            min_limit (int, optional): The limit never goes below this. Defaults to 1.
+            max_limit (int, optional): The limit never goes above this. Defaults to 100.
+            increase (float, optional): How much the limit grows per round of successes. Defaults to 1.
+            decrease (float, optional): The factor applied to the limit on a rate limit. Defaults to 0.5.
+            cooldown (float, optional): Seconds during which further rate limits do not decrease the limit again. Defaults to 5.
+            latency_factor (float, optional): Successes slower than this factor times the fastest latency do not grow the limit. Defaults to 2.
+            aging (float, optional): Seconds of waiting after which a waiter moves up one priority level, 0 to disable. Defaults to 60.
+        """
+        super().__init__(initial, aging)
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.latency_factor = latency_factor
+        self.min_latency = None
+        self._last_decrease = float("-inf")
+
+    def on_success(self, latency: float = None) -> None:
+        super().on_success(latency)
+        if latency is not None:
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            elif latency > self.min_latency * self.latency_factor:
+                return
+        self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+        self._wake()
+
+    def on_rate_limit(self) -> None:
+        super().on_rate_limit()
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+
+
+class AdmissionPolicy(ABC):
+    """Choose which waiting file is admitted next into the page budget.
+
+    The policy only chooses among the files of the highest priority level, a
+    lower one never gets in ahead of them. Subclass it and override `select`
+    to plug in your own policy.
+    """
+
+    @abstractmethod
+    def select(self, waiters: list, available: int):
+        """Pick the waiter to admit
+
+        Args:
+            waiters (list): The waiters of the highest priority level, by deadline then arrival order, each has `weight`, `seq`, `key`, `priority` and `deadline`
+            available (int): The pages left in the budget
+
+        Returns:
+            The waiter to admit, or None to wait for more pages to be released
+        """
+
+
+class FIFOAdmission(AdmissionPolicy):
+    """Admit files strictly in arrival order"""
+
+    def select(self, waiters, available):
+        head = waiters[0]
+        return head if head.weight <= available else None
+
+
+class SmallestFirst(AdmissionPolicy):
+    """Admit the file with the fewest pages first, for the best average latency"""
+
+    def select(self, waiters, available):
+        smallest = min(waiters, key=lambda w: (w.weight, w.seq))
+        return smallest if smallest.weight <= available else None
+
+
+class LargestFirst(AdmissionPolicy):
+    """Admit the file with the most pages first, to shorten the makespan of a batch"""
+
+    def select(self, waiters, available):
+        largest = max(waiters, key=lambda w: (w.weight, -w.seq))
+        return largest if largest.weight <= available else None
+
+
+class BestFit(AdmissionPolicy):
+    """Admit the largest file which fits into the pages left, packing the budget tightly"""
+
+    def select(self, waiters, available):
+        fitting = [w for w in waiters if w.weight <= available]
+        if not fitting:
+            return None
+        return max(fitting, key=lambda w: (w.weight, -w.seq))
+
+
+ADMISSION_POLICIES = {
+    "fifo": FIFOAdmission,
+    "smallest": SmallestFirst,
+    "largest": LargestFirst,
+    "best_fit": BestFit,
+}
+
+
+class PageBudget:
+    """Weighted semaphore over the number of pages being parsed at the same time.
+
+    Each file takes its page count from the budget. Waiters are woken when pages
+    are released, and the admission policy picks which of the most urgent ones
+    goes next.
+    """
+
+    def __init__(
+        self, capacity: int = 1000, policy="fifo", aging: float = AGING
+    ) -> None:
+        """
+        Args:
+            capacity (int, optional): The maximum number of pages in flight. Defaults to 1000.
+            policy (str | AdmissionPolicy, optional): `fifo`, `smallest`, `largest`, `best_fit` or an `AdmissionPolicy`. Defaults to "fifo".
+            aging (float, optional): Seconds of waiting after which a file moves up one priority level, 0 to disable. Defaults to 60.
+        """
+        if isinstance(policy, str):
+            if policy not in ADMISSION_POLICIES:
+                raise ValueError(
+                    f"{policy} is not a valid admission policy, must be one of {', '.join(ADMISSION_POLICIES)}"
+                )
+            policy = ADMISSION_POLICIES[policy]()
+        self.capacity = capacity
+        self.policy = policy
+        self.aging = aging
+        self.used = 0
+        self.wait_times = OrderedDict()
+        self._waiters = []
+        self._seq = 0
+
+    @property
+    def available(self) -> int:
+        return self.capacity - self.used
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def queued(self) -> int:
+        """The pages of the waiting files"""
+        return sum(waiter.weight for waiter in self._waiters)
+
+    async def acquire(
+        self, weight: int, key: str = None, priority: int = 0, deadline: float = None
+    ) -> float:
+        """Wait until `weight` pages can be taken from the budget
+
+        Args:
+            weight (int): The page count of the file
+            key (str, optional): The name the queue wait time is recorded under. Defaults to None.
+            priority (int, optional): Higher goes first. Defaults to 0.
+            deadline (float, optional): `time.monotonic()` by which the file should be done, earlier goes first within a priority. Defaults to None.
+
+        Raises:
+            ValueError: If the file alone exceeds the budget
+
+        Returns:
+            float: Seconds spent waiting in the queue
+        """
+        if weight > self.capacity:
+            raise ValueError(
+                f"{weight} pages exceed the page budget of {self.capacity} pages"
+            )
+        start = time.monotonic()
+        self._seq += 1
+        waiter = _Waiter(
+            weight,
+            self._seq,
+            key,
+            asyncio.get_running_loop().create_future(),
+            priority,
+            deadline,
+        )
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(weight)
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._dispatch()
+            raise
+        waited = time.monotonic() - start
+        if key is not None:
+            self.wait_times[key] = waited
+            self.wait_times.move_to_end(key)
+            if len(self.wait_times) > MAX_WAIT_TIMES:
+                self.wait_times.popitem(last=False)
+        return waited
+
+    def release(self, weight: int) -> None:
+        """Give back the pages taken by `acquire`"""
+        self.used -= weight
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._waiters:
+            waiter = self.policy.select(
+                _most_urgent(self._waiters, self.aging), self.available
+            )
+            if waiter is None:
+                return
+            self._waiters.remove(waiter)
+            if not waiter.future.done():
+                self.used += waiter.weight
+                waiter.future.set_result(None)
+
+
+class TokenBucket:
+    """Request rate limit of one API endpoint.
+
+    Tokens are added at `rate` per second up to `burst`, each request takes one.
+    Waiters get tokens by priority, then deadline, then arrival. When the
+    endpoint still reports a rate limit, `penalize` holds back all requests for
+    a while instead of each caller sleeping on its own.
+    """
+
+    def __init__(self, rate: float = 2, burst: int = 1, aging: float = AGING) -> None:
+        """
+        Args:
+            rate (float, optional): Requests per second, 0 for no limit. Defaults to 2.
+            burst (int, optional): Requests which can be sent at once after an idle period. Defaults to 1.
+            aging (float, optional): Seconds of waiting after which a waiter moves up one priority level, 0 to disable. Defaults to 60.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.aging = aging
+        self.tokens = float(burst)
+        self.penalties = 0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []
+        self._seq = 0
+        self._timer = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = 0, deadline: float = None) -> None:
+        """Wait until a request can be sent
+
+        Args:
+            priority (int, optional): Higher goes first. Defaults to 0.
+            deadline (float, optional): `time.monotonic()` by which the request should be sent, earlier goes first within a priority. Defaults to None.
+        """
+        if not self.rate:
+            return
+        self._seq += 1
+        waiter = _Waiter(
+            1,
+            self._seq,
+            None,
+            asyncio.get_running_loop().create_future(),
+            priority,
+            deadline,
+        )
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted but not used, give the token back
+                self.tokens = min(self.burst, self.tokens + 1)
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._dispatch()
+            raise
+
+    def _dispatch(self) -> None:
+        """Hand out the tokens available now, and wake up again when the next one is"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        if now >= self._paused_until:
+            self._refill(now)
+            while self._waiters and self.tokens >= 1:
+                waiter = _most_urgent(self._waiters, self.aging)[0]
+                self._waiters.remove(waiter)
+                if not waiter.future.done():
+                    self.tokens -= 1
+                    waiter.future.set_result(None)
+        if self._waiters:
+            if now < self._paused_until:
+                delay = self._paused_until - now
+            else:
+                delay = (1 - self.tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def penalize(self, seconds: float) -> None:
+        """Send no request for `seconds`, e.g. after the endpoint reported a rate limit"""
+        self.penalties += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._updated = self._paused_until
+        self.tokens = 0
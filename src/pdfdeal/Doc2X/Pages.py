@@ -1,20 +1,420 @@
-from pypdf import PdfReader
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from collections import deque
+from typing import Dict, Optional, Tuple, Union
+
 from .Exception import RequestError
 
+logger = logging.getLogger("pdfdeal.pages")
+
+STARTXREF = re.compile(rb"startxref\s+(\d+)")
+XREF_SECTION = re.compile(rb"\s*(\d+)\s+(\d+)[ \t]*[\r\n]+")
+XREF_ENTRY = re.compile(rb"\s*(\d{10})\s(\d{5})\s([nf])")
+OBJECT_HEADER = re.compile(rb"\s*(\d+)\s+\d+\s+obj")
+ROOT = re.compile(rb"/Root\s+(\d+)\s+\d+\s+R")
+PREV = re.compile(rb"/Prev\s+(\d+)")
+PAGES = re.compile(rb"/Pages\s+(\d+)\s+\d+\s+R")
+COUNT = re.compile(rb"/Count\s+(\d+)(\s+\d+\s+R)?")
+LENGTH = re.compile(rb"/Length\s+(\d+)(\s+\d+\s+R)?")
+FILTER = re.compile(rb"/Filter\s*\[?\s*/(\w+)")
+PREDICTOR = re.compile(rb"/Predictor\s+(\d+)")
+COLUMNS = re.compile(rb"/Columns\s+(\d+)")
+WIDTHS = re.compile(rb"/W\s*\[\s*(\d+)\s+(\d+)\s+(\d+)\s*\]")
+INDEX = re.compile(rb"/Index\s*\[([\d\s]*)\]")
+SIZE = re.compile(rb"/Size\s+(\d+)")
+FIRST = re.compile(rb"/First\s+(\d+)")
+
+# The trailer is in the last bytes, an object dictionary within the next
+TAIL_SIZE = 4096
+OBJECT_SIZE = 1024 * 1024
+
 
-def get_pdf_page_count(pdf_path: str) -> int:
+def default_memo_path() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "pdfdeal", "pages.sqlite")
+
+
+class PageCountMemo:
+    """Page counts already read, keyed by the path, size and modification time of the file.
+
+    Kept in sqlite so that re-running a batch does not open each PDF again. A lost or
+    stale entry is harmless, the count is read from the file again.
+    """
+
+    def __init__(self, path: str = None) -> None:
+        """
+        Args:
+            path (str, optional): The sqlite file. Defaults to `pdfdeal/pages.sqlite` in `$XDG_CACHE_HOME`, or in `~/.cache`.
+        """
+        self.path = path or default_memo_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages (path TEXT PRIMARY KEY, size INTEGER, "
+            "mtime INTEGER, pages INTEGER, encrypted INTEGER)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(pages)")]
+        if "encrypted" not in columns:
+            # A memo written before the encryption flag was kept, unknown for those rows
+            self._db.execute("ALTER TABLE pages ADD COLUMN encrypted INTEGER")
+        self._db.commit()
+
+    @staticmethod
+    def key(pdf_path: str):
+        stat = os.stat(pdf_path)
+        return os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns
+
+    def get(self, pdf_path: str) -> Optional[int]:
+        info = self.lookup(pdf_path)
+        return info[0] if info else None
+
+    def lookup(self, pdf_path: str) -> Optional[Tuple[int, Optional[bool]]]:
+        """The page count and the encryption flag (None if not known) of the file"""
+        path, size, mtime = self.key(pdf_path)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT pages, encrypted FROM pages "
+                "WHERE path = ? AND size = ? AND mtime = ?",
+                (path, size, mtime),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], None if row[1] is None else bool(row[1])
+
+    def put(self, pdf_path: str, pages: int, encrypted: bool = None) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                (
+                    *self.key(pdf_path),
+                    pages,
+                    None if encrypted is None else int(encrypted),
+                ),
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_memo = None
+_memo_lock = threading.Lock()
+
+
+def default_memo() -> Optional[PageCountMemo]:
+    """The shared memo, None if it can not be opened"""
+    global _memo
+    with _memo_lock:
+        if _memo is None:
+            try:
+                _memo = PageCountMemo()
+            except (OSError, sqlite3.Error) as e:
+                logger.debug(f"Page count memo disabled: {e}")
+                _memo = False
+        return _memo or None
+
+
+def _decode_stream(header: bytes, raw: bytes) -> Optional[bytes]:
+    """Decode a stream with no filter or FlateDecode and an optional PNG predictor"""
+    filter = FILTER.search(header)
+    if filter is None:
+        return raw
+    if filter.group(1) != b"FlateDecode":
+        return None
+    decoded = zlib.decompress(raw)
+    predictor = PREDICTOR.search(header)
+    if predictor is None or int(predictor.group(1)) < 10:
+        return decoded
+    columns = COLUMNS.search(header)
+    columns = int(columns.group(1)) if columns else 1
+    rows, previous = [], bytes(columns)
+    for start in range(0, len(decoded), columns + 1):
+        kind, row = decoded[start], decoded[start + 1 : start + 1 + columns]
+        if kind == 2:
+            row = bytes((a + b) & 0xFF for a, b in zip(row, previous))
+        elif kind != 0:
+            # Only the None and Up filters are used for xref streams in practice
+            return None
+        rows.append(row)
+        previous = row
+    return b"".join(rows)
+
+
+def _last(iterator):
+    """The last item of `iterator`, None if it is empty"""
+    tail = deque(iterator, maxlen=1)
+    return tail[0] if tail else None
+
+
+class _XrefReader:
+    """Just enough of a PDF reader to find a few objects through the cross-reference data"""
+
+    def __init__(self, data) -> None:
+        self.data = data
+        self.offsets: Dict[int, int] = {}
+        self.compressed: Dict[int, Tuple[int, int]] = {}
+        self.root = None
+        self.encrypted = False
+
+    def read(self, offset: int) -> None:
+        """Read the xref sections from the newest one, an update wins over the original"""
+        seen = set()
+        while offset is not None and offset not in seen and offset < len(self.data):
+            seen.add(offset)
+            if self.data[offset : offset + 4] == b"xref":
+                offset = self._read_table(offset)
+            elif OBJECT_HEADER.match(self.data, offset):
+                offset = self._read_stream(offset)
+            else:
+                break
+
+    def _trailer(self, trailer: bytes) -> Optional[int]:
+        if self.root is None:
+            root = ROOT.search(trailer)
+            self.root = int(root.group(1)) if root else None
+        self.encrypted = self.encrypted or b"/Encrypt" in trailer
+        prev = PREV.search(trailer)
+        return int(prev.group(1)) if prev else None
+
+    def _read_table(self, offset: int) -> Optional[int]:
+        pos = offset + 4
+        while True:
+            section = XREF_SECTION.match(self.data, pos)
+            if section is None:
+                break
+            start, count = int(section.group(1)), int(section.group(2))
+            pos = section.end()
+            for number in range(start, start + count):
+                entry = XREF_ENTRY.match(self.data, pos)
+                if entry is None:
+                    return None
+                pos = entry.end()
+                if entry.group(3) == b"n":
+                    self.offsets.setdefault(number, int(entry.group(1)))
+        trailer = self.data.find(b"trailer", pos, pos + TAIL_SIZE)
+        if trailer == -1:
+            return None
+        end = self.data.find(b"startxref", trailer, trailer + TAIL_SIZE)
+        return self._trailer(
+            self.data[trailer : end if end != -1 else trailer + TAIL_SIZE]
+        )
+
+    def _read_stream(self, offset: int) -> Optional[int]:
+        header, content = self._object_at(offset)
+        if content is None:
+            return None
+        widths = WIDTHS.search(header)
+        if widths is None:
+            return None
+        widths = [int(width) for width in widths.groups()]
+        index = INDEX.search(header)
+        if index:
+            index = [int(value) for value in index.group(1).split()]
+        else:
+            size = SIZE.search(header)
+            index = [0, int(size.group(1)) if size else 0]
+        pos, entry_size = 0, sum(widths)
+        for start, count in zip(index[::2], index[1::2]):
+            for number in range(start, start + count):
+                entry = content[pos : pos + entry_size]
+                pos += entry_size
+                if len(entry) < entry_size:
+                    break
+                fields, field_pos = [], 0
+                for width in widths:
+                    fields.append(
+                        int.from_bytes(entry[field_pos : field_pos + width], "big")
+                    )
+                    field_pos += width
+                kind = fields[0] if widths[0] else 1
+                if kind == 1:
+                    self.offsets.setdefault(number, fields[1])
+                elif kind == 2:
+                    self.compressed.setdefault(number, (fields[1], fields[2]))
+        return self._trailer(header)
+
+    def _object_at(self, offset: int) -> Tuple[bytes, Optional[bytes]]:
+        """The dictionary and the decoded stream of the object at `offset`"""
+        match = OBJECT_HEADER.match(self.data, offset)
+        if match is None:
+            raise ValueError(f"No object at offset {offset}")
+        end = self.data.find(b"endobj", match.end(), match.end() + OBJECT_SIZE)
+        end = end if end != -1 else match.end() + OBJECT_SIZE
+        stream = self.data.find(b"stream", match.end(), end)
+        if stream == -1:
+            return self.data[match.end() : end], None
+        header = self.data[match.end() : stream]
+        start = stream + 6
+        if self.data[start : start + 2] == b"\r\n":
+            start += 2
+        elif self.data[start : start + 1] in (b"\r", b"\n"):
+            start += 1
+        length = LENGTH.search(header)
+        if length and not length.group(2):
+            raw = self.data[start : start + int(length.group(1))]
+        else:
+            raw = self.data[start : self.data.rfind(b"endstream", start, end)]
+        return header, _decode_stream(header, raw)
+
+    def find(self, number: int) -> Optional[bytes]:
+        """The body of an object, from an object stream if needed"""
+        if number in self.compressed:
+            stream_number, index = self.compressed[number]
+            return self._from_object_stream(stream_number, index, number)
+        header = re.compile(rb"(?<!\d)%d\s+\d+\s+obj" % number)
+        match = None
+        if number in self.offsets:
+            match = header.match(self.data, self.offsets[number])
+        if match is None:
+            # Broken or missing xref, the last definition is the current one
+            match = _last(header.finditer(self.data))
+        if match is None:
+            return None
+        end = self.data.find(b"endobj", match.end(), match.end() + OBJECT_SIZE)
+        return self.data[match.end() : end if end != -1 else match.end() + OBJECT_SIZE]
+
+    def _from_object_stream(self, stream_number: int, index: int, number: int):
+        if stream_number not in self.offsets:
+            return None
+        header, content = self._object_at(self.offsets[stream_number])
+        first = FIRST.search(header)
+        if content is None or first is None:
+            return None
+        first = int(first.group(1))
+        table = [int(value) for value in content[:first].split()]
+        numbers, offsets = table[::2], table[1::2]
+        if index >= len(numbers) or numbers[index] != number:
+            return None
+        end = offsets[index + 1] if index + 1 < len(offsets) else len(content) - first
+        return content[first + offsets[index] : first + end]
+
+
+def inspect_pdf(pdf_path: str) -> Tuple[Optional[int], bool]:
+    """Read the page count and the encryption flag from the cross-reference data only
+
+    The file is memory mapped, nothing but the trailer, the catalog and the root of the
+    page tree is parsed. The page count is None when the structure is not a usual one
+    (encrypted object streams, indirect count, damaged file...), use pypdf then.
+
+    Args:
+        pdf_path (str): The path to the PDF file.
+
+    Returns:
+        Tuple[Optional[int], bool]: The number of pages, or None if it could not be read this way, and whether the file is encrypted
+    """
+    with open(pdf_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None, False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            startxref = _last(STARTXREF.finditer(data, max(0, len(data) - TAIL_SIZE)))
+            if startxref is None:
+                return None, False
+            reader = _XrefReader(data)
+            try:
+                reader.read(int(startxref.group(1)))
+                if reader.root is None:
+                    return None, reader.encrypted
+                catalog = reader.find(reader.root)
+                pages = PAGES.search(catalog) if catalog else None
+                if pages is None:
+                    return None, reader.encrypted
+                tree = reader.find(int(pages.group(1)))
+            except Exception as e:
+                # Damaged or unusual structure, never more than a reason to use pypdf
+                logger.debug(f"Fast page count failed for {pdf_path}: {e}")
+                return None, reader.encrypted
+            count = COUNT.search(tree) if tree else None
+            if count is None or count.group(2):
+                return None, reader.encrypted
+            return int(count.group(1)) or None, reader.encrypted
+
+
+def fast_page_count(pdf_path: str) -> Optional[int]:
+    """The page count from `inspect_pdf`, None if it could not be read this way
+
+    Args:
+        pdf_path (str): The path to the PDF file.
+
+    Returns:
+        Optional[int]: The number of pages
+    """
+    return inspect_pdf(pdf_path)[0]
+
+
+def pdf_info(
+    pdf_path: str, memo: Union[PageCountMemo, bool] = None
+) -> Tuple[int, bool]:
+    """The page count and the encryption flag of a PDF file
+
+    Tries `memo` if given, then `inspect_pdf`, and falls back to a full
+    `PdfReader`. Blocking, call it from an executor inside the event loop.
+
+    Args:
+        pdf_path (str): The path to the PDF file.
+        memo (PageCountMemo | bool, optional): Use and update this `PageCountMemo`, True for the shared one at `default_memo_path()`. Defaults to None (no memo).
+
+    Raises:
+        Exception: If pypdf can not read the file either
+
+    Returns:
+        Tuple[int, bool]: The number of pages and whether the file is encrypted
+    """
+    if memo is True:
+        memo = default_memo()
+    info = memo.lookup(pdf_path) if memo else None
+    if info is not None and info[1] is not None:
+        return info
+    try:
+        pages, encrypted = inspect_pdf(pdf_path)
+    except Exception as e:
+        # The fast reader is only a shortcut, pypdf decides whether the file is readable
+        logger.debug(f"Fast page count failed for {pdf_path}: {e}")
+        pages, encrypted = None, False
+    if info is not None:
+        pages = info[0]
+    if pages is None:
+        from pypdf import PdfReader
+
+        with open(pdf_path, "rb") as file:
+            reader = PdfReader(file)
+            encrypted = encrypted or reader.is_encrypted
+            pages = len(reader.pages)
+    if memo:
+        try:
+            memo.put(pdf_path, pages, encrypted)
+        except sqlite3.Error as e:
+            logger.debug(f"Failed to remember the page count of {pdf_path}: {e}")
+    return pages, encrypted
+
+
+def get_pdf_page_count(
+    pdf_path: str, limit: int = 1000, memo: Union[PageCountMemo, bool] = None
+) -> int:
     """
     Get the number of pages in a PDF file.
 
+    Tries `fast_page_count` first and falls back to a full `PdfReader`, see `pdf_info`.
+    Blocking, call it from an executor inside the event loop.
+
     Args:
         pdf_path (str): The path to the PDF file.
+        limit (int, optional): Raise `parse_file_page_limit` above this page count, None for no limit. Defaults to 1000.
+        memo (PageCountMemo | bool, optional): Remember the count in this `PageCountMemo`, True for the shared one. Defaults to None (no memo).
 
     Returns:
         int: The number of pages in the PDF.
     """
-    with open(pdf_path, "rb") as file:
-        reader = PdfReader(file)
-        pages = len(reader.pages)
-    if pages > 1000:
+    pages = pdf_info(pdf_path, memo)[0]
+    if limit is not None and pages > limit:
         raise RequestError("parse_file_page_limit")
     return pages
@@ -0,0 +1,159 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class PollState:
+    """The polling history of one parse or convert job"""
+
+    def __init__(self, kind: str = "parse", pages: int = None) -> None:
+        """
+        Args:
+            kind (str, optional): `parse` or `convert`. Defaults to "parse".
+            pages (int, optional): The page count of the file, if known. Defaults to None.
+        """
+        self.kind = kind
+        self.pages = pages
+        self.started = time.monotonic()
+        self.polls = 0
+        self.last_delay = 0.0
+        self.samples = []
+
+    def record(self, progress: Optional[int] = None) -> None:
+        """Record one poll and the progress it reported"""
+        self.polls += 1
+        if progress is not None:
+            self.samples.append((time.monotonic() - self.started, progress))
+
+
+class PollPolicy(ABC):
+    """Decide how long to wait before the next status poll.
+
+    Subclass it and override `next_delay` (and optionally `first_delay`) to plug in your own policy.
+    """
+
+    def first_delay(self, state: PollState) -> float:
+        """Seconds to wait before the first poll, right after the job is created"""
+        return 0
+
+    @abstractmethod
+    def next_delay(self, state: PollState) -> float:
+        """Seconds to wait before the next poll, after a poll reported the job is still processing"""
+
+
+class FixedPoll(PollPolicy):
+    """Poll at a fixed interval, the behaviour before adaptive polling"""
+
+    def __init__(self, interval: float = 3) -> None:
+        self.interval = interval
+
+    def next_delay(self, state: PollState) -> float:
+        return self.interval
+
+
+class AdaptivePoll(PollPolicy):
+    """Estimate the completion time from the page count and the reported progress rate.
+
+    The first poll is scheduled from the page count, so small files are polled early.
+    Once the server reports progress, the next poll is aimed at the estimated completion
+    time. Without usable progress (e.g. conversions) the interval backs off exponentially.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 0.5,
+        max_interval: float = 10,
+        parse_seconds_per_page: float = 0.5,
+        convert_seconds_per_page: float = 0.05,
+        backoff: float = 1.5,
+    ) -> None:
+        """
+        Args:
+            min_interval (float, optional): The shortest wait between polls. Defaults to 0.5.
+            max_interval (float, optional): The longest wait between polls. Defaults to 10.
+            parse_seconds_per_page (float, optional): Expected parse time per page, used before any progress is known. Defaults to 0.5.
+            convert_seconds_per_page (float, optional): Expected convert time per page. Defaults to 0.05.
+            backoff (float, optional): Growth factor of the interval when progress can not be estimated. Defaults to 1.5.
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.seconds_per_page = {
+            "parse": parse_seconds_per_page,
+            "convert": convert_seconds_per_page,
+        }
+        self.backoff = backoff
+
+    def _clamp(self, delay: float) -> float:
+        return max(self.min_interval, min(self.max_interval, delay))
+
+    def first_delay(self, state: PollState) -> float:
+        if not state.pages:
+            return self.min_interval
+        return self._clamp(state.pages * self.seconds_per_page.get(state.kind, 0))
+
+    def next_delay(self, state: PollState) -> float:
+        if len(state.samples) >= 2:
+            t1, p1 = state.samples[-1]
+            # Measure from the last poll before progress started to move, queueing time is not progress
+            t0, p0 = state.samples[0]
+            for t, p in state.samples:
+                if p > p0:
+                    break
+                t0 = t
+            if p1 > p0 and t1 > t0:
+                rate = (p1 - p0) / (t1 - t0)
+                return self._clamp((100 - p1) / rate)
+        if not state.last_delay:
+            return self.min_interval
+        return self._clamp(state.last_delay * self.backoff)
+
+
+class PollStats:
+    """Count the status polls issued for each file
+
+    Only the latest `max_files` files of each kind keep their own count, the totals
+    cover every file, so a long running worker does not grow without bound.
+    """
+
+    def __init__(self, max_files: int = 10000) -> None:
+        self.max_files = max_files
+        self.polls: Dict[str, Dict[str, int]] = {
+            "parse": OrderedDict(),
+            "convert": OrderedDict(),
+        }
+        self._totals: Dict[str, int] = {}
+        self._files: Dict[str, int] = {}
+
+    def record(self, kind: str, key: str, polls: int) -> None:
+        """Record the polls a finished job needed
+
+        Args:
+            kind (str): `parse` or `convert`
+            key (str): The file (or uid) the job belongs to
+            polls (int): The number of polls issued
+        """
+        counts = self.polls.setdefault(kind, OrderedDict())
+        if key not in counts:
+            self._files[kind] = self._files.get(kind, 0) + 1
+        counts[key] = counts.get(key, 0) + polls
+        counts.move_to_end(key)
+        if len(counts) > self.max_files:
+            counts.popitem(last=False)
+        self._totals[kind] = self._totals.get(kind, 0) + polls
+
+    def total(self, kind: str = None) -> int:
+        """The total number of polls, of one kind or of all kinds"""
+        kinds = [kind] if kind else list(self._totals)
+        return sum(self._totals.get(k, 0) for k in kinds)
+
+    def per_file(self, kind: str = "parse") -> float:
+        """The average number of polls per file"""
+        files = self._files.get(kind, 0)
+        return self._totals.get(kind, 0) / files if files else 0.0
+
+    def reset(self) -> None:
+        for counts in self.polls.values():
+            counts.clear()
+        self._totals.clear()
+        self._files.clear()
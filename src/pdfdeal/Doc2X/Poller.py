@@ -0,0 +1,231 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from typing import List, Tuple
+
+import httpx
+
+from .ConvertV2 import uid_status, get_convert_result
+from .Exception import RequestError
+from .Poll import PollPolicy, PollState, PollStats, FixedPoll
+
+logger = logging.getLogger("pdfdeal.poller")
+
+
+class _PollJob:
+    __slots__ = (
+        "kind",
+        "apikey",
+        "uid",
+        "convert",
+        "key",
+        "state",
+        "future",
+        "context",
+    )
+
+    def __init__(self, kind, apikey, uid, convert, key, state, future):
+        self.kind = kind
+        self.apikey = apikey
+        self.uid = uid
+        self.convert = convert
+        self.key = key
+        self.state = state
+        self.future = future
+        # Polls run in the context of the task which asked for them, so they are traced and counted for its file
+        self.context = contextvars.copy_context()
+
+
+class StatusPoller:
+    """One poll loop for all in-flight parse and convert jobs.
+
+    Jobs are kept in a heap ordered by the time their next poll is due, polls are
+    started no faster than `rps` per second, and each waiting task is woken through
+    its own future. The request volume therefore depends on `rps` and the poll
+    policy, not on the number of files in flight.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient = None,
+        rps: float = 10,
+        policy: PollPolicy = None,
+        stats: PollStats = None,
+    ) -> None:
+        """
+        Args:
+            client (httpx.AsyncClient, optional): The shared client. Defaults to None.
+            rps (float, optional): The maximum number of status requests started per second, 0 for no limit. Defaults to 10.
+            policy (PollPolicy, optional): When to poll each job again. Defaults to `FixedPoll()`.
+            stats (PollStats, optional): Where to record the polls per file. Defaults to None.
+        """
+        self.client = client
+        self.interval = 1 / rps if rps else 0
+        self.policy = policy or FixedPoll()
+        self.stats = stats
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._inflight = set()
+        self._next_slot = 0.0
+        self._task = None
+
+    @property
+    def pending(self) -> int:
+        """The number of jobs waiting for their result"""
+        return sum(1 for _, _, job in self._heap if not job.future.done()) + len(
+            self._inflight
+        )
+
+    def poll_parse(
+        self,
+        apikey: str,
+        uid: str,
+        convert: bool = False,
+        pages: int = None,
+        key: str = None,
+    ) -> "asyncio.Future[Tuple[List[str], List[dict]]]":
+        """Poll `uid_status` until the file is parsed
+
+        Args:
+            apikey (str): The key
+            uid (str): The uid of the file
+            convert (bool, optional): Convert "[" and "[[" to "$" and "$$" or not. Defaults to False.
+            pages (int, optional): The page count of the file, used by the poll policy. Defaults to None.
+            key (str, optional): The name the polls are recorded under, defaults to the uid.
+
+        Returns:
+            asyncio.Future: Resolves to the texts and locations, or raises the error of the status request. Cancel it to stop polling.
+        """
+        return self._submit("parse", apikey, uid, convert, pages, key)
+
+    def poll_convert(
+        self, apikey: str, uid: str, pages: int = None, key: str = None
+    ) -> "asyncio.Future[str]":
+        """Poll `get_convert_result` until the conversion is done
+
+        Args:
+            apikey (str): The key
+            uid (str): The uid of the file
+            pages (int, optional): The page count of the file, used by the poll policy. Defaults to None.
+            key (str, optional): The name the polls are recorded under, defaults to the uid.
+
+        Returns:
+            asyncio.Future: Resolves to the url of the converted file. Cancel it to stop polling.
+        """
+        return self._submit("convert", apikey, uid, False, pages, key)
+
+    def _submit(self, kind, apikey, uid, convert, pages, key):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+        job = _PollJob(
+            kind,
+            apikey,
+            uid,
+            convert,
+            key or uid,
+            PollState(kind, pages),
+            loop.create_future(),
+        )
+        job.future.add_done_callback(lambda _: self._record(job))
+        self._schedule(job, self.policy.first_delay(job.state))
+        return job.future
+
+    def _record(self, job: _PollJob) -> None:
+        if self.stats is not None:
+            self.stats.record(job.kind, job.key, job.state.polls)
+
+    def _schedule(self, job: _PollJob, delay: float) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), job))
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            while self._heap and self._heap[0][2].future.done():
+                heapq.heappop(self._heap)
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            due = max(self._heap[0][0], self._next_slot)
+            if due > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), due - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._next_slot = max(now, self._next_slot) + self.interval
+            _, _, job = heapq.heappop(self._heap)
+            task = job.context.run(asyncio.create_task, self._poll(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _poll(self, job: _PollJob) -> None:
+        try:
+            if job.kind == "parse":
+                progress, status, texts, locations = await uid_status(
+                    job.apikey, job.uid, job.convert, client=self.client
+                )
+                job.state.record(progress)
+                if status == "Success":
+                    result = (texts, locations)
+                elif status == "Processing file":
+                    logger.info(f"Processing {job.uid} : {progress}%")
+                    result = None
+                else:
+                    raise RequestError(
+                        f"Unexpected status: {status} with uid: {job.uid}"
+                    )
+            else:
+                status, url = await get_convert_result(
+                    job.apikey, job.uid, client=self.client
+                )
+                job.state.record()
+                if status == "Success":
+                    result = url
+                elif status == "Processing":
+                    logger.info(f"Converting {job.uid} file...")
+                    result = None
+                else:
+                    raise RequestError(
+                        f"Unexpected status: {status} with uid: {job.uid}"
+                    )
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        if job.future.done():
+            return
+        if result is not None:
+            job.future.set_result(result)
+        else:
+            job.state.last_delay = self.policy.next_delay(job.state)
+            self._schedule(job, job.state.last_delay)
+
+    async def aclose(self) -> None:
+        """Stop polling, jobs still waiting are cancelled"""
+        for _, _, job in self._heap:
+            job.future.cancel()
+        self._heap.clear()
+        tasks = list(self._inflight)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
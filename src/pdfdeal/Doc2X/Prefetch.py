@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Iterable, Optional, Tuple
+
+import httpx
+
+from .ConvertV2 import preupload
+
+logger = logging.getLogger("pdfdeal.prefetch")
+
+
+class PreuploadPrefetcher:
+    """Request presigned OSS upload slots for queued files while other uploads are in flight.
+
+    A slot is the `(uid, url)` pair returned by `/v2/parse/preupload`. Slots are
+    keyed by file path, since the file name is sent with the request, and are
+    dropped once older than `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        apikey: str,
+        client: httpx.AsyncClient = None,
+        depth: int = 2,
+        ttl: float = 300,
+    ) -> None:
+        """
+        Args:
+            apikey (str): The key
+            client (httpx.AsyncClient, optional): The shared client. Defaults to None.
+            depth (int, optional): The maximum number of slots held or being requested. Defaults to 2.
+            ttl (float, optional): Seconds after which an unused slot is discarded. Defaults to 300.
+        """
+        self.apikey = apikey
+        self.client = client
+        self.depth = depth
+        self.ttl = ttl
+        self._slots = {}
+        self._pending = {}
+        self.used = 0
+        self.expired = 0
+
+    @property
+    def held(self) -> int:
+        """The number of ready slots which have not expired"""
+        self.discard_expired()
+        return len(self._slots)
+
+    def discard_expired(self) -> None:
+        """Drop slots older than `ttl`"""
+        now = time.monotonic()
+        for path, (_, _, created) in list(self._slots.items()):
+            if now - created > self.ttl:
+                del self._slots[path]
+                self.expired += 1
+
+    def prefetch(self, pdf_paths: Iterable[str]) -> None:
+        """Start requesting slots for the given files, in order, until `depth` slots are held or pending
+
+        Args:
+            pdf_paths (Iterable[str]): The next files in the queue
+        """
+        self.discard_expired()
+        for path in pdf_paths:
+            if len(self._slots) + len(self._pending) >= self.depth:
+                break
+            if path in self._slots or path in self._pending:
+                continue
+            self._pending[path] = asyncio.create_task(self._fetch(path))
+
+    async def _fetch(self, path: str) -> None:
+        try:
+            uid, url = await preupload(
+                self.apikey, os.path.basename(path), client=self.client
+            )
+            self._slots[path] = (uid, url, time.monotonic())
+        except Exception as e:
+            logger.debug(f"Failed to prefetch upload slot for {path}: {e}")
+        finally:
+            self._pending.pop(path, None)
+
+    async def take(self, pdf_path: str) -> Optional[Tuple[str, str]]:
+        """Take the slot of a file, waiting for it if it is still being requested
+
+        Args:
+            pdf_path (str): The pdf file path
+
+        Returns:
+            Optional[Tuple[str, str]]: The `(uid, url)` slot, or None if there is no usable one
+        """
+        task = self._pending.get(pdf_path)
+        if task is not None:
+            await asyncio.shield(task)
+        self.discard_expired()
+        slot = self._slots.pop(pdf_path, None)
+        if slot is None:
+            return None
+        self.used += 1
+        return slot[0], slot[1]
+
+    async def aclose(self) -> None:
+        """Cancel pending requests and drop all unused slots"""
+        for task in list(self._pending.values()):
+            task.cancel()
+        if self._pending:
+            await asyncio.gather(*self._pending.values(), return_exceptions=True)
+        self._pending.clear()
+        if self._slots:
+            logger.debug(f"Discarding {len(self._slots)} unused upload slot(s)")
+        self._slots.clear()
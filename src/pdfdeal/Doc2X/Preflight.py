@@ -0,0 +1,99 @@
+import logging
+import os
+from typing import NamedTuple, Optional
+
+from .Cache import file_digest
+from .Exception import RequestError
+from .Pages import PageCountMemo, pdf_info
+
+logger = logging.getLogger("pdfdeal.preflight")
+
+# Files checked at the same time, the work is mostly disk reads
+PREFLIGHT_WORKERS = 8
+HEADER_SIZE = 1024
+# Upload limits of the API
+MAX_DIRECT_SIZE = 300 * 1024**2
+MAX_OSS_SIZE = 1024**3
+
+
+class PreflightResult(NamedTuple):
+    """What is known about a file before it is uploaded"""
+
+    size: int
+    pages: Optional[int]
+    digest: Optional[str]
+    encrypted: bool
+    error: Optional[str] = None
+
+
+def _password_protected(pdf_path: str) -> bool:
+    """Whether an encrypted file can not be opened without a password"""
+    from pypdf import PdfReader
+
+    try:
+        with open(pdf_path, "rb") as f:
+            reader = PdfReader(f)
+            return reader.is_encrypted and not reader.decrypt("")
+    except Exception as e:
+        # Missing crypto support and the like, leave it to the server
+        logger.debug(f"Could not check the encryption of {pdf_path}: {e}")
+        return False
+
+
+def preflight(
+    pdf_path: str,
+    digest: bool = False,
+    max_size: int = MAX_OSS_SIZE,
+    page_limit: Optional[int] = 1000,
+    memo: Optional[PageCountMemo] = None,
+) -> PreflightResult:
+    """Check a PDF locally, so that a broken file fails before it touches the API
+
+    Blocking, run it in an executor.
+
+    Args:
+        pdf_path (str): The pdf file path
+        digest (bool, optional): Also compute the SHA-256 of the file. Defaults to False.
+        max_size (int, optional): The maximum file size in bytes. Defaults to 1GB, the limit of OSS uploads.
+        page_limit (int, optional): The maximum page count, None for no limit. Defaults to 1000.
+        memo (PageCountMemo, optional): Read and remember the page count in this memo. Defaults to None.
+
+    Returns:
+        PreflightResult: The size, page count, hash and encryption flag of the file, with `error` set if it should not be uploaded
+    """
+    try:
+        size = os.path.getsize(pdf_path)
+        with open(pdf_path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+    except OSError as e:
+        return PreflightResult(0, None, None, False, str(e))
+
+    def failed(code, message=None, pages=None, encrypted=False):
+        # Only the code and reason, there is no uid or trace id for a local check
+        error = RequestError(code, message=message).args[0]
+        return PreflightResult(size, pages, None, encrypted, error)
+
+    if b"%PDF-" not in header:
+        return failed("parse_file_not_pdf")
+    if size > max_size:
+        return failed("parse_file_too_large")
+
+    try:
+        pages, encrypted = pdf_info(pdf_path, memo)
+    except Exception as e:
+        # Only a file pypdf can not read either is invalid
+        logger.debug(f"Failed to read {pdf_path}: {e}")
+        return failed("parse_pdf_invalid")
+    if encrypted and _password_protected(pdf_path):
+        return failed(
+            "parse_pdf_invalid",
+            "parse_pdf_invalid: 文件已被密码保护 (The PDF is protected by a password)",
+            pages,
+            encrypted,
+        )
+    if page_limit is not None and pages > page_limit:
+        return failed("parse_file_page_limit", pages=pages)
+
+    return PreflightResult(
+        size, pages, file_digest(pdf_path) if digest else None, encrypted
+    )
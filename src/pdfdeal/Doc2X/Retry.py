@@ -0,0 +1,286 @@
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Dict, Optional
+
+import httpx
+
+from .Exception import FileError, RateLimit, RequestError
+from .Stats import record_retry
+from .Trace import reset_attempt, set_attempt
+
+logger = logging.getLogger("pdfdeal.retry")
+
+# Errors raised before the request reached the server, any operation can be sent again
+NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Errors which retrying can not fix
+PERMANENT = (RequestError, FileError, FileNotFoundError, ValueError)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a `Retry-After` header, given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """How one operation is retried.
+
+    Waits follow decorrelated jitter: each wait is drawn between `base` and three
+    times the previous one, at most `cap`, so tasks which failed together do not
+    retry together. A `Retry-After` from the server is waited for instead, with a
+    little jitter on top.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        base: float = 1,
+        cap: float = 30,
+        timeout: Optional[float] = 60,
+        idempotent: bool = True,
+        throttled: bool = True,
+    ) -> None:
+        """
+        Args:
+            attempts (int, optional): Attempts in total, 1 to never retry. Defaults to 3.
+            base (float, optional): The shortest wait in seconds. Defaults to 1.
+            cap (float, optional): The longest wait in seconds, unless the server asks for longer. Defaults to 30.
+            timeout (float, optional): Seconds allowed for each attempt, None to rely on the timeouts of the HTTP client. Defaults to 60.
+            idempotent (bool, optional): Whether repeating the operation is harmless. Only then errors after which the server may have done the work (timeouts, broken connections, server errors) are retried. Defaults to True.
+            throttled (bool, optional): Retry rate limited (HTTP 429) requests here, instead of leaving them to the caller. Defaults to True.
+        """
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.timeout = timeout
+        self.idempotent = idempotent
+        self.throttled = throttled
+
+    def retryable(self, error: BaseException) -> bool:
+        if isinstance(error, RateLimit):
+            # A capacity code means the task was refused, the caller starts it again
+            return self.throttled and error.code is None
+        if isinstance(error, PERMANENT):
+            return False
+        if isinstance(error, NOT_SENT):
+            return True
+        return self.idempotent
+
+    def backoff(self, previous: float) -> float:
+        """The next wait after waiting `previous` seconds"""
+        return min(self.cap, random.uniform(self.base, max(self.base, previous) * 3))
+
+    def delay(self, error: BaseException, previous: float) -> float:
+        """The wait before the next attempt after `error`"""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base)
+        return self.backoff(previous)
+
+
+class RetryBudget:
+    """Retries allowed as a fraction of the requests, shared by every client of the process.
+
+    Each request adds `ratio` of a retry to the budget and each retry takes one,
+    so when a failing API makes every request retry, retries stay near `ratio`
+    of the traffic instead of multiplying it. `min_per_second` retries are always
+    allowed so a quiet client can still recover.
+    """
+
+    def __init__(
+        self, ratio: float = 0.2, min_per_second: float = 1, max_tokens: float = 100
+    ) -> None:
+        """
+        Args:
+            ratio (float, optional): Retries allowed per request. Defaults to 0.2.
+            min_per_second (float, optional): Retries allowed per second whatever the traffic. Defaults to 1.
+            max_tokens (float, optional): The most retries saved up for a burst of failures. Defaults to 100.
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = float(max_tokens)
+        self.requests = 0
+        self.retries = 0
+        self.denied = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _add(self, tokens: float) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + tokens)
+
+    def on_request(self) -> None:
+        """Count a first attempt"""
+        with self._lock:
+            self.requests += 1
+            self._add(self.ratio)
+
+    def allow(self) -> bool:
+        """Take one retry from the budget
+
+        Returns:
+            bool: False if the budget is spent and the error should be raised instead
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._add((now - self._updated) * self.min_per_second)
+            self._updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.retries += 1
+                return True
+            self.denied += 1
+            return False
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "denied": self.denied,
+            "tokens": round(self.tokens, 2),
+        }
+
+
+_budget = RetryBudget()
+
+
+def default_budget() -> RetryBudget:
+    """The retry budget of the process"""
+    return _budget
+
+
+# Uploads create a parse task, they are only sent again when they surely did not
+# reach the server, and large files get no wall clock limit. A refused or rate
+# limited upload or parse is started again by `parse_pdf`, and a rate limited
+# conversion holds back all conversions of the client, both with the `parse` and
+# `convert` waits.
+DEFAULT_POLICIES = {
+    "upload": RetryPolicy(timeout=None, idempotent=False, throttled=False),
+    "preupload": RetryPolicy(timeout=30, throttled=False),
+    "put_oss": RetryPolicy(timeout=None),
+    "status": RetryPolicy(timeout=30),
+    "convert": RetryPolicy(base=2, timeout=30, throttled=False),
+    "result": RetryPolicy(timeout=30),
+    "download": RetryPolicy(timeout=None),
+    "parse": RetryPolicy(base=5, cap=60),
+}
+
+
+class RetryEngine:
+    """The retry policy of each operation and the retry budget they share"""
+
+    def __init__(
+        self,
+        policies: Dict[str, RetryPolicy] = None,
+        budget: RetryBudget = None,
+    ) -> None:
+        """
+        Args:
+            policies (Dict[str, RetryPolicy], optional): Policies replacing the defaults of `upload`, `preupload`, `put_oss`, `status`, `convert`, `result`, `download` or `parse` (the restart of a refused upload). Defaults to None.
+            budget (RetryBudget, optional): The budget of the retries. Defaults to the budget of the process.
+        """
+        self.policies = {**DEFAULT_POLICIES, **(policies or {})}
+        self.budget = budget or default_budget()
+
+    def policy(self, operation: str) -> RetryPolicy:
+        return self.policies.get(operation) or RetryPolicy()
+
+    def delay(
+        self, operation: str, error: BaseException, previous: float = 0
+    ) -> Optional[float]:
+        """The wait before retrying `operation` from the outside, e.g. a whole parse
+
+        Returns:
+            Optional[float]: Seconds to wait, None if the retry budget is spent
+        """
+        if not self.budget.allow():
+            logger.warning(f"Retry budget spent, not retrying {operation}")
+            return None
+        record_retry()
+        return self.policy(operation).delay(error, previous)
+
+    async def call(
+        self, operation: str, func, *args, policy: RetryPolicy = None, **kwargs
+    ):
+        """Await `func(*args, **kwargs)`, retrying it as the policy of `operation` allows"""
+        policy = policy or self.policy(operation)
+        self.budget.on_request()
+        wait = 0.0
+        for attempt in range(1, policy.attempts + 1):
+            token = set_attempt(attempt)
+            try:
+                if policy.timeout is None:
+                    return await func(*args, **kwargs)
+                return await asyncio.wait_for(func(*args, **kwargs), policy.timeout)
+            except Exception as e:
+                if attempt == policy.attempts or not policy.retryable(e):
+                    raise
+                if not self.budget.allow():
+                    logger.warning(
+                        f"Retry budget spent, not retrying {operation}: {type(e).__name__} {e}"
+                    )
+                    raise
+                wait = policy.delay(e, wait)
+                record_retry()
+                logger.warning(
+                    f"{operation} failed with {type(e).__name__} {e}, retry {attempt} in {wait:.1f} seconds..."
+                )
+                await asyncio.sleep(wait)
+            finally:
+                reset_attempt(token)
+
+
+_engine: ContextVar[Optional[RetryEngine]] = ContextVar("pdfdeal_retry", default=None)
+_default_engine = None
+
+
+def current_engine() -> RetryEngine:
+    """The engine of the running batch, the defaults outside of one"""
+    global _default_engine
+    engine = _engine.get()
+    if engine is None:
+        if _default_engine is None:
+            _default_engine = RetryEngine()
+        engine = _default_engine
+    return engine
+
+
+def use_engine(engine: RetryEngine) -> None:
+    """Retry the API calls of the running task, and the tasks it creates, with `engine`"""
+    _engine.set(engine)
+
+
+def retried(operation: str = None, policy: RetryPolicy = None):
+    """Decorator retrying an API call with the policy of `operation` in the current engine, or with `policy`"""
+
+    def decorator(func):
+        name = operation or func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await current_engine().call(
+                name, func, *args, policy=policy, **kwargs
+            )
+
+        return wrapper
+
+    return decorator
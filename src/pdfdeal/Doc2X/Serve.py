@@ -0,0 +1,418 @@
+"""A long-running conversion worker fed from a durable job queue.
+
+`serve` keeps one warm `Doc2X` client and runs up to `max_jobs` files through it
+at the same time. The files share the connection pool, the limiter, the page
+budget and the status poller of the client, so the API stays busy however the
+jobs are submitted. A small HTTP API on localhost submits jobs and reads their
+state and results:
+
+    doc2x serve --root ./doc2x-serve --port 8765
+
+    curl -X POST localhost:8765/jobs -d '{"path": "/data/paper.pdf", "output_format": "md"}'
+    curl -X POST "localhost:8765/jobs?name=paper&format=docx" \\
+        -H "Content-Type: application/pdf" --data-binary @paper.pdf
+    curl localhost:8765/jobs/<id>
+    curl -o paper.zip localhost:8765/jobs/<id>/result
+    curl -X DELETE localhost:8765/jobs/<id>
+    curl localhost:8765/stats
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import signal
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from urllib.parse import parse_qs, urlsplit
+
+from .Jobs import QUEUED, RUNNING, Job, JobQueue
+
+logger = logging.getLogger("pdfdeal.serve")
+
+# Bytes read from the request per chunk when a PDF is uploaded to the worker
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+class Worker:
+    """Run the jobs of a `JobQueue` through one client, at most `max_jobs` at a time.
+
+    Each job is one `pdf2file_stream` call with its own journal, so a job cut off
+    by a restart re-attaches to its upload instead of parsing the file again.
+    """
+
+    def __init__(
+        self,
+        client,
+        queue: JobQueue,
+        root: str,
+        max_jobs: int = 100,
+        poll_interval: float = 1,
+    ) -> None:
+        """
+        Args:
+            client (Doc2X): The client, kept open while the worker runs
+            queue (JobQueue): Where the jobs come from
+            root (str): The folder of the outputs (`output/<id>`), journals and uploaded PDFs
+            max_jobs (int, optional): The number of jobs in flight. Defaults to 100.
+            poll_interval (float, optional): Seconds between two looks at the queue when nobody calls `notify`, e.g. for jobs added by another process. Defaults to 1.
+        """
+        self.client = client
+        self.queue = queue
+        self.root = os.path.abspath(root)
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.running: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.started = None
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+
+    def output_dir(self, job_id: str) -> str:
+        return os.path.join(self.root, "output", job_id)
+
+    def journal_path(self, job_id: str) -> str:
+        return os.path.join(self.root, "journal", f"{job_id}.jsonl")
+
+    def spool_path(self, job_id: str) -> str:
+        return os.path.join(self.root, "spool", f"{job_id}.pdf")
+
+    def notify(self) -> None:
+        """Tell the worker that jobs were queued, safe to call from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def stop(self) -> None:
+        """Stop claiming jobs and put the running ones back into the queue, safe to call from any thread"""
+        self._stopping = True
+        self.notify()
+
+    @property
+    def stats(self) -> dict:
+        keys = self.client.keys
+        return {
+            "jobs": self.queue.counts(),
+            "running": len(self.running),
+            "completed": self.completed,
+            "seconds": round(time.monotonic() - self.started, 3) if self.started else 0,
+            "keys": keys.stats if len(keys) > 1 else self.client.limiter.stats,
+            "pages_in_flight": sum(key.page_budget.used for key in keys.keys),
+            "retries": self.client.retry.budget.stats,
+        }
+
+    async def run(self) -> None:
+        """Process jobs until `stop` is called"""
+        loop = asyncio.get_running_loop()
+        self._loop, self._wakeup = loop, asyncio.Event()
+        self.started = time.monotonic()
+        recovered = await loop.run_in_executor(None, self.queue.recover)
+        if recovered:
+            logger.info(f"Put {recovered} interrupted job(s) back into the queue")
+        async with self.client:
+            try:
+                while not self._stopping:
+                    # A submission while claiming sets it again, so no job is missed
+                    self._wakeup.clear()
+                    free = self.max_jobs - len(self.running)
+                    if free > 0:
+                        jobs = await loop.run_in_executor(None, self.queue.claim, free)
+                        for job in jobs:
+                            self.running[job.id] = asyncio.create_task(
+                                self._process(job)
+                            )
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                interrupted = list(self.running)
+                tasks = list(self.running.values())
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                if interrupted:
+                    await loop.run_in_executor(None, self.queue.requeue, interrupted)
+                    logger.info(
+                        f"Stopped with {len(interrupted)} job(s) in flight, they resume on the next start"
+                    )
+                self._loop = None
+
+    async def _process(self, job: Job) -> None:
+        loop = asyncio.get_running_loop()
+        journal = self.journal_path(job.id)
+        try:
+            deadline = None if job.deadline is None else job.deadline - time.time()
+            last = None
+            async for item in self.client.pdf2file_stream(
+                [job.pdf],
+                output_names=[job.output_name] if job.output_name else None,
+                output_path=self.output_dir(job.id),
+                output_format=job.output_format,
+                convert=job.convert,
+                journal=journal,
+                resume=job.attempts > 1,
+                priorities=[job.priority],
+                deadlines=[deadline],
+            ):
+                last = item
+            result, error, failed = last.result, last.error, last.failed
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result, error, failed = "", str(e) or type(e).__name__, True
+        try:
+            await loop.run_in_executor(
+                None, self.queue.finish, job.id, result, error, failed
+            )
+            self.completed += 1
+            for path in (journal, self.spool_path(job.id)):
+                if os.path.exists(path):
+                    os.remove(path)
+        finally:
+            self.running.pop(job.id, None)
+            self._wakeup.set()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "ServeHTTPServer"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, data, status=HTTPStatus.OK) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message: str) -> None:
+        self._send_json({"error": message}, status)
+
+    def _route(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        return parts, query
+
+    def do_GET(self):
+        parts, query = self._route()
+        queue = self.server.queue
+        if parts == ["stats"]:
+            return self._send_json(self.server.worker.stats)
+        if parts == ["jobs"]:
+            try:
+                limit = int(query.get("limit", 100))
+            except ValueError:
+                return self._error(HTTPStatus.BAD_REQUEST, "limit must be a number")
+            jobs = queue.list(query.get("state"), limit)
+            return self._send_json({"jobs": [job.to_dict() for job in jobs]})
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = queue.get(parts[1])
+            if job is None:
+                return self._error(HTTPStatus.NOT_FOUND, "No such job")
+            if len(parts) == 2:
+                return self._send_json(job.to_dict())
+            if parts[2] == "result":
+                return self._send_result(job, query)
+        self._error(HTTPStatus.NOT_FOUND, "Not found")
+
+    def _send_result(self, job: Job, query: dict) -> None:
+        if job.finished is None or job.result is None:
+            return self._send_json(
+                {"error": "The job is not done", "state": job.state},
+                HTTPStatus.CONFLICT,
+            )
+        result = job.result
+        if isinstance(result, list) and "index" in query:
+            try:
+                result = result[int(query["index"])]
+            except (ValueError, IndexError):
+                return self._error(HTTPStatus.BAD_REQUEST, "No such output index")
+        # Files are sent as they are, text outputs and several formats as JSON
+        if not (isinstance(result, str) and result and os.path.isfile(result)):
+            return self._send_json({"result": result, "error": job.error})
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(result)))
+        self.send_header(
+            "Content-Disposition",
+            f'attachment; filename="{os.path.basename(result)}"',
+        )
+        self.end_headers()
+        with open(result, "rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_POST(self):
+        parts, query = self._route()
+        if parts != ["jobs"]:
+            return self._error(HTTPStatus.NOT_FOUND, "Not found")
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            return self._error(HTTPStatus.BAD_REQUEST, "Bad Content-Length")
+        worker, queue = self.server.worker, self.server.queue
+        try:
+            if self.headers.get_content_type() == "application/pdf":
+                job = self._spool(length, query)
+            else:
+                options = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(options, dict) or "path" not in options:
+                    raise ValueError("The job needs the `path` of a PDF file")
+                path = os.path.abspath(str(options["path"]))
+                if not os.path.isfile(path):
+                    raise ValueError(f"No such file: {path}")
+                job = queue.submit(
+                    path,
+                    output_format=str(options.get("output_format", "md_dollar")),
+                    output_name=_output_name(options.get("output_name")),
+                    convert=bool(options.get("convert", False)),
+                    priority=_integer(options.get("priority"), "priority"),
+                    deadline=_number(options.get("deadline"), "deadline"),
+                )
+        except ValueError as e:
+            return self._error(HTTPStatus.BAD_REQUEST, str(e))
+        worker.notify()
+        self._send_json(job.to_dict(), HTTPStatus.CREATED)
+
+    def _spool(self, length: int, query: dict) -> Job:
+        """Write an uploaded PDF to the spool folder of the worker and queue it"""
+        worker = self.server.worker
+        # Check the options before reading the body, a bad request leaves nothing behind
+        options = dict(
+            output_format=query.get("format", "md_dollar"),
+            output_name=_output_name(query.get("name")),
+            convert=query.get("convert", "").lower() in ("1", "true"),
+            priority=_integer(query.get("priority"), "priority"),
+            deadline=_number(query.get("deadline"), "deadline"),
+        )
+        job_id = JobQueue.new_id()
+        path = worker.spool_path(job_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path, "wb") as f:
+                left = length
+                while left > 0:
+                    chunk = self.rfile.read(min(SPOOL_CHUNK_SIZE, left))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    left -= len(chunk)
+            if left:
+                raise ValueError("The upload was cut off")
+            return self.server.queue.submit(path, job_id=job_id, **options)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._error(HTTPStatus.NOT_FOUND, "Not found")
+        queue = self.server.queue
+        if queue.cancel(parts[1]):
+            return self._send_json(queue.get(parts[1]).to_dict())
+        job = queue.get(parts[1])
+        if job is None:
+            return self._error(HTTPStatus.NOT_FOUND, "No such job")
+        self._send_json(
+            {"error": "Only queued jobs can be cancelled", "state": job.state},
+            HTTPStatus.CONFLICT,
+        )
+
+
+def _number(value, name: str):
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+
+
+def _integer(value, name: str) -> int:
+    if value in (None, ""):
+        return 0
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+
+
+def _output_name(value):
+    """The output name of a job, a plain file name inside the output folder of the job"""
+    if value in (None, ""):
+        return None
+    if not isinstance(value, str):
+        raise ValueError("output_name must be a string")
+    if any(part in value for part in ("/", "\\", "\0", "..")) or value == ".":
+        raise ValueError("output_name must be a file name without a path")
+    return value
+
+
+class ServeHTTPServer(ThreadingHTTPServer):
+    """The HTTP API of a worker, each request is handled in its own thread"""
+
+    daemon_threads = True
+
+    def __init__(self, worker: Worker, host: str = "127.0.0.1", port: int = 8765):
+        self.worker = worker
+        self.queue = worker.queue
+        super().__init__((host, port), _Handler)
+
+
+def serve(
+    client,
+    root: str = "./doc2x-serve",
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    max_jobs: int = 100,
+) -> None:
+    """Run a worker and its HTTP API until SIGINT or SIGTERM
+
+    Args:
+        client (Doc2X): The client to convert with
+        root (str, optional): The folder of the job queue (`jobs.sqlite`), the outputs, journals and uploaded PDFs. Defaults to "./doc2x-serve".
+        host (str, optional): The address to listen on, keep it local, the API has no authentication. Defaults to "127.0.0.1".
+        port (int, optional): The port to listen on. Defaults to 8765.
+        max_jobs (int, optional): The number of jobs in flight. Defaults to 100.
+    """
+    queue = JobQueue(os.path.join(root, "jobs.sqlite"))
+    worker = Worker(client, queue, root, max_jobs=max_jobs)
+    server = ServeHTTPServer(worker, host, port)
+    thread = threading.Thread(
+        target=server.serve_forever, name="pdfdeal-serve", daemon=True
+    )
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, worker.stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows, or not the main thread
+                pass
+        await worker.run()
+
+    thread.start()
+    counts = queue.counts()
+    logger.info(
+        f"Serving on http://{host}:{server.server_port}, {counts[QUEUED] + counts[RUNNING]} job(s) to do"
+    )
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        queue.close()
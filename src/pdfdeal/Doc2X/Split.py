@@ -0,0 +1,256 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import posixpath
+import re
+import sys
+import tempfile
+import weakref
+import zipfile
+from typing import Dict, List, Tuple
+
+from .Exception import FileError
+
+logger = logging.getLogger("pdfdeal.split")
+
+# Worker processes splitting or merging at the same time, pypdf holds the GIL while it works
+SPLIT_WORKERS = min(4, os.cpu_count() or 1)
+# Targets of markdown links and images, `](path)` or `](<path> "title")`, and html images
+MD_LINK = re.compile(r"(\]\(\s*<?)([^)\s>]+)(>?)")
+HTML_IMAGE = re.compile(r"(<img\b[^>]*?\bsrc=[\"'])([^\"']+)([\"'])", re.IGNORECASE)
+
+# The worker slots of each event loop
+_slots = weakref.WeakKeyDictionary()
+
+
+def _child_env() -> dict:
+    """The environment of a worker, with the folder of this copy of pdfdeal on its path"""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    path = os.environ.get("PYTHONPATH")
+    return {**os.environ, "PYTHONPATH": root + (os.pathsep + path if path else "")}
+
+
+async def in_process(task: str, *args):
+    """Run `split_pdf` (`split`) or `merge_outputs` (`merge`) in a new Python process
+
+    The work is CPU bound and pypdf holds the GIL, in a process of its own it runs in
+    parallel with the other files and leaves the event loop alone. The worker is a
+    fresh interpreter (`python -m pdfdeal.Doc2X.Split`) rather than a fork, forking a
+    client which runs threads can deadlock the child, and a spawned multiprocessing
+    worker would run the main script of the caller again. Falls back to a thread if
+    no process can be started.
+
+    Raises:
+        FileError: If the task failed in the worker
+    """
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(SPLIT_WORKERS)
+    async with slots:
+        try:
+            if not sys.executable:
+                raise OSError("No Python executable")
+            process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                __name__,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=_child_env(),
+            )
+        except (OSError, NotImplementedError) as e:
+            # E.g. an embedded interpreter, or a loop without subprocess support on Windows
+            logger.debug(f"No worker process for {task}, running it on a thread: {e}")
+            return await loop.run_in_executor(None, TASKS[task], *args)
+        try:
+            out, err = await process.communicate(
+                json.dumps({"task": task, "args": args}).encode("utf-8")
+            )
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+    try:
+        reply = json.loads(out)
+    except ValueError:
+        logger.warning(
+            f"The {task} worker process failed, running it on a thread: {err.decode(errors='replace')[-1000:]}"
+        )
+        return await loop.run_in_executor(None, TASKS[task], *args)
+    if "error" in reply:
+        raise FileError(reply["error"])
+    result = reply["result"]
+    return [tuple(part) for part in result] if task == "split" else result
+
+
+def split_pdf(
+    pdf_path: str, chunk_pages: int, target_dir: str
+) -> List[Tuple[str, int, int]]:
+    """Cut a PDF into parts of at most `chunk_pages` pages, of about the same size
+
+    Blocking, run it in an executor.
+
+    Args:
+        pdf_path (str): The pdf file path
+        chunk_pages (int): The maximum number of pages of a part
+        target_dir (str): Where to write the parts
+
+    Returns:
+        List[Tuple[str, int, int]]: The path, index of the first page and page count of each part
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(pdf_path)
+    total = len(reader.pages)
+    count = math.ceil(total / chunk_pages)
+    size = math.ceil(total / count)
+    name = os.path.splitext(os.path.basename(pdf_path))[0]
+    parts = []
+    for number, first in enumerate(range(0, total, size), 1):
+        writer = PdfWriter()
+        for page in reader.pages[first : first + size]:
+            writer.add_page(page)
+        path = os.path.join(target_dir, f"{name}_part{number}.pdf")
+        with open(path, "wb") as f:
+            writer.write(f)
+        parts.append((path, first, len(writer.pages)))
+    return parts
+
+
+def merge_parsed(
+    parts: List[Tuple[str, List[str], List[dict]]], first_pages: List[int]
+) -> Tuple[List[str], List[str], List[dict]]:
+    """Stitch the parse results of the parts back into one file
+
+    Args:
+        parts (List[Tuple[str, List[str], List[dict]]]): The uid, texts and locations of each part, in order
+        first_pages (List[int]): The index of the first page of each part
+
+    Returns:
+        Tuple[List[str], List[str], List[dict]]: The uids of the parts, the texts and the locations with `page_idx` of the whole file
+    """
+    uids, texts, locations = [], [], []
+    for (uid, part_texts, part_locations), first in zip(parts, first_pages):
+        uids.append(uid)
+        texts.extend(part_texts)
+        for location in part_locations:
+            location = dict(location)
+            location["page_idx"] = location.get("page_idx", 0) + first
+            locations.append(location)
+    return uids, texts, locations
+
+
+def _relink(text: str, renamed: Dict[str, str]) -> str:
+    """Point the links and images of a markdown text at renamed files, nothing else is touched"""
+    if not renamed:
+        return text
+
+    def replace(match):
+        target = renamed.get(match.group(2))
+        if target is None:
+            return match.group(0)
+        return match.group(1) + target + match.group(3)
+
+    return HTML_IMAGE.sub(replace, MD_LINK.sub(replace, text))
+
+
+def _merge_md(sources: List[zipfile.ZipFile], target: zipfile.ZipFile, name: str):
+    texts = []
+    used = set()
+    for number, source in enumerate(sources, 1):
+        renamed = {}
+        for info in source.infolist():
+            if info.is_dir() or info.filename.endswith(".md"):
+                continue
+            new_name = info.filename
+            if new_name in used:
+                folder, base = posixpath.split(new_name)
+                new_name = posixpath.join(folder, f"part{number}_{base}")
+                renamed[info.filename] = new_name
+            used.add(new_name)
+            target.writestr(new_name, source.read(info))
+        for info in source.infolist():
+            if info.filename.endswith(".md"):
+                texts.append(_relink(source.read(info).decode("utf-8"), renamed))
+    target.writestr(f"{name}.md", "\n\n".join(texts))
+
+
+def merge_outputs(
+    fmt: str, paths: List[str], target_folder: str, target_filename: str
+) -> str:
+    """Merge the converted files of the parts of a split PDF
+
+    `md` / `md_dollar` zips are merged into one markdown file with the images of all
+    parts. `tex` and `docx` can not be joined reliably, their parts are bundled into
+    one zip as `part1/`, `part2/`... and `<name>_part1.docx`...
+
+    Args:
+        fmt (str): The output format
+        paths (List[str]): The downloaded file of each part, in order
+        target_folder (str): The folder where the file should be saved.
+        target_filename (str): The desired filename, can include subdirectories.
+
+    Returns:
+        str: The full path of the merged zip
+    """
+    from .ConvertV2 import reserve_path
+
+    target_path = os.path.join(target_folder, target_filename)
+    target_dir = os.path.dirname(target_path)
+    filename = os.path.splitext(os.path.basename(target_path))[0]
+    os.makedirs(target_dir, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(
+        prefix=f".{filename}.", suffix=".part", dir=target_dir
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as target:
+                if fmt == "docx":
+                    for number, path in enumerate(paths, 1):
+                        target.write(path, f"{filename}_part{number}.docx")
+                else:
+                    sources = [zipfile.ZipFile(path) for path in paths]
+                    try:
+                        if fmt in ("md", "md_dollar"):
+                            _merge_md(sources, target, filename)
+                        else:
+                            for number, source in enumerate(sources, 1):
+                                for info in source.infolist():
+                                    if not info.is_dir():
+                                        target.writestr(
+                                            f"part{number}/{info.filename}",
+                                            source.read(info),
+                                        )
+                    finally:
+                        for source in sources:
+                            source.close()
+        file_path = reserve_path(target_dir, filename, "zip")
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return file_path
+
+
+TASKS = {"split": split_pdf, "merge": merge_outputs}
+
+
+def _main() -> None:
+    """The worker of `in_process`, reads the task from stdin and writes the reply to stdout"""
+    request = json.loads(sys.stdin.buffer.read())
+    try:
+        reply = {"result": TASKS[request["task"]](*request["args"])}
+    except Exception as e:
+        reply = {"error": f"{type(e).__name__}: {e}"}
+    sys.stdout.write(json.dumps(reply))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,282 @@
+import json
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# Pipeline stages, in the order a file goes through them
+STAGES = ("preflight", "queue", "upload", "parse", "convert", "download")
+
+# The file the running task works on, set once per file task and inherited by its sub tasks
+_current: ContextVar[Optional["FileStats"]] = ContextVar(
+    "pdfdeal_file_stats", default=None
+)
+
+
+class FileStats:
+    """Where the time of one file went"""
+
+    __slots__ = (
+        "path",
+        "pages",
+        "timings",
+        "retries",
+        "rate_limits",
+        "bytes_sent",
+        "bytes_received",
+        "started",
+        "finished",
+        "failed",
+        "priority",
+        "deadline",
+    )
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.pages = 0
+        self.timings: Dict[str, float] = {}
+        self.retries = 0
+        self.rate_limits = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.failed = False
+        self.priority = 0
+        # Seconds after the start of the batch by which the file should be done
+        self.deadline = None
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "path": self.path,
+            "pages": self.pages,
+            "failed": self.failed,
+            "seconds": round((self.finished or time.monotonic()) - self.started, 3),
+            "timings": {stage: round(t, 3) for stage, t in self.timings.items()},
+            "retries": self.retries,
+            "rate_limits": self.rate_limits,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "priority": self.priority,
+            "deadline": self.deadline,
+        }
+
+
+def _quantiles(values: List[float], quantiles: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        f"p{int(q * 100)}": round(values[min(len(values) - 1, int(q * len(values)))], 3)
+        for q in quantiles
+    }
+
+
+class timed:
+    """Add the time spent in a `with` block to a stage of the current file"""
+
+    __slots__ = ("stage", "stats", "start")
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+
+    def __enter__(self):
+        self.stats = _current.get()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.stats is not None:
+            self.stats.add(self.stage, time.perf_counter() - self.start)
+
+
+def bind(stats: Optional[FileStats]) -> None:
+    """Make `stats` the current file of the running task and the tasks it creates"""
+    _current.set(stats)
+
+
+def record_retry() -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.retries += 1
+
+
+def record_rate_limit() -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.rate_limits += 1
+
+
+def record_bytes(sent: int = 0, received: int = 0) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.bytes_sent += sent
+        stats.bytes_received += received
+
+
+class BatchStats:
+    """Per file timings, retries, rate limit hits and transferred bytes of a batch
+
+    Filled while the batch runs, available as `BatchResult.stats`. Export it with
+    `to_json` or `to_prometheus`.
+    """
+
+    def __init__(self) -> None:
+        self.files: Dict[int, FileStats] = {}
+        self.started = time.monotonic()
+        self.finished = None
+
+    def file(self, index: int, path: str) -> FileStats:
+        """The stats of the file at `index` of the input, created on first use"""
+        stats = self.files.get(index)
+        if stats is None:
+            stats = self.files[index] = FileStats(path)
+        return stats
+
+    def finish(self) -> None:
+        self.finished = time.monotonic()
+
+    @property
+    def seconds(self) -> float:
+        """The wall time of the batch"""
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def pages(self) -> int:
+        return sum(f.pages for f in self.files.values())
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.seconds if self.seconds > 0 else 0.0
+
+    def totals(self) -> Dict[str, float]:
+        """The time of each stage, summed over all files"""
+        totals = dict.fromkeys(STAGES, 0.0)
+        for f in self.files.values():
+            for stage, seconds in f.timings.items():
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def percentiles(
+        self, stage: str, quantiles: List[float] = (0.5, 0.95, 0.99)
+    ) -> Dict[str, float]:
+        """The per file time of a stage at the given quantiles"""
+        return _quantiles(
+            [f.timings[stage] for f in self.files.values() if stage in f.timings],
+            quantiles,
+        )
+
+    def latency(self, f: FileStats) -> Optional[float]:
+        """Seconds from the start of the batch until the file was done, None while it runs"""
+        return None if f.finished is None else f.finished - self.started
+
+    def priorities(self, quantiles: List[float] = (0.5, 0.95, 0.99)) -> Dict[int, dict]:
+        """Latency percentiles and missed deadlines of the finished files of each priority, the highest first"""
+        groups: Dict[int, List[FileStats]] = {}
+        for f in self.files.values():
+            if f.finished is not None:
+                groups.setdefault(f.priority, []).append(f)
+        return {
+            priority: {
+                "files": len(files),
+                **_quantiles([self.latency(f) for f in files], quantiles),
+                "missed_deadlines": sum(
+                    1
+                    for f in files
+                    if f.deadline is not None and self.latency(f) > f.deadline
+                ),
+            }
+            for priority, files in sorted(groups.items(), reverse=True)
+        }
+
+    def to_dict(self, per_file: bool = True) -> dict:
+        files = self.files.values()
+        data = {
+            "files": len(self.files),
+            "failed": sum(f.failed for f in files),
+            "pages": self.pages,
+            "seconds": round(self.seconds, 3),
+            "pages_per_second": round(self.pages_per_second, 3),
+            "retries": sum(f.retries for f in files),
+            "rate_limits": sum(f.rate_limits for f in files),
+            "bytes_sent": sum(f.bytes_sent for f in files),
+            "bytes_received": sum(f.bytes_received for f in files),
+            "stages": {
+                stage: {"total": round(total, 3), **self.percentiles(stage)}
+                for stage, total in self.totals().items()
+            },
+            "priorities": {str(p): v for p, v in self.priorities().items()},
+        }
+        if per_file:
+            data["per_file"] = [self.files[i].to_dict() for i in sorted(self.files)]
+        return data
+
+    def to_json(self, per_file: bool = True, **kwargs) -> str:
+        return json.dumps(self.to_dict(per_file), ensure_ascii=False, **kwargs)
+
+    def to_prometheus(self, prefix: str = "pdfdeal") -> str:
+        """The batch totals in the Prometheus text exposition format"""
+        data = self.to_dict(per_file=False)
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        metric(
+            "files_total",
+            "counter",
+            "Files in the batch by outcome.",
+            [
+                ('{status="success"}', data["files"] - data["failed"]),
+                ('{status="failed"}', data["failed"]),
+            ],
+        )
+        metric(
+            "stage_seconds_total",
+            "counter",
+            "Time spent in each pipeline stage, summed over files.",
+            [(f'{{stage="{s}"}}', v["total"]) for s, v in data["stages"].items()],
+        )
+        for name, help in (
+            ("pages", "Pages parsed."),
+            ("retries", "Retried requests."),
+            ("rate_limits", "Rate limit responses."),
+            ("bytes_sent", "Bytes uploaded."),
+            ("bytes_received", "Bytes downloaded."),
+        ):
+            metric(f"{name}_total", "counter", help, [("", data[name])])
+        metric(
+            "file_latency_seconds",
+            "gauge",
+            "Seconds from the start of the batch until a file was done, by priority.",
+            [
+                (f'{{priority="{p}",quantile="0.{q[1:]}"}}', value)
+                for p, v in data["priorities"].items()
+                for q, value in v.items()
+                if q.startswith("p")
+            ],
+        )
+        metric(
+            "missed_deadlines_total",
+            "counter",
+            "Files done after their deadline, by priority.",
+            [
+                (f'{{priority="{p}"}}', v["missed_deadlines"])
+                for p, v in data["priorities"].items()
+            ],
+        )
+        metric(
+            "batch_seconds", "gauge", "Wall time of the batch.", [("", data["seconds"])]
+        )
+        metric(
+            "pages_per_second",
+            "gauge",
+            "Pages parsed per second of wall time.",
+            [("", data["pages_per_second"])],
+        )
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,256 @@
+import inspect
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+logger = logging.getLogger("pdfdeal.trace")
+
+# The tracer of the running batch and the attributes (batch, path, uid) every span gets
+_tracer: ContextVar[Optional["Tracer"]] = ContextVar("pdfdeal_tracer", default=None)
+_attributes: ContextVar[Optional[dict]] = ContextVar(
+    "pdfdeal_trace_attributes", default=None
+)
+_span: ContextVar[Optional["Span"]] = ContextVar("pdfdeal_span", default=None)
+_attempt: ContextVar[int] = ContextVar("pdfdeal_attempt", default=1)
+
+
+class SpanExporter:
+    """Receives the finished spans, subclass it to send them somewhere else than a file"""
+
+    def export(self, span: dict) -> None:
+        """Take one finished span, must not block the event loop"""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlSpanExporter(SpanExporter):
+    """Append the spans to a JSONL file from a background thread, like the batch journal
+
+    The file and the thread are opened by the first span, and again by the first span after `close`.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1) -> None:
+        """
+        Args:
+            path (str): The JSONL file, appended to
+            flush_interval (float, optional): Seconds between two batched writes. Defaults to 1.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._closed = threading.Event()
+        self._wake = threading.Event()
+
+    def export(self, span: dict) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                    self._closed.clear()
+                    self._thread = threading.Thread(
+                        target=self._write_loop, name="pdfdeal-trace", daemon=True
+                    )
+                    self._thread.start()
+        self._queue.put(span)
+
+    def _write_loop(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            closing = self._closed.is_set()
+            self._write()
+            if closing:
+                return
+
+    def _write(self) -> None:
+        lines, flushed = [], []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, threading.Event):
+                flushed.append(item)
+            else:
+                lines.append(json.dumps(item, ensure_ascii=False) + "\n")
+        if lines:
+            try:
+                self._file.writelines(lines)
+                self._file.flush()
+            except OSError as e:
+                logger.warning(f"Failed to write the trace {self.path}: {e}")
+        for event in flushed:
+            event.set()
+
+    def flush(self) -> None:
+        """Wait until the spans exported so far are written"""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        self._wake.set()
+        done.wait()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                return
+            self._closed.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+
+
+class Tracer:
+    """Turns spans into records for an exporter"""
+
+    def __init__(self, exporter: SpanExporter) -> None:
+        self.exporter = exporter
+
+    def emit(self, name: str, start: float, duration: float, **attributes) -> None:
+        """Export a span which was timed elsewhere
+
+        Args:
+            name (str): The operation, e.g. `api.uid_status` or `stage.parse`
+            start (float): The start as a unix timestamp
+            duration (float): The duration in seconds
+            **attributes: More attributes, None values are left out
+        """
+        record = {
+            "name": name,
+            "start": round(start, 6),
+            "duration": round(duration, 6),
+        }
+        record.update(_attributes.get() or {})
+        record.update(attributes)
+        try:
+            self.exporter.export({k: v for k, v in record.items() if v is not None})
+        except Exception as e:
+            logger.warning(f"Failed to export span {name}: {e}")
+
+
+class Span:
+    """A running span, `set` adds attributes learned on the way, like the server trace-id"""
+
+    __slots__ = ("tracer", "name", "attributes", "start", "clock", "token")
+
+    def __init__(self, tracer: Tracer, name: str, attributes: dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.clock = time.perf_counter()
+        self.token = _span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _span.reset(self.token)
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"[:300]
+        attributes = {"attempt": _attempt.get(), **self.attributes}
+        self.tracer.emit(
+            self.name, self.start, time.perf_counter() - self.clock, **attributes
+        )
+
+
+class _NoSpan:
+    """Stands in for a span when the batch is not traced"""
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str, **attributes):
+    """A span around a `with` block, a no-op unless the batch is traced"""
+    tracer = _tracer.get()
+    if tracer is None:
+        return _NO_SPAN
+    return Span(tracer, name, attributes)
+
+
+def annotate(**attributes) -> None:
+    """Add attributes to the innermost running span, if any"""
+    current = _span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def start_tracing(tracer: Tracer) -> str:
+    """Trace the running task and the tasks it creates with `tracer`, returns the new batch id"""
+    batch = uuid.uuid4().hex[:16]
+    _tracer.set(tracer)
+    _attributes.set({"batch": batch})
+    return batch
+
+
+def set_attributes(**attributes) -> None:
+    """Add attributes to the spans of the running task and the tasks it creates from now on"""
+    if _tracer.get() is not None:
+        _attributes.set({**(_attributes.get() or {}), **attributes})
+
+
+def emit_span(name: str, seconds: float, **attributes) -> None:
+    """Export a span which just ended after `seconds`, timed elsewhere"""
+    tracer = _tracer.get()
+    if tracer is not None:
+        tracer.emit(name, time.time() - seconds, seconds, **attributes)
+
+
+def set_attempt(attempt: int):
+    """Number the spans of a retried call, returns the token to reset it"""
+    return _attempt.set(attempt)
+
+
+def reset_attempt(token) -> None:
+    _attempt.reset(token)
+
+
+def traced(name: str):
+    """Decorate an API call of ConvertV2, each call (and each retry) is one span with its uid"""
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            tracer = _tracer.get()
+            if tracer is None:
+                return await func(*args, **kwargs)
+            uid = signature.bind_partial(*args, **kwargs).arguments.get("uid")
+            with Span(tracer, name, {"uid": uid} if uid else {}):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
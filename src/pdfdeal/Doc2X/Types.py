@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import Any, NamedTuple, Optional
 
 
 class OutputFormat(str, Enum):
@@ -64,3 +65,48 @@ class Support_File_Type(str, Enum):
         raise ValueError(
             f"{value} is not a valid {cls.__name__}, must be one of {', '.join([m.value for m in cls])}"
         )
+
+
+class BatchResult(tuple):
+    """The `(success_files, failed_files, has_error)` tuple returned by `pdf2file`, with batch statistics as attributes
+
+    Attributes:
+        cache_hits (int): Files whose parse result was taken from the result cache
+        cache_misses (int): Files which had to be uploaded and parsed
+        stats (BatchStats): Per file timings, retries and transferred bytes, None if not collected
+    """
+
+    def __new__(
+        cls,
+        success_files,
+        failed_files,
+        has_error,
+        cache_hits=0,
+        cache_misses=0,
+        stats=None,
+    ):
+        self = super().__new__(cls, (success_files, failed_files, has_error))
+        self.cache_hits = cache_hits
+        self.cache_misses = cache_misses
+        self.stats = stats
+        return self
+
+
+class FileResult(NamedTuple):
+    """The result of one file, yielded by `pdf2file_stream` as soon as the file is done
+
+    Attributes:
+        index (int): The position of the file in the input
+        path (str): The pdf file path
+        result (Any): The output file path or content, a list if several formats are requested
+        error (Any): The error message, "" on success, a list if several formats are requested
+        failed (bool): Whether any format failed
+        cached (Optional[bool]): Whether the parse result came from the result cache, None without a cache
+    """
+
+    index: int
+    path: str
+    result: Any
+    error: Any
+    failed: bool
+    cached: Optional[bool] = None
@@ -1,3 +1,32 @@
-from .doc2x import Doc2X
+import importlib
+import sys
+import types
+from typing import TYPE_CHECKING
 
 __all__ = ["Doc2X"]
+
+if TYPE_CHECKING:
+    from .doc2x import Doc2X
+
+
+class _Package(types.ModuleType):
+    """Import the client on first use, so `import pdfdeal` stays cheap
+
+    A property and not a module `__getattr__`: importing the `pdfdeal.Doc2X` subpackage
+    binds it to the same name, which would hide the client class from `__getattr__`.
+    """
+
+    @property
+    def Doc2X(self):
+        return importlib.import_module(".doc2x", __name__).Doc2X
+
+    @Doc2X.setter
+    def Doc2X(self, value):
+        # Set by the import system for the subpackage, the name stays the client class
+        pass
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(__all__))
+
+
+sys.modules[__name__].__class__ = _Package
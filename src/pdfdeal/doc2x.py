@@ -1,17 +1,65 @@
 import asyncio
+import itertools
 import os
-from typing import Tuple, List
+import shutil
+import tempfile
+import threading
+import weakref
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional, Tuple, List, Union
 import logging
+import httpx
 from .Doc2X.ConvertV2 import (
+    Base_URL,
+    new_client,
+    UPLOAD_CHUNK_SIZE,
     upload_pdf,
-    uid_status,
     convert_parse,
-    get_convert_result,
     download_file,
+    md_to_dollar,
+)
+from .Doc2X.Types import OutputFormat, BatchResult, FileResult
+from .Doc2X.Cache import ResultCache
+from .Doc2X.Export import LOCAL_FORMATS, export_markdown
+from .Doc2X import Journal
+from .Doc2X.Journal import BatchJournal, FileState
+from .Doc2X.Prefetch import PreuploadPrefetcher
+from .Doc2X.Poll import PollPolicy, PollStats, AdaptivePoll
+from .Doc2X.Poller import StatusPoller
+from .Doc2X.Limiter import ConcurrencyLimiter, AIMDLimiter, TokenBucket
+from .Doc2X.Keys import ApiKey, KeyPool
+from .Doc2X.Retry import (
+    RetryBudget,
+    RetryEngine,
+    RetryPolicy,
+    current_engine,
+    use_engine,
+)
+from .Doc2X.Pages import PageCountMemo, default_memo
+from .Doc2X.Preflight import (
+    MAX_DIRECT_SIZE,
+    MAX_OSS_SIZE,
+    PREFLIGHT_WORKERS,
+    PreflightResult,
+    preflight,
+)
+from .Doc2X.Split import in_process, merge_parsed
+from .Doc2X.Stats import BatchStats, bind, record_rate_limit, timed
+from .Doc2X.Trace import (
+    JsonlSpanExporter,
+    SpanExporter,
+    Tracer,
+    emit_span,
+    set_attributes,
+    span,
+    start_tracing,
+)
+from .Doc2X.Exception import (
+    RequestError,
+    RateLimit,
+    background_loop,
+    run_async,
+    iter_async,
 )
-from .Doc2X.Types import OutputFormat
-from .Doc2X.Pages import get_pdf_page_count
-from .Doc2X.Exception import RequestError, RateLimit, run_async
 from .FileTools.file_tools import get_files
 import time
 
@@ -22,65 +70,125 @@ async def parse_pdf(
     apikey: str,
     pdf_path: str,
     maxretry: int,
-    wait_time: int,
+    wait_time: Optional[float],
     max_time: int,
     convert: bool,
     oss_choose: str = "auto",
+    client: httpx.AsyncClient = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    prefetcher: PreuploadPrefetcher = None,
+    pages: int = None,
+    poller: StatusPoller = None,
+    limiter: ConcurrencyLimiter = None,
+    uid: str = None,
+    on_upload: Callable[[str], None] = None,
 ) -> Tuple[str, List[str], List[dict]]:
-    """Parse PDF file and return uid and extracted text"""
-
-    async def task_limit_lock():
-        global full_speed
-        if full_speed:
-            global limit_lock, get_max_limit, max_threads, thread_min
-            nonlocal thread_lock
-            if not get_max_limit and not thread_lock:
-                get_max_limit = True
-                thread_lock = True
-                async with limit_lock:
-                    max_threads = max(thread_min, max_threads - 1)
-            else:
-                if not thread_lock:
-                    async with limit_lock:
-                        max_threads = max(thread_min, max_threads - 1)
-                    thread_lock = True
+    """Parse PDF file and return uid and extracted text
+
+    Give `uid` to re-attach to a file uploaded before, it is uploaded again if the uid fails.
+    `on_upload` is called with the uid of each upload.
+    After a rate limit it waits `wait_time` seconds, or if None as the `parse` policy of the
+    current retry engine says, within its retry budget.
+    """
+    if poller is None:
+        async with StatusPoller(client=client) as poller:
+            return await parse_pdf(
+                apikey=apikey,
+                pdf_path=pdf_path,
+                maxretry=maxretry,
+                wait_time=wait_time,
+                max_time=max_time,
+                convert=convert,
+                oss_choose=oss_choose,
+                client=client,
+                chunk_size=chunk_size,
+                prefetcher=prefetcher,
+                pages=pages,
+                poller=poller,
+                limiter=limiter,
+                uid=uid,
+                on_upload=on_upload,
+            )
+
+    engine = current_engine()
+    waited = 0.0
+
+    async def rate_limited(error: RateLimit) -> None:
+        nonlocal waited
+        record_rate_limit()
+        if limiter is not None:
+            limiter.on_rate_limit()
+        if wait_time is not None:
+            await asyncio.sleep(wait_time)
+            return
+        delay = engine.delay("parse", error, waited)
+        if delay is None:
+            raise RequestError(
+                "Retry budget spent for parse_pdf, too many requests are failing, try again later."
+            )
+        waited = delay
+        await asyncio.sleep(delay)
 
-    thread_lock = False
     for attempt in range(maxretry):
         try:
-            logger.info(f"Uploading {pdf_path}...")
-            uid = await upload_pdf(apikey, pdf_path, oss_choose)
-            logger.info(f"Uploading successful for {pdf_path} with uid {uid}")
+            start = time.monotonic()
+            resumed = uid is not None
+            if resumed:
+                logger.info(f"Re-attaching to {pdf_path} with uid {uid}")
+            else:
+                logger.info(f"Uploading {pdf_path}...")
+                with timed("upload"), span("stage.upload", attempt=attempt + 1):
+                    slot = await prefetcher.take(pdf_path) if prefetcher else None
+                    uid = await upload_pdf(
+                        apikey,
+                        pdf_path,
+                        oss_choose,
+                        client=client,
+                        chunk_size=chunk_size,
+                        slot=slot,
+                    )
+                logger.info(f"Uploading successful for {pdf_path} with uid {uid}")
+                set_attributes(uid=uid)
+                if on_upload is not None:
+                    on_upload(uid)
 
-            for _ in range(max_time // 3):
-                try:
-                    progress, status, texts, locations = await uid_status(
-                        apikey, uid, convert
+            try:
+                with timed("parse"), span("stage.parse", uid=uid, attempt=attempt + 1):
+                    texts, locations = await asyncio.wait_for(
+                        poller.poll_parse(apikey, uid, convert, pages, key=pdf_path),
+                        timeout=max_time,
                     )
-                    if status == "Success":
-                        logger.info(f"Parsing successful for {pdf_path} with uid {uid}")
-                        return uid, texts, locations
-                    elif status == "Processing file":
-                        logger.info(f"Processing {uid} : {progress}%")
-                        await asyncio.sleep(3)
-                    else:
-                        raise RequestError(
-                            f"Unexpected status: {status} with uid: {uid}"
-                        )
-                except RateLimit:
+            except asyncio.TimeoutError:
+                raise RequestError(f"Max time reached for uid_status with uid: {uid}")
+            except RequestError as e:
+                if not resumed:
+                    raise
+                logger.warning(
+                    f"Failed to re-attach to uid {uid}, uploading again: {str(e)}"
+                )
+                uid = None
+                continue
+            except RateLimit as e:
+                if e.code is None:
+                    # Only the status requests were throttled, the task is still running
+                    logger.warning(
+                        "Rate limit reached during status check, polling again..."
+                    )
+                else:
                     logger.warning(
                         "Rate limit reached during status check, retrying from upload..."
                     )
-                    await task_limit_lock()
-                    await asyncio.sleep(wait_time)
-                    break
-            else:
-                raise RequestError(f"Max time reached for uid_status with uid: {uid}")
-        except RateLimit:
+                    uid = None
+                await rate_limited(e)
+                continue
+            logger.info(f"Parsing successful for {pdf_path} with uid {uid}")
+            if limiter is not None:
+                limiter.on_success((time.monotonic() - start) / (pages or 1))
+            return uid, texts, locations
+        except RateLimit as e:
             if attempt < maxretry - 1:
-                await task_limit_lock()
                 logger.warning("Rate limit reached during upload, retrying...")
-                await asyncio.sleep(wait_time)
+                await rate_limited(e)
             else:
                 raise RequestError(
                     "Max retry reached for parse_pdf, this may be a rate limit issue, try to reduce the number of threads."
@@ -89,6 +197,46 @@ async def parse_pdf(
     raise RequestError("Failed to parse PDF after maximum retries")
 
 
+async def convert_to_url(
+    apikey: str,
+    uid: str,
+    output_format: str,
+    max_time: int,
+    client: httpx.AsyncClient = None,
+    pages: int = None,
+    poller: StatusPoller = None,
+) -> str:
+    """Convert parsed PDF to specified format and return the download url"""
+    if poller is None:
+        async with StatusPoller(client=client) as poller:
+            return await convert_to_url(
+                apikey=apikey,
+                uid=uid,
+                output_format=output_format,
+                max_time=max_time,
+                client=client,
+                pages=pages,
+                poller=poller,
+            )
+
+    logger.info(f"Converting {uid} to {output_format}...")
+    with timed("convert"), span("stage.convert", uid=uid, format=output_format):
+        status, url = await convert_parse(apikey, uid, output_format, client=client)
+        if status == "Processing":
+            logger.info(f"Converting {uid} {output_format} file...")
+            try:
+                url = await asyncio.wait_for(
+                    poller.poll_convert(apikey, uid, pages), timeout=max_time
+                )
+            except asyncio.TimeoutError:
+                raise RequestError(
+                    f"Max time reached for get_convert_result with uid: {uid}"
+                )
+        elif status != "Success":
+            raise RequestError(f"Unexpected status: {status} with uid: {uid}")
+    return url
+
+
 async def convert_to_format(
     apikey: str,
     uid: str,
@@ -96,67 +244,180 @@ async def convert_to_format(
     output_path: str,
     output_name: str,
     max_time: int,
+    client: httpx.AsyncClient = None,
+    pages: int = None,
+    poller: StatusPoller = None,
 ) -> str:
     """Convert parsed PDF to specified format"""
+    url = await convert_to_url(
+        apikey=apikey,
+        uid=uid,
+        output_format=output_format,
+        max_time=max_time,
+        client=client,
+        pages=pages,
+        poller=poller,
+    )
+    logger.info(f"Downloading {uid} {output_format} file to {output_path}...")
+    return await download_file(
+        url=url,
+        file_type=output_format,
+        target_folder=output_path,
+        target_filename=output_name or uid,
+        client=client,
+    )
 
-    logger.info(f"Converting {uid} to {output_format}...")
-    status, url = await convert_parse(apikey, uid, output_format)
-    for _ in range(max_time // 3):
-        if status == "Success":
-            logger.info(f"Downloading {uid} {output_format} file to {output_path}...")
-            return await download_file(
-                url=url,
-                file_type=output_format,
-                target_folder=output_path,
-                target_filename=output_name or uid,
-            )
-        elif status == "Processing":
-            logger.info(f"Converting {uid} {output_format} file...")
-            await asyncio.sleep(3)
-            status, url = await get_convert_result(apikey, uid)
-        else:
-            raise RequestError(f"Unexpected status: {status} with uid: {uid}")
-    raise RequestError(f"Max time reached for get_convert_result with uid: {uid}")
+
+class _Pool:
+    """The connection pool and status poller of a client on one event loop"""
+
+    __slots__ = ("client", "poller", "users", "held")
+
+    def __init__(self, client: httpx.AsyncClient, poller: StatusPoller) -> None:
+        self.client = client
+        self.poller = poller
+        self.users = 0
+        # Kept open by the synchronous methods until `close`
+        self.held = False
 
 
 class Doc2X:
     def __init__(
         self,
-        apikey: str = None,
+        apikey: Union[str, List[str]] = None,
         thread: int = 5,
         max_pages: int = 1000,
         retry_time: int = 5,
         max_time: int = 300,
         debug: bool = False,
         full_speed: bool = False,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30,
+        upload_chunk_size: int = UPLOAD_CHUNK_SIZE,
+        prefetch: int = 0,
+        prefetch_ttl: float = 300,
+        poll_policy: PollPolicy = None,
+        poll_rps: float = 10,
+        limiter: ConcurrencyLimiter = None,
+        admission="fifo",
+        lookahead: int = 100,
+        cache=None,
+        cache_size: int = 2 * 1024**3,
+        page_memo=None,
+        convert_rps: float = 10,
+        local_md: bool = False,
+        fetch_images: bool = True,
+        split_pages: int = 0,
+        priority_aging: float = 60,
+        retry_policies: Dict[str, RetryPolicy] = None,
+        retry_budget: RetryBudget = None,
+        trace: Union[str, SpanExporter] = None,
+        base_url: str = None,
+        transport: httpx.AsyncBaseTransport = None,
     ) -> None:
         """
         Initialize a Doc2X client.
 
         Args:
-            apikey (str, optional): The API key for Doc2X. If not provided, it will try to get from environment variable 'DOC2X_APIKEY'.
-            thread (int, optional): The maximum number of concurrent threads at same time. Defaults to 5.
-            max_pages (int, optional): The maximum number of pages to process at same time. Defaults to 1000.
+            apikey (str | List[str], optional): The API key for Doc2X, or several keys (a list, or one string separated by commas) to use as one client. If not provided, it will try to get from environment variable 'DOC2X_APIKEY'. With several keys each key has its own `thread`, `max_pages` and limiter, new uploads go to the least loaded key, every later call for a file goes to the key which uploaded it, and a key out of quota (`parse_quota_limit`) is no longer used. Prefetched upload slots are only used with a single key.
+            thread (int, optional): The maximum number of concurrent threads at same time, per API key. Defaults to 5.
+            max_pages (int, optional): The maximum number of pages to process at same time, per API key. Defaults to 1000.
             retry_time (int, optional): The number of retry attempts. Defaults to 5.
             max_time (int, optional): The maximum time (in seconds) to wait for a response. Defaults to 300.
             debug (bool, optional): Whether to enable debug logging. Defaults to False.
-            full_speed (bool, optional): **Experimental function**. Whether to enable automatic sniffing of the concurrency limit. Defaults to False.
+            full_speed (bool, optional): **Experimental function**. Whether to enable automatic sniffing of the concurrency limit, using an `AIMDLimiter` starting at `thread`. Defaults to False.
+            max_connections (int, optional): The maximum number of connections in the shared HTTP/2 pool. Defaults to 100.
+            max_keepalive_connections (int, optional): The maximum number of idle connections kept alive in the pool. Defaults to 20.
+            keepalive_expiry (float, optional): Seconds an idle connection is kept alive. Defaults to 30.
+            upload_chunk_size (int, optional): Bytes read from disk per chunk when streaming a PDF upload, bounds the memory used by each upload. Defaults to 1MB.
+            prefetch (int, optional): The number of OSS upload slots requested ahead for queued files when `oss_choose` is `always`, 0 to disable. Defaults to 0.
+            prefetch_ttl (float, optional): Seconds after which an unused prefetched upload slot is discarded. Defaults to 300.
+            poll_policy (PollPolicy, optional): How to schedule parse/convert status polls, e.g. `FixedPoll(3)` for the old fixed interval. Defaults to `AdaptivePoll()`.
+            poll_rps (float, optional): The maximum number of status polls per second shared by all in-flight files, 0 for no limit. Defaults to 10.
+            limiter (ConcurrencyLimiter, optional): Decides how many files are processed at the same time, its live `stats` can be read while a batch runs. Each further API key gets a copy of it, see `keys.stats`. Defaults to a fixed limit of `thread`, or an `AIMDLimiter` if `full_speed` is set.
+            admission (str | AdmissionPolicy, optional): Which queued file gets into the `max_pages` budget first: `fifo`, `smallest`, `largest` (shortest makespan), `best_fit` or an `AdmissionPolicy`. Defaults to "fifo".
+            lookahead (int, optional): The number of queued files the admission policy can choose from. Defaults to 100.
+            cache (bool | str | ResultCache, optional): Cache parse results and converted files on disk, keyed by the content of the PDF. `True` for `~/.cache/pdfdeal/results`, a folder path, or a `ResultCache`. Defaults to None (no cache).
+            cache_size (int, optional): The maximum size of the cache in bytes, least recently used entries are evicted. Defaults to 2GB.
+            page_memo (bool | str | PageCountMemo, optional): Remember the page count of each input in sqlite, keyed by its path, size and modification time, so a batch run again does not open the PDFs again. `True` for `pdfdeal/pages.sqlite` in `$XDG_CACHE_HOME` (`~/.cache` if unset), a file path, or a `PageCountMemo`. Defaults to None (no memo).
+            convert_rps (float, optional): The maximum number of conversion requests per second. All formats of a file are exported concurrently, with `md_dollar` derived from `md` when both are requested. Defaults to 10.
+            local_md (bool, optional): Build `md` / `md_dollar` zips locally from the parse result instead of converting and downloading them from the server. `md` still uses the server when `convert` is set, since the original formula delimiters are gone. Defaults to False.
+            fetch_images (bool, optional): With `local_md`, download the referenced images into `images/` of the zip like the server does, otherwise keep the remote links. Defaults to True.
+            split_pages (int, optional): Cut PDFs with more pages than this into parts of about equal size, parse the parts concurrently and merge the results, 0 to disable. This also lets files over the 1000 page limit be parsed. The `md` outputs are merged into one markdown file, `tex` and `docx` parts are bundled into one zip. Defaults to 0.
+            priority_aging (float, optional): Seconds a queued file waits before it moves up one priority level, so files of a low priority keep moving behind a stream of urgent ones, 0 to disable. Applies to the page budget, the default limiter and the convert rate limit. Defaults to 60.
+            retry_policies (Dict[str, RetryPolicy], optional): Replace the retry policy of an API operation: `upload`, `preupload`, `put_oss`, `status`, `convert`, `result`, `download`, or `parse` for restarting a rate limited file. Waits are jittered and follow `Retry-After`, uploads are only repeated when they did not reach the server. Defaults to None.
+            retry_budget (RetryBudget, optional): Caps the retries to a share of the requests, see `retry.budget.stats`. Defaults to one budget shared by every client of the process.
+            trace (str | SpanExporter, optional): Record a span for each API call and pipeline stage of a batch, with the file path, uid, server trace-id, attempt number and duration. A path appends them to a JSONL file from a background thread, a `SpanExporter` receives them instead. Defaults to None.
+            base_url (str, optional): The root of the v2 API. If not provided, it will try to get from environment variable 'DOC2X_BASE_URL', then use the public API.
+            transport (httpx.AsyncBaseTransport, optional): Send all requests of the client through this transport instead of the network, e.g. the mock server of the tests. Defaults to None.
 
         Raises:
             ValueError: If no API key is found.
 
         Note:
             If debug is set to True, it will set the logging level of 'pdfdeal' logger to DEBUG.
+            The client can be used as an async context manager (`async with Doc2X() as client:`) to keep the connection pool open across calls.
+            The synchronous methods keep the pool open on a background loop until `close()`.
         """
-        self.apikey = apikey or os.environ.get("DOC2X_APIKEY", "")
-        if not self.apikey:
-            raise ValueError("No apikey found")
+        apikey = apikey or os.environ.get("DOC2X_APIKEY", "")
         self.retry_time = retry_time
         self.max_time = max_time
         self.thread = thread
         self.max_pages = max_pages
         self.request_interval = 0.1
         self.full_speed = full_speed
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.upload_chunk_size = upload_chunk_size
+        self.prefetch = prefetch
+        self.prefetch_ttl = prefetch_ttl
+        self.poll_policy = poll_policy or AdaptivePoll()
+        self.poll_stats = PollStats()
+        self.poll_rps = poll_rps
+        if limiter is None:
+            limiter = (
+                AIMDLimiter(initial=thread, aging=priority_aging)
+                if full_speed
+                else ConcurrencyLimiter(thread, aging=priority_aging)
+            )
+        self.keys = KeyPool(apikey, limiter, max_pages, admission, priority_aging)
+        # The first key, for code which only knows about one
+        self.apikey = self.keys.keys[0].apikey
+        self.limiter = self.keys.keys[0].limiter
+        self.page_budget = self.keys.keys[0].page_budget
+        self.lookahead = lookahead
+        if cache is True:
+            cache = ResultCache(max_size=cache_size)
+        elif isinstance(cache, str):
+            cache = ResultCache(cache, max_size=cache_size)
+        self.cache = cache or None
+        if page_memo is True:
+            page_memo = default_memo()
+        elif isinstance(page_memo, str):
+            page_memo = PageCountMemo(page_memo)
+        self.page_memo = page_memo or None
+        self.convert_bucket = TokenBucket(convert_rps, aging=priority_aging)
+        self.retry = RetryEngine(retry_policies, retry_budget)
+        self.local_md = local_md
+        self.fetch_images = fetch_images
+        self.split_pages = min(split_pages, max_pages)
+        self.tracer = None
+        if trace is not None:
+            self.tracer = Tracer(
+                JsonlSpanExporter(trace) if isinstance(trace, str) else trace
+            )
+        # A trace file opened here is closed with the client, an exporter passed in belongs to the caller
+        self._owns_trace = isinstance(trace, str)
+        self.base_url = base_url or os.environ.get("DOC2X_BASE_URL") or Base_URL
+        self.transport = transport
+        # One connection pool per event loop, e.g. the background loop of the synchronous methods and the loop of the caller
+        self._pools = weakref.WeakKeyDictionary()
+        # The loop of the running batches, see `_enter_batch`
+        self._batch_loop = None
+        self._batches = 0
+        self._batch_lock = threading.Lock()
 
         handler = logging.StreamHandler()
         formatter = logging.Formatter(
@@ -170,6 +431,181 @@ class Doc2X:
             logging.getLogger("pdfdeal").setLevel(logging.DEBUG)
         self.debug = debug
 
+    def _current_pool(self) -> Optional[_Pool]:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Outside of a loop, e.g. between synchronous calls: the pool they keep open
+            return next((pool for pool in self._pools.values() if pool.held), None)
+        return self._pools.get(loop)
+
+    @property
+    def _client(self) -> Optional[httpx.AsyncClient]:
+        """The connection pool of the running loop"""
+        pool = self._current_pool()
+        return pool.client if pool else None
+
+    @property
+    def _poller(self) -> Optional[StatusPoller]:
+        """The status poller of the running loop"""
+        pool = self._current_pool()
+        return pool.poller if pool else None
+
+    async def _acquire_client(self) -> httpx.AsyncClient:
+        """Get the shared connection pool of the running loop, open it if this is the first user"""
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            client = new_client(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+                base_url=self.base_url,
+                transport=self.transport,
+            )
+            poller = StatusPoller(
+                client=client,
+                rps=self.poll_rps,
+                policy=self.poll_policy,
+                stats=self.poll_stats,
+            )
+            pool = self._pools[loop] = _Pool(client, poller)
+        pool.users += 1
+        return pool.client
+
+    async def _release_client(self) -> None:
+        """Release the shared connection pool, close it once nobody uses it"""
+        pool = self._pools.get(asyncio.get_running_loop())
+        if pool is None:
+            return
+        pool.users -= 1
+        if pool.users <= 0:
+            await self.aclose()
+
+    async def aclose(self) -> None:
+        """Close the shared connection pool of the running loop, and the trace file once no loop has a pool"""
+        loop = asyncio.get_running_loop()
+        pool = self._pools.pop(loop, None)
+        if pool is not None:
+            await pool.poller.aclose()
+            await pool.client.aclose()
+        # Another loop may still be tracing a batch, the file is closed with the last pool
+        if self._owns_trace and not self._pools:
+            try:
+                await loop.run_in_executor(None, self.tracer.exporter.close)
+            except RuntimeError:
+                # The executor is already shut down when the process exits
+                self.tracer.exporter.close()
+
+    async def _hold_client(self) -> None:
+        """Keep the pool open on the background loop between calls of the synchronous methods, until `close`"""
+        pool = self._pools.get(asyncio.get_running_loop())
+        if pool is None or not pool.held:
+            await self._acquire_client()
+            self._pools[asyncio.get_running_loop()].held = True
+            background_loop().register(self)
+
+    def close(self) -> None:
+        """Close the connection pool kept open by the synchronous methods and the trace file, they are reopened on the next call"""
+        if any(pool.held for pool in self._pools.values()):
+            run_async(self.aclose())
+        elif self._owns_trace and not self._pools:
+            self.tracer.exporter.close()
+
+    def _enter_batch(self) -> None:
+        """Count a batch of the running loop
+
+        The limiters, page budgets and token buckets of the client are shared by all its
+        batches and wake their waiters on the loop of the batch, so every batch running at
+        the same time must run on one loop. The connection pools are kept per loop.
+
+        Raises:
+            RuntimeError: If a batch of another event loop is still running
+        """
+        loop = asyncio.get_running_loop()
+        with self._batch_lock:
+            if self._batches and self._batch_loop is not loop:
+                raise RuntimeError(
+                    "This Doc2X client is running a batch on another event loop, "
+                    "wait for it to finish or use one client per event loop "
+                    "(the synchronous methods run on a background loop of their own)."
+                )
+            self._batch_loop = loop
+            self._batches += 1
+
+    def _leave_batch(self) -> None:
+        with self._batch_lock:
+            self._batches -= 1
+            if not self._batches:
+                self._batch_loop = None
+
+    async def __aenter__(self):
+        await self._acquire_client()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self._release_client()
+
+    async def pdf2file_stream(
+        self,
+        pdf_file,
+        output_names: List[str] = None,
+        output_path: str = "./Output",
+        output_format: str = "md_dollar",
+        convert: bool = False,
+        oss_choose: str = "auto",
+        journal: str = None,
+        resume: bool = False,
+        max_pending: int = 100,
+        stats: BatchStats = None,
+        priorities: List[int] = None,
+        deadlines: List[float] = None,
+    ) -> AsyncIterator[FileResult]:
+        """Convert PDF files like `pdf2file`, yielding each file as soon as all its formats are written.
+
+        Results come in completion order, use `FileResult.index` to match them with the input.
+        At most `max_pending` finished results are held for a slow consumer before the batch waits for it.
+        Give a `BatchStats` as `stats` to collect the timings of the batch.
+        Batches of one client share its limiters, so the batches running at the same time must run on
+        one event loop, a batch started from another loop (e.g. the synchronous methods) raises RuntimeError.
+        See `pdf2file` for the other arguments.
+
+        Yields:
+            FileResult: The index, pdf path, output, error and whether the file failed
+        """
+        self._enter_batch()
+        batch_journal = None
+        try:
+            batch_journal = BatchJournal(journal, resume=resume) if journal else None
+            client = await self._acquire_client()
+            stream = self._pdf2file_stream(
+                client=client,
+                pdf_file=pdf_file,
+                output_names=output_names,
+                output_path=output_path,
+                output_format=output_format,
+                convert=convert,
+                oss_choose=oss_choose,
+                journal=batch_journal,
+                max_pending=max_pending,
+                stats=stats,
+                priorities=priorities,
+                deadlines=deadlines,
+            )
+            try:
+                async for item in stream:
+                    yield item
+            finally:
+                await stream.aclose()
+                await self._release_client()
+        finally:
+            self._leave_batch()
+            if batch_journal is not None:
+                # Waits for the writer thread, which may sleep for a flush interval
+                await asyncio.get_running_loop().run_in_executor(
+                    None, batch_journal.close
+                )
+
     async def pdf2file_back(
         self,
         pdf_file,
@@ -178,7 +614,88 @@ class Doc2X:
         output_format: str = "md_dollar",
         convert: bool = False,
         oss_choose: str = "auto",
+        journal: str = None,
+        resume: bool = False,
+        priorities: List[int] = None,
+        deadlines: List[float] = None,
     ) -> Tuple[List[str], List[dict], bool]:
+        finished = {}
+        stats = BatchStats()
+        async for item in self.pdf2file_stream(
+            pdf_file=pdf_file,
+            output_names=output_names,
+            output_path=output_path,
+            output_format=output_format,
+            convert=convert,
+            oss_choose=oss_choose,
+            journal=journal,
+            resume=resume,
+            stats=stats,
+            priorities=priorities,
+            deadlines=deadlines,
+        ):
+            finished[item.index] = item
+        results = [finished[i] for i in range(len(finished))]
+
+        success_files = []
+        for r in results:
+            success_files.append(r.result)
+
+        failed_files = []
+        for r in results:
+            if r.failed:
+                failed_files.append({"error": r.error, "path": r.path})
+            else:
+                failed_files.append({"error": r.error, "path": ""})
+        has_error = any(r.failed for r in results)
+        if has_error:
+            logger.error(
+                f"Failed to convert {sum(1 for r in results if r.failed)} file(s), please enable DEBUG mode to check or read the output variable."
+            )
+            if self.debug:
+                if has_error:
+                    print("=====================")
+                    for fail in failed_files:
+                        if isinstance(fail["error"], list):
+                            for e in fail["error"]:
+                                if e != "":
+                                    print(
+                                        f"Failed to convert {fail['path']}: {e}\n====================="
+                                    )
+                        else:
+                            if fail["error"] != "":
+                                print(
+                                    f"Failed to convert {fail['path']}: {fail['error']}\n====================="
+                                )
+
+        logger.info(
+            f"Successfully converted {sum(1 for r in results if not r.failed)} file(s) and failed to convert {sum(1 for r in results if r.failed)} file(s)."
+        )
+        return BatchResult(
+            success_files,
+            failed_files,
+            has_error,
+            cache_hits=sum(1 for r in results if r.cached),
+            cache_misses=sum(1 for r in results if r.cached is False),
+            stats=stats,
+        )
+
+    async def _pdf2file_stream(
+        self,
+        client: httpx.AsyncClient,
+        pdf_file,
+        output_names: List[str],
+        output_path: str,
+        output_format: str,
+        convert: bool,
+        oss_choose: str,
+        journal: BatchJournal = None,
+        max_pending: int = 100,
+        stats: BatchStats = None,
+        priorities: List[int] = None,
+        deadlines: List[float] = None,
+    ) -> AsyncIterator[FileResult]:
+        stats = stats if stats is not None else BatchStats()
         if isinstance(pdf_file, str):
             if os.path.isdir(pdf_file):
                 pdf_file, output_names = get_files(
@@ -195,6 +712,14 @@ class Doc2X:
         output_names = output_names or [None] * len(pdf_file)
         if len(pdf_file) != len(output_names):
             raise ValueError("The length of files and output_names should be the same.")
+        priorities = [p or 0 for p in priorities or [0] * len(pdf_file)]
+        deadlines = deadlines or [None] * len(pdf_file)
+        if len(priorities) != len(pdf_file) or len(deadlines) != len(pdf_file):
+            raise ValueError(
+                "The length of files, priorities and deadlines should be the same."
+            )
+        # Deadlines count from the start of the batch stats, like the latencies
+        due = [None if d is None else stats.started + d for d in deadlines]
 
         output_formats = []
         if isinstance(output_format, str):
@@ -213,96 +738,463 @@ class Doc2X:
             if isinstance(fmt, OutputFormat):
                 fmt = fmt.value
 
-        # Track total pages and last request time
-        total_pages = 0
-        last_request_time = 0
-        page_lock = asyncio.Lock()
         parse_tasks = set()
         convert_tasks = set()
-        results = [None] * len(pdf_file)
-        parse_results = [None] * len(pdf_file)
-        global limit_lock, get_max_limit, max_threads, full_speed, thread_min
-        thread_min = self.thread
-        full_speed = self.full_speed
-        limit_lock = asyncio.Lock()
-        get_max_limit = False
-        max_threads = self.thread
-
-        if full_speed:
+        # Only files in flight keep state here, finished ones wait in `finished` for the consumer
+        finished = asyncio.Queue(max_pending)
+        converted_any = False
+        cache_hits = 0
+        cache_misses = 0
+        loop = asyncio.get_running_loop()
+        if self.full_speed:
             self.max_time = 600
             self.retry_time = 10
             self.request_interval = 0.01
 
-        async def process_file(index, pdf, name):
+        # Files which have not started uploading yet, in order, at most `lookahead` of them
+        queued = {}
+        window = asyncio.Semaphore(self.lookahead)
+        # The uids each file bound to a key, unbound when the file is done
+        bound = {}
+
+        def leave_queue(index):
+            if index in queued:
+                waited = time.perf_counter() - queued.pop(index)
+                stats.file(index, pdf_file[index]).add("queue", waited)
+                emit_span("stage.queue", waited)
+                window.release()
+
+        async def finish(index, result, error, failed, cached=None):
+            # Files with the same content share a cached uid, it stays bound until the last one is done
+            self.keys.unbind(
+                [
+                    uid
+                    for uid in bound.pop(index, [])
+                    if not any(uid in uids for uids in bound.values())
+                ]
+            )
+            file_stats = stats.file(index, pdf_file[index])
+            file_stats.finished = time.monotonic()
+            file_stats.failed = failed
+            emit_span(
+                "file",
+                file_stats.finished - file_stats.started,
+                path=pdf_file[index],
+                failed=failed,
+                pages=file_stats.pages,
+            )
+            await finished.put(
+                FileResult(index, pdf_file[index], result, error, failed, cached)
+            )
+
+        def start_convert(index, name, parsed, cache_key, state, cached):
+            nonlocal converted_any
+            converted_any = True
+            task = asyncio.create_task(
+                convert_file(index, name, parsed, cache_key, state, cached)
+            )
+            convert_tasks.add(task)
+            task.add_done_callback(convert_tasks.discard)
+
+        def record(index, state, **fields):
+            if journal is not None:
+                journal.record(pdf_file[index], state, **fields)
+
+        async def pace(key: ApiKey):
+            # Shared by the concurrent batches of the client
+            wait = key.reserve_upload(self.request_interval)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        def key_fields(uid):
+            # Which key a uid belongs to only matters with several keys
+            return {"key": self.keys.ids(uid)} if len(self.keys) > 1 else {}
+
+        prefetcher = None
+        if self.prefetch > 0 and len(self.keys) > 1:
+            # A slot binds its uid to a key before the file is routed
+            logger.warning("Prefetched upload slots are not used with several keys.")
+        elif self.prefetch > 0 and oss_choose == "always":
+            prefetcher = PreuploadPrefetcher(
+                apikey=self.apikey,
+                client=client,
+                depth=self.prefetch,
+                ttl=self.prefetch_ttl,
+            )
+
+        async def process_file(index, pdf, name, check):
+            # Everything this file's task and its sub tasks record goes to its stats
+            bind(stats.file(index, pdf))
+            set_attributes(path=pdf)
             try:
-                page_count = get_pdf_page_count(pdf)
-            except RequestError as e:
-                results[index] = ("", str(e), True)
-                logger.warning(f"Skiping {pdf}: {str(e)}")
-                return
+                await parse_file(index, pdf, name, check)
             except Exception as e:
-                logger.warning(f"Failed to get page count for {pdf}: {str(e)}")
-                page_count = self.max_pages - 1  #! Assume the worst case
-            if page_count > self.max_pages:
+                leave_queue(index)
+                await finish(index, "", str(e), True)
+
+        async def parse_file(index, pdf, name, check):
+            nonlocal cache_hits, cache_misses
+            cache_key = None
+            cached = None
+            if self.cache is not None:
+                try:
+                    cache_key = self.cache.key(pdf, convert, check.digest)
+                    hit = await loop.run_in_executor(None, self.cache.lookup, cache_key)
+                except OSError as e:
+                    logger.warning(f"Failed to look up {pdf} in the cache: {str(e)}")
+                    hit = None
+                cached = hit is not None
+                if cached:
+                    cache_hits += 1
+                    leave_queue(index)
+                    logger.info(f"Using cached result of {pdf}")
+                    uid, texts, locations, key_ids = hit
+                    if key_ids is not None:
+                        # The uid only converts with the key which uploaded it
+                        self.keys.restore(uid, key_ids)
+                        bound.setdefault(index, []).extend(
+                            uid if isinstance(uid, list) else [uid]
+                        )
+                    record(
+                        index,
+                        Journal.PARSED,
+                        uid=uid,
+                        pages=len(texts),
+                        **key_fields(uid),
+                    )
+                    start_convert(
+                        index,
+                        name,
+                        (uid, texts, locations),
+                        cache_key,
+                        FileState(),
+                        cached,
+                    )
+                    return
+                cache_misses += 1
+
+            state = FileState()
+            if journal is not None:
+                state = journal.state(pdf)
+                if state.uid and state.key:
+                    self.keys.restore(state.uid, state.key)
+                    uids = state.uid if isinstance(state.uid, list) else [state.uid]
+                    bound.setdefault(index, []).extend(uids)
+                if state.parsed and all(state.downloaded(f) for f in output_formats):
+                    leave_queue(index)
+                    logger.info(f"Skipping {pdf}, already converted in the journal")
+                    start_convert(
+                        index, name, (state.uid, [], []), cache_key, state, cached
+                    )
+                    return
+
+            page_count = known_pages = check.pages
+            split = bool(
+                self.split_pages and known_pages and known_pages > self.split_pages
+            )
+            if not split and page_count > self.page_budget.capacity:
+                leave_queue(index)
                 logger.warning(f"File {pdf} has too many pages, skipping.")
-                results[index] = ("", "File has too many pages", True)
+                await finish(index, "", "File has too many pages", True, cached)
                 return
 
-            nonlocal total_pages, last_request_time
-
+            error = None
             try:
-                # Check if we can start new task
-                while True:
-                    async with page_lock:
-                        if total_pages + page_count <= self.max_pages:
-                            current_time = time.time()
-                            if current_time - last_request_time < self.request_interval:
-                                await asyncio.sleep(
-                                    self.request_interval
-                                    - (current_time - last_request_time)
-                                )
+                if split:
+                    uid, texts, locations = await parse_split(index, pdf, known_pages)
+                else:
+                    uid, texts, locations = await parse_in_slot(
+                        index,
+                        pdf,
+                        page_count,
+                        pages=known_pages,
+                        uid=state.uid if isinstance(state.uid, str) else None,
+                        on_upload=lambda uid: record(
+                            index, Journal.UPLOADED, uid=uid, **key_fields(uid)
+                        ),
+                    )
+                record(
+                    index, Journal.PARSED, uid=uid, pages=len(texts), **key_fields(uid)
+                )
+                stats.file(index, pdf).pages = len(texts)
+                if cache_key is not None:
+                    try:
+                        await loop.run_in_executor(
+                            None,
+                            self.cache.put,
+                            cache_key,
+                            uid,
+                            texts,
+                            locations,
+                            self.keys.ids(uid) if len(self.keys) > 1 else None,
+                        )
+                    except Exception as e:
+                        logger.warning(f"Failed to cache {pdf}: {str(e)}")
+                # Create convert task as soon as parse is complete
+                start_convert(
+                    index, name, (uid, texts, locations), cache_key, state, cached
+                )
+            except asyncio.TimeoutError:
+                error = "Operation timed out, this may be a rate limit issue or network issue, try to reduce the number of threads."
+                record(index, Journal.FAILED, error=error)
+            except Exception as e:
+                error = str(e)
+                record(index, Journal.FAILED, error=error)
+            # Report outside of the limiter, a slow consumer must not hold a slot
+            if error is not None:
+                await finish(index, "", error, True, cached)
 
-                            total_pages += page_count
-                            last_request_time = time.time()
-                            break
-                    await asyncio.sleep(0.1)
+        async def parse_in_slot(
+            index, pdf, weight, pages=None, uid=None, on_upload=None
+        ):
+            """Upload and parse one PDF (or part) within the page budget and the limiter of a key"""
+            while True:
+                # A journaled uid goes back to its key, a new upload to the least loaded one
+                key = self.keys.key_for(uid) if uid is not None else self.keys.pick()
+                urgency = {"priority": priorities[index], "deadline": due[index]}
+                try:
+                    await key.page_budget.acquire(weight, key=pdf, **urgency)
+                except BaseException:
+                    leave_queue(index)
+                    raise
+                try:
+                    await key.limiter.acquire(**urgency)
+                except BaseException:
+                    leave_queue(index)
+                    key.page_budget.release(weight)
+                    raise
+
+                def uploaded(new_uid, key=key):
+                    self.keys.bind(new_uid, key)
+                    bound.setdefault(index, []).append(new_uid)
+                    if on_upload is not None:
+                        on_upload(new_uid)
 
-                # Process the file
                 try:
-                    uid, texts, locations = await parse_pdf(
-                        apikey=self.apikey,
+                    if key.disabled is not None:
+                        # Ran out of quota while this file waited for it
+                        uid = None
+                        continue
+                    await pace(key)
+                    leave_queue(index)
+                    if prefetcher:
+                        prefetcher.prefetch(
+                            pdf_file[i] for i in itertools.islice(queued, self.prefetch)
+                        )
+                    key.uploads += 1
+                    return await parse_pdf(
+                        apikey=key.apikey,
                         pdf_path=pdf,
                         maxretry=self.retry_time,
-                        wait_time=5,
+                        wait_time=None,
                         max_time=self.max_time,
                         convert=convert,
                         oss_choose=oss_choose,
+                        client=client,
+                        chunk_size=self.upload_chunk_size,
+                        prefetcher=prefetcher,
+                        pages=pages,
+                        poller=self._poller,
+                        limiter=key.limiter,
+                        uid=uid,
+                        on_upload=uploaded,
                     )
-                    parse_results[index] = (uid, texts, locations)
-                    # Create convert task as soon as parse is complete
-                    task = asyncio.create_task(convert_file(index, name))
-                    convert_tasks.add(task)
-
-                except asyncio.TimeoutError:
-                    results[index] = (
-                        "",
-                        "Operation timed out, this may be a rate limit issue or network issue, try to reduce the number of threads.",
-                        True,
+                except RequestError as e:
+                    if e.error_code != "parse_quota_limit" or len(self.keys) == 1:
+                        raise
+                    self.keys.disable(key, str(e))
+                    if not self.keys.active:
+                        raise
+                    logger.warning(f"Moving {pdf} to another API key")
+                    uid = None
+                finally:
+                    leave_queue(index)
+                    key.limiter.release()
+                    key.page_budget.release(weight)
+
+        async def parse_split(index, pdf, pages):
+            """Cut a large PDF into parts, parse them concurrently and stitch the results"""
+            part_dir = tempfile.mkdtemp(prefix="pdfdeal-split-")
+            try:
+                parts = await in_process("split", pdf, self.split_pages, part_dir)
+                logger.info(
+                    f"Split {pdf} ({pages} pages) into {len(parts)} parts, parsing them concurrently"
+                )
+                tasks = [
+                    asyncio.ensure_future(
+                        parse_in_slot(index, path, count, pages=count)
                     )
-                except Exception as e:
-                    results[index] = ("", str(e), True)
+                    for path, _, count in parts
+                ]
+                try:
+                    parsed = await asyncio.gather(*tasks)
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
             finally:
-                async with page_lock:
-                    total_pages -= page_count
+                shutil.rmtree(part_dir, ignore_errors=True)
+            return merge_parsed(parsed, [first for _, first, _ in parts])
 
-        async def convert_file(index, name):
-            if parse_results[index] is None:
-                return
-            uid, texts, locations = parse_results[index]
-            all_results = []
-            all_errors = []
+        async def convert_file(index, name, parsed, cache_key, state, cached):
+            # The consumer waits for a result of every file, it must be reported whatever fails here
+            try:
+                await convert_outputs(index, name, parsed, cache_key, state, cached)
+            except Exception as e:
+                logger.warning(f"Failed to convert {pdf_file[index]}: {str(e)}")
+                await finish(index, "", str(e) or type(e).__name__, True, cached)
+
+        async def convert_outputs(index, name, parsed, cache_key, state, cached):
+            uid, texts, locations = parsed
+            # A split file has the uids of its parts
+            uids = uid if isinstance(uid, list) else [uid]
+            uid = uids[0]
+            # The result endpoint only reports the latest conversion of a uid, so conversions of one uid take turns
+            uid_locks = {part_uid: asyncio.Lock() for part_uid in uids}
+            exports = {}
+
+            async def submit(fmt, uid):
+                waited = 0.0
+                for attempt in range(self.retry_time):
+                    await self.convert_bucket.acquire(
+                        priority=priorities[index], deadline=due[index]
+                    )
+                    try:
+                        return await convert_to_url(
+                            apikey=self.keys.key_for(uid).apikey,
+                            uid=uid,
+                            output_format=fmt,
+                            max_time=self.max_time,
+                            client=client,
+                            pages=len(texts) // len(uids) or None,
+                            poller=self._poller,
+                        )
+                    except RateLimit as e:
+                        record_rate_limit()
+                        if attempt == self.retry_time - 1:
+                            raise
+                        delay = self.retry.delay("convert", e, waited)
+                        if delay is None:
+                            raise
+                        waited = delay
+                        logger.warning(
+                            f"Rate limit reached while converting {uid} to {fmt}, retrying in {delay:.1f} seconds..."
+                        )
+                        # Holds back every conversion of the client, not only this one
+                        self.convert_bucket.penalize(delay)
+
+            async def convert_parts(fmt, target):
+                part_dir = tempfile.mkdtemp(prefix="pdfdeal-parts-")
+                try:
+
+                    async def convert_part(number, part_uid):
+                        async with uid_locks[part_uid]:
+                            url = await submit(fmt, part_uid)
+                        return await download_file(
+                            url=url,
+                            file_type=fmt,
+                            target_folder=part_dir,
+                            target_filename=f"part{number}",
+                            client=client,
+                        )
+
+                    paths = await asyncio.gather(
+                        *[
+                            convert_part(number, part_uid)
+                            for number, part_uid in enumerate(uids, 1)
+                        ]
+                    )
+                    return await in_process("merge", fmt, paths, output_path, target)
+                finally:
+                    shutil.rmtree(part_dir, ignore_errors=True)
+
+            async def convert_and_download(fmt, target):
+                if len(uids) > 1:
+                    return await convert_parts(fmt, target)
+                # A conversion left by an interrupted run may still be downloadable
+                url = state.urls.get(fmt)
+                if url:
+                    try:
+                        return await download_file(
+                            url=url,
+                            file_type=fmt,
+                            target_folder=output_path,
+                            target_filename=target,
+                            client=client,
+                        )
+                    except Exception as e:
+                        logger.info(
+                            f"Converting {pdf_file[index]} to {fmt} again, the journaled url failed: {str(e)}"
+                        )
+                async with uid_locks[uid]:
+                    url = await submit(fmt, uid)
+                record(index, Journal.CONVERTED, format=fmt, url=url)
+                logger.info(f"Downloading {uid} {fmt} file to {output_path}...")
+                return await download_file(
+                    url=url,
+                    file_type=fmt,
+                    target_folder=output_path,
+                    target_filename=target,
+                    client=client,
+                )
+
+            async def export(fmt, name_fmt):
+                target = name_fmt or uid
+                result = state.downloaded(fmt)
+                if result is not None:
+                    return result
+                if cache_key is not None:
+                    result = await loop.run_in_executor(
+                        None,
+                        self.cache.restore_artifact,
+                        cache_key,
+                        fmt,
+                        output_path,
+                        target,
+                    )
+                if (
+                    result is None
+                    and self.local_md
+                    and fmt in LOCAL_FORMATS
+                    and texts
+                    and (fmt == "md_dollar" or not convert)
+                ):
+                    result = await export_markdown(
+                        texts,
+                        fmt,
+                        output_path,
+                        target,
+                        client=client,
+                        with_images=self.fetch_images,
+                    )
+                if result is None and fmt == "md_dollar" and "md" in exports:
+                    # Only the formula delimiters differ, rewrite the md zip instead of converting again
+                    try:
+                        md_zip = await exports["md"]
+                    except Exception:
+                        md_zip = None
+                    if md_zip:
+                        result = await loop.run_in_executor(
+                            None, md_to_dollar, md_zip, output_path, target
+                        )
+                if result is None:
+                    result = await convert_and_download(fmt, target)
+                    if cache_key is not None:
+                        try:
+                            await loop.run_in_executor(
+                                None, self.cache.put_artifact, cache_key, fmt, result
+                            )
+                        except Exception as e:
+                            logger.warning(
+                                f"Failed to cache {fmt} file of {pdf_file[index]}: {str(e)}"
+                            )
+                record(index, Journal.DOWNLOADED, format=fmt, path=result)
+                return result
 
             for name_index, fmt in enumerate(output_formats):
+                if fmt not in ["md", "md_dollar", "tex", "docx"] or fmt in exports:
+                    continue
                 if isinstance(name, list):
                     try:
                         name_fmt = name[name_index]
@@ -310,131 +1202,180 @@ class Doc2X:
                         name_fmt = name[-1]
                 else:
                     name_fmt = name
-                try:
-                    if fmt in ["md", "md_dollar", "tex", "docx"]:
-                        nonlocal last_request_time
-                        # Wait for request interval
-                        current_time = time.time()
-                        if current_time - last_request_time < self.request_interval:
-                            await asyncio.sleep(
-                                self.request_interval
-                                - (current_time - last_request_time)
-                            )
-
-                        async with page_lock:
-                            last_request_time = time.time()
+                exports[fmt] = asyncio.ensure_future(export(fmt, name_fmt))
+            if exports:
+                await asyncio.wait(exports.values())
 
-                        result = await convert_to_format(
-                            apikey=self.apikey,
-                            uid=uid,
-                            output_format=fmt,
-                            output_path=output_path,
-                            output_name=name_fmt,
-                            max_time=self.max_time,
+            all_results = []
+            all_errors = []
+            for fmt in output_formats:
+                if fmt == "texts":
+                    result = texts
+                elif fmt == "text":
+                    result = "\n".join(texts)
+                elif fmt == "detailed":
+                    result = [
+                        {"text": text, "location": loc}
+                        for text, loc in zip(texts, locations)
+                    ]
+                else:
+                    e = exports[fmt].exception()
+                    if e is None:
+                        result = exports[fmt].result()
+                    elif isinstance(e, asyncio.TimeoutError):
+                        all_results.append("")
+                        all_errors.append(
+                            f"Operation timed out while converting to {fmt}, this may be a rate limit issue or network issue, try to reduce the number of threads."
                         )
-                        all_results.append(result)
-                        all_errors.append("")
-                        # Wait 5 seconds between formats
-                        if fmt != output_formats[-1]:
-                            logger.info(
-                                f"Due to the rate limit, waiting 5 seconds before converting {pdf_file[index]} to the{fmt} format."
-                            )
-                            await asyncio.sleep(5)
+                        continue
                     else:
-                        if fmt == "texts":
-                            result = texts
-                        elif fmt == "text":
-                            result = "\n".join(texts)
-                        elif fmt == "detailed":
-                            result = [
-                                {"text": text, "location": loc}
-                                for text, loc in zip(texts, locations)
-                            ]
-                        all_results.append(result)
-                        all_errors.append("")
-
-                except asyncio.TimeoutError:
-                    all_results.append("")
-                    all_errors.append(
-                        f"Operation timed out while converting to {fmt}, this may be a rate limit issue or network issue, try to reduce the number of threads."
-                    )
-                except Exception as e:
-                    all_results.append("")
-                    error_message = str(e) if str(e) else type(e).__name__
-                    all_errors.append(
-                        f"Error while converting to {fmt}: {error_message}"
-                    )
+                        if isinstance(e, RequestError) and cache_key is not None:
+                            # The cached uid may have expired on the server, parse again next time
+                            try:
+                                await loop.run_in_executor(
+                                    None, self.cache.invalidate, cache_key
+                                )
+                            except Exception as error:
+                                logger.warning(
+                                    f"Failed to drop {pdf_file[index]} from the cache: {str(error)}"
+                                )
+                        all_results.append("")
+                        error_message = str(e) if str(e) else type(e).__name__
+                        record(index, Journal.FAILED, format=fmt, error=error_message)
+                        all_errors.append(
+                            f"Error while converting to {fmt}: {error_message}"
+                        )
+                        continue
+                all_results.append(result)
+                all_errors.append("")
 
-            results[index] = (
-                (all_results[0], all_errors[0], not all_results[0])
-                if len(all_results) == 1 and len(all_errors) == 1
-                else (
+            if len(all_results) == 1 and len(all_errors) == 1:
+                await finish(
+                    index, all_results[0], all_errors[0], not all_results[0], cached
+                )
+            else:
+                await finish(
+                    index,
                     all_results,
                     all_errors,
                     any(not result for result in all_results),
+                    cached,
                 )
-            )
 
-        # Create and run parse tasks with controlled concurrency
-        for i, (pdf, name) in enumerate(zip(pdf_file, output_names)):
-            while len(parse_tasks) >= max_threads:
-                done, parse_tasks = await asyncio.wait(
-                    parse_tasks, return_when=asyncio.FIRST_COMPLETED
+        # Files checked by the preflight, ahead of the files waiting for the network
+        ready = asyncio.Queue(self.lookahead)
+        preflight_tasks = set()
+
+        async def run_preflight():
+            # The most urgent files are checked, and so queued, first
+            indexes = iter(
+                sorted(
+                    range(len(pdf_file)),
+                    key=lambda i: (
+                        -priorities[i],
+                        float("inf") if due[i] is None else due[i],
+                        i,
+                    ),
                 )
-                if full_speed:
-                    async with limit_lock:
-                        if not get_max_limit:
-                            max_threads = max_threads + 1
-            task = asyncio.create_task(process_file(i, pdf, name))
-            parse_tasks.add(task)
-
-        # Wait for remaining parse tasks
-        if parse_tasks:
-            await asyncio.wait(parse_tasks)
-
-        # Wait for remaining convert tasks
-        if convert_tasks:
-            await asyncio.wait(convert_tasks)
-        else:
-            logger.warning("No successful parse tasks, skipping conversion.")
+            )
+            max_size = (
+                MAX_DIRECT_SIZE if oss_choose in ("never", "none") else MAX_OSS_SIZE
+            )
 
-        if full_speed:
-            logger.info(f"Convert tasks done with {max_threads} threads.")
-        success_files = []
-        for r in results:
-            success_files.append(r[0])
+            async def worker():
+                for i in indexes:
+                    start = time.perf_counter()
+                    try:
+                        check = await loop.run_in_executor(
+                            None,
+                            preflight,
+                            pdf_file[i],
+                            self.cache is not None,
+                            max_size,
+                            None if self.split_pages else 1000,
+                            self.page_memo,
+                        )
+                    except Exception as e:
+                        check = PreflightResult(0, None, None, False, str(e))
+                    seconds = time.perf_counter() - start
+                    file_stats = stats.file(i, pdf_file[i])
+                    file_stats.priority = priorities[i]
+                    file_stats.deadline = deadlines[i]
+                    file_stats.add("preflight", seconds)
+                    emit_span(
+                        "stage.preflight",
+                        seconds,
+                        path=pdf_file[i],
+                        pages=check.pages,
+                        error=check.error,
+                    )
+                    await ready.put((i, check))
 
-        failed_files = []
-        for r, pdf in zip(results, pdf_file):
-            if r and r[2]:
-                failed_files.append({"error": r[1], "path": pdf})
-            else:
-                failed_files.append({"error": r[1], "path": ""})
-        has_error = any(r[2] for r in results if r)
-        if has_error:
-            logger.error(
-                f"Failed to convert {sum(1 for r in results if r and r[2])} file(s), please enable DEBUG mode to check or read the output variable."
+            workers = [asyncio.create_task(worker()) for _ in range(PREFLIGHT_WORKERS)]
+            preflight_tasks.update(workers)
+            await asyncio.gather(*workers)
+
+        async def feed():
+            # Create parse tasks while the queue has room, the page budget and the limiter decide which start
+            # Every task of the batch inherits the retry engine of the client
+            use_engine(self.retry)
+            if self.tracer is not None:
+                # Every task of the batch is created from here, so they all inherit the tracer
+                batch_id = start_tracing(self.tracer)
+                logger.info(f"Tracing batch {batch_id}")
+            preflight_tasks.add(asyncio.create_task(run_preflight()))
+            for _ in range(len(pdf_file)):
+                i, check = await ready.get()
+                pdf, name = pdf_file[i], output_names[i]
+                if check.error is not None:
+                    # Broken inputs fail here, without a slot or a request
+                    logger.warning(f"Skipping {pdf}: {check.error}")
+                    record(i, Journal.FAILED, error=check.error)
+                    await finish(i, "", check.error, True)
+                    continue
+                await window.acquire()
+                queued[i] = time.perf_counter()
+                record(i, Journal.QUEUED)
+                if prefetcher and len(queued) <= self.prefetch:
+                    prefetcher.prefetch([pdf])
+                task = asyncio.create_task(process_file(i, pdf, name, check))
+                parse_tasks.add(task)
+                task.add_done_callback(parse_tasks.discard)
+
+        feeder = asyncio.create_task(feed())
+        try:
+            for _ in range(len(pdf_file)):
+                yield await finished.get()
+            await feeder
+        finally:
+            # Only left over if the consumer stopped early
+            tasks = [feeder, *preflight_tasks, *parse_tasks, *convert_tasks]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            stats.finish()
+            if self.tracer is not None:
+                await loop.run_in_executor(None, self.tracer.exporter.flush)
+
+            if not converted_any:
+                logger.warning("No successful parse tasks, skipping conversion.")
+            logger.debug(
+                f"Status polls per file: {self.poll_stats.per_file('parse'):.1f} parse, {self.poll_stats.per_file('convert'):.1f} convert."
             )
-            if self.debug:
-                if has_error:
-                    print("=====================")
-                    for fail in failed_files:
-                        if isinstance(fail["error"], list):
-                            for e in fail["error"]:
-                                if e != "":
-                                    print(
-                                        f"Failed to convert {fail['path']}: {e}\n====================="
-                                    )
-                        else:
-                            if fail["error"] != "":
-                                print(
-                                    f"Failed to convert {fail['path']}: {fail['error']}\n====================="
-                                )
+            if prefetcher:
+                logger.debug(
+                    f"Used {prefetcher.used} prefetched upload slot(s), {prefetcher.expired} expired, discarding {prefetcher.held} unused."
+                )
+                await prefetcher.aclose()
 
-        logger.info(
-            f"Successfully converted {sum(1 for r in results if r and not r[2])} file(s) and failed to convert {sum(1 for r in results if r and r[2])} file(s)."
-        )
-        return success_files, failed_files, has_error
+            if self.cache is not None:
+                logger.info(
+                    f"Result cache: {cache_hits} hit(s), {cache_misses} miss(es)."
+                )
+            if self.full_speed:
+                logger.info(
+                    f"Convert tasks done with limiter stats {self.keys.stats if len(self.keys) > 1 else self.limiter.stats}."
+                )
 
     def pdf2file(
         self,
@@ -445,6 +1386,10 @@ class Doc2X:
         convert: bool = False,
         oss_choose: str = "always",
         ocr: bool = False,
+        journal: str = None,
+        resume: bool = False,
+        priorities: List[int] = None,
+        deadlines: List[float] = None,
     ) -> Tuple[List[str], List[dict], bool]:
         """Convert PDF files to the specified format.
 
@@ -456,20 +1401,26 @@ class Doc2X:
             convert (bool, optional): Whether to convert "[" and "[[" to "$" and "$$", only valid if `output_format` is a variable format(`txt`|`txts`|`detailed`). Defaults to False.
             oss_choose (str, optional): Now can upload files directly through API or through OSS link given by API. Acceptable values: `auto`, `always`, `never` (it means `Only >=100MB files will be uploaded to OSS`, `All files will be uploaded to OSS`, `All files will be uploaded directly`). Defaults to "always".
             ocr (bool, optional): This option is deprecated and will not be used.
+            journal (str, optional): Path of a JSONL journal recording the state of each file (queued, uploaded, parsed, converted, downloaded), written in the background. Defaults to None.
+            resume (bool, optional): Continue from the existing `journal` after a crash: parsing uids are re-attached to, journaled conversions are downloaded again and files already downloaded are skipped. Defaults to False.
+            priorities (List[int], optional): The priority of each file, higher is more urgent. Urgent files are checked, admitted into the page budget, uploaded and converted first, while waiting files slowly gain priority (see `priority_aging`). Defaults to 0 for all.
+            deadlines (List[float], optional): A soft deadline of each file in seconds from the start of the batch, None for no deadline. Within a priority the earliest deadline goes first, missed deadlines are counted in the batch stats. Defaults to None.
 
         Returns:
             Tuple[List[str], List[dict], bool]: A tuple containing:
                 1. A list of successfully converted file paths or content.
                 2. A list of dictionaries containing error information for failed conversions.
                 3. A boolean indicating whether any errors occurred during the conversion process.
+                It is a `BatchResult`, `cache_hits` and `cache_misses` tell how many files were served from the result cache, `stats` is a `BatchStats` with the per file timings which can be exported with `to_json` or `to_prometheus`.
 
         Raises:
             Any exceptions raised by pdf2file_back or run_async.
 
         Note:
             This method provides a convenient synchronous interface for the asynchronous
-            PDF conversion functionality. It handles all the necessary setup for running
-            the asynchronous code in a synchronous context.
+            PDF conversion functionality. It runs on one background event loop shared by the
+            whole process, so it can be called from several threads at once, and the connection
+            pool stays open between calls until `close()` or the exit of the program.
         """
         if ocr:
             import warnings
@@ -480,13 +1431,67 @@ class Doc2X:
                 stacklevel=2,
             )
 
-        return run_async(
-            self.pdf2file_back(
+        async def run():
+            await self._hold_client()
+            return await self.pdf2file_back(
                 pdf_file=pdf_file,
                 output_names=output_names,
                 output_path=output_path,
                 output_format=output_format,
                 convert=convert,
                 oss_choose=oss_choose,
+                journal=journal,
+                resume=resume,
+                priorities=priorities,
+                deadlines=deadlines,
             )
-        )
+
+        return run_async(run())
+
+    def pdf2file_iter(
+        self,
+        pdf_file,
+        output_names: List[str] = None,
+        output_path: str = "./Output",
+        output_format: str = "md_dollar",
+        convert: bool = False,
+        oss_choose: str = "always",
+        journal: str = None,
+        resume: bool = False,
+        max_pending: int = 100,
+        priorities: List[int] = None,
+        deadlines: List[float] = None,
+    ) -> Iterator[FileResult]:
+        """Convert PDF files like `pdf2file`, yielding each file as soon as it is done.
+
+        The synchronous counterpart of `pdf2file_stream`, e.g. to index each result while the batch continues:
+
+            for item in client.pdf2file_iter(files, output_format="texts"):
+                if not item.failed:
+                    index(item.path, item.result)
+
+        Args:
+            See `pdf2file` and `pdf2file_stream`.
+
+        Yields:
+            FileResult: The index, pdf path, output, error and whether the file failed, in completion order
+        """
+
+        async def stream():
+            await self._hold_client()
+            async for item in self.pdf2file_stream(
+                pdf_file=pdf_file,
+                output_names=output_names,
+                output_path=output_path,
+                output_format=output_format,
+                convert=convert,
+                oss_choose=oss_choose,
+                journal=journal,
+                resume=resume,
+                max_pending=max_pending,
+                priorities=priorities,
+                deadlines=deadlines,
+            ):
+                yield item
+
+        return iter_async(stream())
@@ -1,6 +1,6 @@
 import asyncio
 import os
-from .Doc2X.Exception import RateLimit, run_async
+from .Doc2X.Exception import RateLimit, run_in_new_loop
 from .Doc2X.Types import RAG_OutputType
 from .Doc2X.Types import OutputFormat_Legacy as OutputFormat
 from .FileTools.dealpdfs import strore_pdf
@@ -179,7 +179,7 @@ class Doc2X:
             rpm (int, optional): The rate of concurrent processing. Defaults will be auto set according to the apikey. Please use `thread` instead of `rpm`.
             thread (int, optional): The rate of concurrent processing. Defaults will be auto set according to the apikey.
         """
-        self.apikey = run_async(get_key(apikey))
+        self.apikey = run_in_new_loop(get_key(apikey))
         if rpm is not None and thread is not None:
             raise ValueError(
                 "Please use `rpm` or `thread`, not both. Suggest to use `thread`."
@@ -282,7 +282,7 @@ class Doc2X:
                     "The length of files and output_names should be the same."
                 )
 
-        success, failed, flag = run_async(
+        success, failed, flag = run_in_new_loop(
             self.pic2file_back(
                 image_file,
                 output_path,
@@ -392,7 +392,7 @@ class Doc2X:
                     "The length of files and output_names should be the same."
                 )
 
-        success, failed, flag = run_async(
+        success, failed, flag = run_in_new_loop(
             self.pdf2file_back(
                 pdf_file, output_path, output_format, ocr, convert, False
             )
@@ -418,7 +418,7 @@ class Doc2X:
         Returns:
             int: The rate limit of the apikey
         """
-        return run_async(get_limit(self.apikey))
+        return run_in_new_loop(get_limit(self.apikey))
 
     async def pdfdeal_back(
         self,
@@ -528,7 +528,7 @@ class Doc2X:
         if isinstance(pdf_file, str):
             pdf_file = [pdf_file]
 
-        success, failed, flag = run_async(
+        success, failed, flag = run_in_new_loop(
             self.pdfdeals(pdf_file, output_path, output_format, convert)
         )
         logging.info(
@@ -1,13 +1,28 @@
-from .FileTools.file_tools import (
-    gen_folder_list,
-    get_files,
-    auto_split_md,
-    auto_split_mds,
-    unzips,
-)
-from .FileTools.extract_img import md_replace_imgs, mds_replace_imgs
-from .FileTools.html2md import html_table_to_md
+import importlib
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from .FileTools.file_tools import (
+        gen_folder_list,
+        get_files,
+        auto_split_md,
+        auto_split_mds,
+        unzips,
+    )
+    from .FileTools.extract_img import md_replace_imgs, mds_replace_imgs
+    from .FileTools.html2md import html_table_to_md
+
+# Where each tool lives, imported on first use so `get_files` does not pull in httpx or BeautifulSoup
+_TOOLS = {
+    "gen_folder_list": ".FileTools.file_tools",
+    "get_files": ".FileTools.file_tools",
+    "auto_split_md": ".FileTools.file_tools",
+    "auto_split_mds": ".FileTools.file_tools",
+    "unzips": ".FileTools.file_tools",
+    "md_replace_imgs": ".FileTools.extract_img",
+    "mds_replace_imgs": ".FileTools.extract_img",
+    "html_table_to_md": ".FileTools.html2md",
+}
 
 __all__ = [
     "gen_folder_list",
@@ -19,3 +34,15 @@ __all__ = [
     "auto_split_mds",
     "html_table_to_md",
 ]
+
+
+def __getattr__(name):
+    if name not in _TOOLS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_TOOLS[name], "pdfdeal"), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,319 @@
+"""An in-process stand-in for the Doc2X v2 API, for offline tests and benchmarks.
+
+`MockDoc2X` is an httpx transport, give it to the client and no request leaves
+the process:
+
+    server = MockDoc2X(seconds_per_page=lognormal(0.05, 0.5), page_capacity=200)
+    client = Doc2X(apikey="sk-mock", transport=server)
+
+It answers preupload, the OSS upload, direct upload, parse status, convert,
+convert result and the download. Like the real API, a file whose pages do not
+fit in `page_capacity` next to the pages being parsed fails with
+`parse_concurrency_limit`, and requests over `rps` get a 429 with a
+`Retry-After`. The capacity is per API key, a file belongs to the key which
+uploaded it, and a key with a `quota` of pages refuses uploads past it with
+`parse_quota_limit`.
+"""
+
+import asyncio
+import heapq
+import io
+import itertools
+import json
+import math
+import random
+import re
+import time
+import zipfile
+from collections import Counter, defaultdict
+
+import httpx
+
+# What the requests and latencies are counted by
+ENDPOINTS = ("preupload", "upload", "oss", "status", "convert", "result", "download")
+OSS_HOST = "oss.mock"
+DOWNLOAD_HOST = "dl.mock"
+
+PAGE = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+
+
+def constant(seconds: float):
+    """A latency distribution which always takes `seconds`"""
+    return lambda rng: seconds
+
+
+def uniform(low: float, high: float):
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(median: float, sigma: float):
+    """A long tailed latency distribution, half of the samples are below `median`"""
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+class _File:
+    __slots__ = (
+        "key",
+        "pages",
+        "parse_started",
+        "parse_done",
+        "error",
+        "convert_to",
+        "convert_done",
+    )
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.pages = 0
+        self.parse_started = None
+        self.parse_done = None
+        self.error = None
+        self.convert_to = None
+        self.convert_done = None
+
+
+class MockDoc2X(httpx.AsyncBaseTransport):
+    """Answer the Doc2X v2 endpoints from memory, with simulated latency and capacity"""
+
+    def __init__(
+        self,
+        seconds_per_page=constant(0.01),
+        convert_seconds=constant(0.01),
+        latency: dict = None,
+        page_capacity: int = 1000,
+        rps: float = 0,
+        seed: int = 0,
+        quota: dict = None,
+    ) -> None:
+        """
+        Args:
+            seconds_per_page (callable, optional): Parse time per page, drawn once per file. Defaults to 10ms.
+            convert_seconds (callable, optional): Time of a conversion. Defaults to 10ms.
+            latency (dict, optional): Response latency distribution by endpoint, see `ENDPOINTS`. Defaults to none.
+            page_capacity (int, optional): Pages parsed at the same time before uploads are refused with `parse_concurrency_limit`. Defaults to 1000.
+            rps (float, optional): API requests per second before answering 429, 0 for no limit. Defaults to 0.
+            seed (int, optional): Seed of the latency samples. Defaults to 0.
+            quota (dict, optional): Pages each API key may parse in total, keys not in it have no limit. Defaults to none.
+        """
+        self.seconds_per_page = seconds_per_page
+        self.convert_seconds = convert_seconds
+        self.latency = dict.fromkeys(ENDPOINTS, constant(0))
+        self.latency.update(latency or {})
+        self.page_capacity = page_capacity
+        self.rps = rps
+        self.quota = dict(quota or {})
+        self.rng = random.Random(seed)
+        self.files = {}
+        self.requests = Counter()
+        self.rejected = Counter()
+        # The most pages parsed at the same time for one key
+        self.peak_pages = 0
+        self.pages_by_key = Counter()
+        self._ids = itertools.count()
+        # (done, pages) of the files being parsed for each key, the earliest first
+        self._parsing = defaultdict(list)
+        self._parsing_pages = Counter()
+        self._second = 0
+        self._second_requests = 0
+        self._zip = None
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self.files),
+            "requests": sum(self.requests.values()),
+            "by_endpoint": dict(self.requests),
+            "rejected": dict(self.rejected),
+            "peak_pages": self.peak_pages,
+            "pages_by_key": dict(self.pages_by_key),
+        }
+
+    @staticmethod
+    def _endpoint(request: httpx.Request):
+        if request.url.host == OSS_HOST:
+            return "oss"
+        if request.url.host == DOWNLOAD_HOST:
+            return "download"
+        path = request.url.path
+        for suffix, name in (
+            ("/v2/parse/preupload", "preupload"),
+            ("/v2/parse/pdf", "upload"),
+            ("/v2/parse/status", "status"),
+            ("/v2/convert/parse/result", "result"),
+            ("/v2/convert/parse", "convert"),
+        ):
+            if path.endswith(suffix):
+                return name
+        return None
+
+    def _respond(
+        self, data=None, code: str = "success", status: int = 200, headers=None
+    ):
+        body = {"code": code}
+        if data is not None:
+            body["data"] = data
+        trace_id = f"mock-{next(self._ids)}"
+        return httpx.Response(
+            status, json=body, headers={"trace-id": trace_id, **(headers or {})}
+        )
+
+    def _over_rps(self) -> bool:
+        if not self.rps:
+            return False
+        now = time.monotonic()
+        if now - self._second >= 1:
+            self._second, self._second_requests = now, 0
+        self._second_requests += 1
+        return self._second_requests > self.rps
+
+    def _in_flight(self, key: str, now: float) -> int:
+        parsing = self._parsing[key]
+        while parsing and parsing[0][0] <= now:
+            self._parsing_pages[key] -= heapq.heappop(parsing)[1]
+        return self._parsing_pages[key]
+
+    def _new_file(self, key: str) -> str:
+        uid = f"mock{len(self.files)}"
+        self.files[uid] = _File(key)
+        return uid
+
+    def _start_parse(self, uid: str, content: bytes) -> None:
+        """Admit an uploaded file into the page capacity, or refuse it"""
+        file = self.files[uid]
+        file.pages = max(1, len(PAGE.findall(content)))
+        key = file.key
+        now = time.monotonic()
+        if key in self.quota and self.pages_by_key[key] + file.pages > self.quota[key]:
+            file.error = "parse_quota_limit"
+        elif self._in_flight(key, now) + file.pages > self.page_capacity:
+            file.error = "parse_concurrency_limit"
+        if file.error is not None:
+            self.rejected[file.error] += 1
+            return
+        file.parse_started = now
+        file.parse_done = now + file.pages * self.seconds_per_page(self.rng)
+        heapq.heappush(self._parsing[key], (file.parse_done, file.pages))
+        self._parsing_pages[key] += file.pages
+        self.pages_by_key[key] += file.pages
+        self.peak_pages = max(self.peak_pages, self._parsing_pages[key])
+
+    def _result_zip(self) -> bytes:
+        if self._zip is None:
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, "w") as z:
+                z.writestr("output.md", "mock \\(x\\)")
+            self._zip = buf.getvalue()
+        return self._zip
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = self._endpoint(request)
+        if endpoint is None:
+            return httpx.Response(404)
+        self.requests[endpoint] += 1
+        content = await request.aread()
+        delay = self.latency[endpoint](self.rng)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if endpoint == "oss":
+            uid = request.url.path.strip("/")
+            if uid not in self.files:
+                return httpx.Response(403)
+            self._start_parse(uid, content)
+            return httpx.Response(200)
+        if endpoint == "download":
+            return httpx.Response(200, content=self._result_zip())
+
+        authorization = request.headers.get("Authorization", "")
+        if not authorization.startswith("Bearer "):
+            return self._respond(code="unauthorized", status=401)
+        key = authorization[len("Bearer ") :]
+        if self._over_rps():
+            self.rejected["429"] += 1
+            # Until the current one second window is over
+            wait = math.ceil(1 - (time.monotonic() - self._second))
+            return self._respond(
+                code="too_many_requests",
+                status=429,
+                headers={"Retry-After": str(max(1, wait))},
+            )
+
+        if endpoint == "preupload":
+            uid = self._new_file(key)
+            return self._respond({"uid": uid, "url": f"https://{OSS_HOST}/{uid}"})
+        if endpoint == "upload":
+            uid = self._new_file(key)
+            self._start_parse(uid, content)
+            error = self.files[uid].error
+            if error is not None:
+                return self._respond({"uid": uid}, code=error)
+            return self._respond({"uid": uid})
+
+        uid = request.url.params.get("uid")
+        if endpoint == "convert":
+            body = json.loads(content)
+            uid = body["uid"]
+        file = self.files.get(uid)
+        # The tasks of one key are not visible to another
+        if file is None or file.key != key:
+            self.rejected["parse_task_not_found"] += 1
+            return self._respond(code="parse_task_not_found", status=400)
+        now = time.monotonic()
+
+        if endpoint == "status":
+            if file.error is not None:
+                return self._respond(code=file.error)
+            if file.parse_done is None:
+                return self._respond({"status": "processing", "progress": 0})
+            if now < file.parse_done:
+                elapsed = now - file.parse_started
+                progress = int(100 * elapsed / (file.parse_done - file.parse_started))
+                return self._respond({"status": "processing", "progress": progress})
+            pages = [
+                {
+                    "md": f"page {i} \\(x\\)",
+                    "page_idx": i,
+                    "page_width": 1,
+                    "page_height": 1,
+                }
+                for i in range(file.pages)
+            ]
+            return self._respond(
+                {"status": "success", "progress": 100, "result": {"pages": pages}}
+            )
+        if endpoint == "convert":
+            file.convert_to = body["to"]
+            file.convert_done = now + self.convert_seconds(self.rng)
+            return self._respond({"status": "processing", "url": ""})
+        # Like the real API the result is the one of the latest conversion
+        if file.convert_done is None or now < file.convert_done:
+            return self._respond({"status": "processing", "url": ""})
+        url = f"https://{DOWNLOAD_HOST}/{uid}.{file.convert_to}"
+        return self._respond({"status": "success", "url": url})
+
+
+def synthetic_pdfs(folder: str, count: int, pages=(1, 20), seed: int = 0) -> list:
+    """Write `count` blank PDFs with a random number of pages in the `pages` range
+
+    Returns:
+        list: The paths of the files
+    """
+    from pypdf import PdfWriter
+
+    rng = random.Random(seed)
+    documents = {}
+    paths = []
+    for i in range(count):
+        n = rng.randint(*pages)
+        if n not in documents:
+            writer = PdfWriter()
+            for _ in range(n):
+                writer.add_blank_page(100, 100)
+            buf = io.BytesIO()
+            writer.write(buf)
+            documents[n] = buf.getvalue()
+        path = f"{folder}/file{i}.pdf"
+        with open(path, "wb") as f:
+            f.write(documents[n])
+        paths.append(path)
+    return paths
@@ -0,0 +1,113 @@
+import asyncio
+import os
+
+from pdfdeal import Doc2X
+from pdfdeal.Doc2X.Cache import ResultCache
+from pdfdeal.Doc2X.Poll import FixedPoll
+
+from .mock_doc2x import MockDoc2X, synthetic_pdfs
+
+
+def mock_client(server, cache, apikey="sk-test"):
+    return Doc2X(
+        apikey=apikey,
+        transport=server,
+        poll_policy=FixedPoll(0.02),
+        poll_rps=0,
+        cache=cache,
+    )
+
+
+def test_result_cache(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    key = cache.key("tests/pdf/sample.pdf", False)
+    assert key != cache.key("tests/pdf/sample.pdf", True)
+    assert cache.get(key) is None
+
+    cache.put(key, "uid-1", ["# page 1"], [{"page_idx": 0}])
+    assert cache.get(key) == ("uid-1", ["# page 1"], [{"page_idx": 0}])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    artifact = tmp_path / "out.zip"
+    artifact.write_bytes(b"zip")
+    cache.put_artifact(key, "md", str(artifact))
+    assert cache.restore_artifact(key, "tex", str(tmp_path), "a") is None
+    restored = cache.restore_artifact(key, "md", str(tmp_path / "out"), "sub/a.pdf")
+    assert restored == os.path.join(str(tmp_path / "out"), "sub", "a.zip")
+    assert open(restored, "rb").read() == b"zip"
+
+    cache.invalidate(key)
+    assert cache.get(key) is None
+    cache.close()
+
+
+def test_result_cache_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), max_size=400)
+    for i in range(5):
+        cache.put(f"{i:02d}-0", f"uid-{i}", [os.urandom(64).hex()], [])
+    assert cache.size <= 400
+    assert cache.get("04-0") is not None
+    assert cache.get("00-0") is None
+    cache.close()
+
+
+class BrokenInvalidate(ResultCache):
+    def invalidate(self, key):
+        raise OSError("disk full")
+
+
+class RefusedConvert(MockDoc2X):
+    async def handle_async_request(self, request):
+        if self._endpoint(request) == "convert":
+            return self._respond(code="parse_file_lock")
+        return await super().handle_async_request(request)
+
+
+def test_cached_uid_refused(tmp_path):
+    pdfs = synthetic_pdfs(str(tmp_path), 2, pages=(1, 2))
+    cache = BrokenInvalidate(str(tmp_path / "cache"))
+    asyncio.run(
+        mock_client(MockDoc2X(), cache).pdf2file_back(
+            pdfs, output_path=str(tmp_path / "out"), output_format="md"
+        )
+    )
+
+    async def stream():
+        # The cached uids are refused and dropping them from the cache fails too
+        client = mock_client(RefusedConvert(), cache)
+        items = client.pdf2file_stream(
+            pdfs, output_path=str(tmp_path / "again"), output_format="tex"
+        )
+        return [item async for item in items]
+
+    results = asyncio.run(asyncio.wait_for(stream(), 30))
+    assert sorted(item.index for item in results) == [0, 1]
+    assert all(item.failed and item.cached for item in results)
+    assert all("parse_file_lock" in item.error for item in results)
+    cache.close()
+
+
+def test_cached_uid_keeps_its_key(tmp_path):
+    keys = ["sk-one", "sk-two"]
+    server = MockDoc2X()
+    pdfs = synthetic_pdfs(str(tmp_path), 6, pages=(1, 3))
+    cache = ResultCache(str(tmp_path / "cache"))
+    asyncio.run(
+        mock_client(server, cache, keys).pdf2file_back(
+            pdfs, output_path=str(tmp_path / "out"), output_format="md"
+        )
+    )
+    assert set(server.pages_by_key) == set(keys)
+
+    # A new client has no uid bound yet, the cache tells which key uploaded each
+    client = mock_client(server, cache, keys)
+    success, failed, has_error = asyncio.run(
+        client.pdf2file_back(
+            pdfs, output_path=str(tmp_path / "again"), output_format="tex"
+        )
+    )
+    assert not has_error
+    assert all(os.path.exists(path) for path in success)
+    assert cache.hits == len(pdfs)
+    assert server.rejected["parse_task_not_found"] == 0
+    cache.close()
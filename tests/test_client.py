@@ -1,7 +1,12 @@
 import logging.config
 from pdfdeal import Doc2X
+from pdfdeal.Doc2X.Poll import FixedPoll
+import asyncio
+import pytest
 import logging
 
+from .mock_doc2x import MockDoc2X, synthetic_pdfs
+
 httpx_logger = logging.getLogger("httpx")
 httpx_logger.setLevel(logging.WARNING)
 logging.basicConfig(level=logging.INFO)
@@ -10,3 +15,73 @@ logging.basicConfig(level=logging.INFO)
 def test_client():
     client = Doc2X()
     assert client is not None
+
+
+def test_client_pool():
+    async def main():
+        async with Doc2X(apikey="sk-test", max_connections=10) as client:
+            pool = client._client
+            assert pool is not None
+            async with client:
+                assert client._client is pool
+            assert not pool.is_closed
+        assert client._client is None
+        assert pool.is_closed
+
+    asyncio.run(main())
+
+
+def test_client_sync_pool(tmp_path):
+    pdfs = synthetic_pdfs(str(tmp_path), 2, pages=(1, 2))
+    client = Doc2X(
+        apikey="sk-mock",
+        transport=MockDoc2X(),
+        poll_policy=FixedPoll(0.05),
+        poll_rps=0,
+    )
+    out = str(tmp_path / "out")
+    success, _, has_error = client.pdf2file(pdfs[0], output_path=out)
+    assert not has_error and success[0]
+    pool = client._client
+    # The pool stays open between synchronous calls
+    assert not pool.is_closed
+    assert [r.failed for r in client.pdf2file_iter(pdfs[1], output_path=out)] == [False]
+    assert client._client is pool
+
+    # The same client from the loop of the caller gets a pool of its own
+    async def from_loop():
+        success, _, has_error = await client.pdf2file_back(pdfs[0], output_path=out)
+        assert not has_error and success[0]
+        return client._client
+
+    assert asyncio.run(from_loop()) is None
+    assert client._client is pool and not pool.is_closed
+
+    client.close()
+    assert pool.is_closed and client._client is None
+
+
+def test_client_one_batch_loop(tmp_path):
+    pdfs = synthetic_pdfs(str(tmp_path), 2, pages=(1, 2))
+    client = Doc2X(
+        apikey="sk-mock",
+        transport=MockDoc2X(),
+        poll_policy=FixedPoll(0.05),
+        poll_rps=0,
+    )
+    out = str(tmp_path / "out")
+
+    async def main():
+        items = client.pdf2file_stream(pdfs, output_path=out, output_format="md")
+        first = await items.__anext__()
+        # The synchronous methods run on the background loop, which may not share the limiters
+        with pytest.raises(RuntimeError, match="another event loop"):
+            await asyncio.to_thread(client.pdf2file, pdfs[0], output_path=out)
+        rest = [item async for item in items]
+        return [first, *rest]
+
+    assert not any(item.failed for item in asyncio.run(main()))
+    # Once the batch is done another loop may run one
+    success, _, has_error = client.pdf2file(pdfs[0], output_path=out)
+    assert not has_error and success[0]
+    client.close()
@@ -0,0 +1,64 @@
+import asyncio
+import zipfile
+
+import httpx
+
+from pdfdeal.Doc2X.ConvertV2 import dollar_formula, md_to_dollar
+from pdfdeal.Doc2X.Export import export_markdown, image_name
+
+
+def test_md_to_dollar(tmp_path):
+    md_zip = tmp_path / "paper.zip"
+    with zipfile.ZipFile(md_zip, "w") as z:
+        z.writestr("paper.md", "a \\(x\\) b \\[y\\]\n```\n\\(x\\)\n```")
+        z.writestr("images/0.jpg", b"\\(raw\\)")
+
+    path = md_to_dollar(str(md_zip), str(tmp_path), "paper")
+    assert path == str(tmp_path / "paper_1.zip")
+    with zipfile.ZipFile(path) as z:
+        assert z.read("paper.md").decode() == "a $x$ b $$y$$\n```\n\\(x\\)\n```"
+        assert z.read("images/0.jpg") == b"\\(raw\\)"
+
+
+def test_dollar_formula():
+    # Code blocks, code spans and escaped backslashes are left alone
+    fenced = "```latex\n\\(x\\) \\[y\\]\n```\n"
+    assert dollar_formula(fenced + "\\(z\\)") == fenced + "$z$"
+    assert dollar_formula("~~~\n\\(x\\)") == "~~~\n\\(x\\)"
+    assert dollar_formula("`\\(x\\)` and ``a ` \\[b``") == "`\\(x\\)` and ``a ` \\[b``"
+    assert dollar_formula("a \\\\(b\\\\) \\(c\\)") == "a \\\\(b\\\\) $c$"
+    assert dollar_formula("\\[a \\\\[2pt] b\\]") == "$$a \\\\[2pt] b$$"
+    # A stray backtick does not hide the formulas of the next paragraph
+    assert dollar_formula("a `\n\n\\(x\\)") == "a `\n\n$x$"
+
+
+def test_export_markdown(tmp_path):
+    url = "https://cdn.example/page0/fig.png"
+    texts = [
+        f"# Title \\(x\\)\n![]({url})",
+        '<img src="https://cdn.example/missing.jpg"/>',
+    ]
+
+    def handler(request):
+        if request.url.path == "/page0/fig.png":
+            return httpx.Response(200, content=b"PNG")
+        return httpx.Response(404)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            md = await export_markdown(texts, "md", str(tmp_path), "a.pdf", client)
+            dollar = await export_markdown(
+                texts, "md_dollar", str(tmp_path), "a.pdf", with_images=False
+            )
+        return md, dollar
+
+    md, dollar = asyncio.run(main())
+    with zipfile.ZipFile(md) as z:
+        assert sorted(z.namelist()) == ["a.md", f"images/{image_name(url)}"]
+        assert z.read("a.md").decode() == (
+            f"# Title \\(x\\)\n![](images/{image_name(url)})\n\n"
+            '<img src="https://cdn.example/missing.jpg"/>'
+        )
+    with zipfile.ZipFile(dollar) as z:
+        assert z.namelist() == ["a.md"]
+        assert z.read("a.md").decode().startswith(f"# Title $x$\n![]({url})")
@@ -0,0 +1,46 @@
+import json
+import subprocess
+import sys
+
+# Cold import budgets in seconds, about 20x what was measured (1ms and 0.35s)
+IMPORT_BUDGET = 0.05
+CLIENT_BUDGET = 2
+
+HEAVY = ["httpx", "pypdf", "bs4", "asyncio"]
+
+
+def cold_import(statement):
+    """Time `statement` in a fresh interpreter, the best of three runs, and list the heavy modules it loaded"""
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps([seconds, [m for m in {HEAVY!r} if m in sys.modules]]))"
+    )
+    runs = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", script],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        )
+        for _ in range(3)
+    ]
+    return min(seconds for seconds, _ in runs), runs[0][1]
+
+
+def test_import_budget():
+    seconds, loaded = cold_import("import pdfdeal, pdfdeal.file_tools")
+    assert loaded == []
+    assert seconds < IMPORT_BUDGET
+
+    seconds, loaded = cold_import("from pdfdeal.file_tools import get_files")
+    assert loaded == []
+
+    # The client needs httpx, pypdf is only loaded when a PDF needs it
+    seconds, loaded = cold_import("from pdfdeal import Doc2X")
+    assert loaded == ["httpx", "asyncio"]
+    assert seconds < CLIENT_BUDGET
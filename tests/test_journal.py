@@ -0,0 +1,34 @@
+import os
+from pdfdeal.Doc2X.Journal import BatchJournal, load_journal
+
+
+def test_journal_resume(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    output = tmp_path / "a.zip"
+    output.write_bytes(b"zip")
+
+    journal = BatchJournal(path, flush_interval=0.01)
+    journal.record("a.pdf", "queued")
+    journal.record("a.pdf", "uploaded", uid="u0")
+    journal.record("a.pdf", "parsed", uid="u0", pages=3)
+    journal.record("a.pdf", "converted", format="md", url="https://example/u0.zip")
+    journal.record("a.pdf", "downloaded", format="md", path=str(output))
+    journal.record("b.pdf", "uploaded", uid="u1")
+    journal.close()
+    with open(path, "a") as f:
+        f.write('{"t": 1, "fi')
+
+    states = load_journal(path)
+    a = states[os.path.abspath("a.pdf")]
+    assert (a.uid, a.parsed, a.pages) == ("u0", True, 3)
+    assert a.urls == {"md": "https://example/u0.zip"}
+    assert a.downloaded("md") == str(output)
+    assert a.downloaded("docx") is None
+
+    journal = BatchJournal(path, resume=True)
+    b = journal.state("b.pdf")
+    assert (b.uid, b.parsed) == ("u1", False)
+    assert journal.state("c.pdf").uid is None
+    journal.record("b.pdf", "uploaded", uid="u2")
+    journal.close()
+    assert load_journal(path)[os.path.abspath("b.pdf")].uid == "u2"
@@ -0,0 +1,82 @@
+import asyncio
+import os
+
+import pytest
+
+from pdfdeal import Doc2X
+from pdfdeal.Doc2X.Exception import RequestError
+from pdfdeal.Doc2X.Keys import KeyPool, fingerprint
+from pdfdeal.Doc2X.Limiter import ConcurrencyLimiter
+from pdfdeal.Doc2X.Poll import FixedPoll
+
+from .mock_doc2x import MockDoc2X, constant, synthetic_pdfs
+
+
+def test_key_pool():
+    limiter = ConcurrencyLimiter(4)
+    pool = KeyPool("sk-a, sk-b,sk-a", limiter, max_pages=10)
+    first, second = pool.keys
+    assert len(pool) == 2
+    assert first.limiter is limiter and second.limiter is not limiter
+    assert second.limiter.capacity == 4
+    assert first.id == fingerprint("sk-a") and "sk-a" not in first.id
+
+    # The least loaded key takes the upload, its uid stays with it
+    asyncio.run(first.page_budget.acquire(5))
+    assert pool.pick() is second
+    pool.bind("uid1", second)
+    assert pool.key_for("uid1") is second
+    assert pool.ids(["uid1", "other"]) == [second.id, first.id]
+
+    restored = KeyPool(["sk-a", "sk-b"], ConcurrencyLimiter(4))
+    restored.restore(["uid1", "uid2"], [second.id, "unknown"])
+    assert restored.key_for("uid1").apikey == "sk-b"
+    assert restored.key_for("uid2").apikey == "sk-a"
+
+    pool.unbind(["uid1", "other"])
+    assert pool.key_for("uid1") is first
+
+    pool.disable(second, "parse_quota_limit")
+    assert pool.active == [first]
+    assert pool.pick() is first
+    pool.disable(first, "parse_quota_limit")
+    with pytest.raises(RequestError):
+        pool.pick()
+
+    with pytest.raises(ValueError):
+        KeyPool(" , ", limiter)
+
+
+def test_key_sharding(tmp_path):
+    keys = ["sk-one", "sk-two", "sk-empty"]
+    server = MockDoc2X(
+        seconds_per_page=constant(0.01), page_capacity=10, quota={"sk-empty": 0}
+    )
+    inputs = tmp_path / "in"
+    inputs.mkdir()
+    pdfs = synthetic_pdfs(str(inputs), 12, pages=(1, 5))
+    client = Doc2X(
+        apikey=keys,
+        transport=server,
+        max_pages=10,
+        poll_policy=FixedPoll(0.05),
+        poll_rps=0,
+    )
+
+    success, failed, has_error = asyncio.run(
+        client.pdf2file_back(
+            pdfs, output_path=str(tmp_path / "out"), output_format="md"
+        )
+    )
+    assert not has_error
+    assert all(os.path.exists(path) for path in success)
+    # The key without quota left the rotation, the others shared the files
+    stats = {key["key"]: key for key in client.keys.stats}
+    assert stats[fingerprint("sk-empty")]["disabled"]
+    assert server.rejected["parse_quota_limit"] >= 1
+    assert set(server.pages_by_key) == {"sk-one", "sk-two"}
+    assert server.peak_pages <= 10
+    # Every follow up call went to the key of the upload, the mock refuses uids of another key
+    assert server.rejected["parse_task_not_found"] == 0
+    # Finished files no longer hold on to their key
+    assert not client.keys._uids
@@ -0,0 +1,160 @@
+import asyncio
+import time
+
+import pytest
+
+from pdfdeal.Doc2X.Limiter import (
+    AIMDLimiter,
+    ConcurrencyLimiter,
+    PageBudget,
+    TokenBucket,
+)
+
+
+def test_concurrency_limiter():
+    async def main():
+        limiter = ConcurrencyLimiter(2)
+        running = []
+
+        async def job():
+            async with limiter:
+                running.append(limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[job() for _ in range(6)])
+        assert max(running) == 2
+        assert limiter.in_flight == 0
+        assert limiter.stats["peak"] == 2
+
+    asyncio.run(main())
+
+
+def test_aimd_limiter():
+    limiter = AIMDLimiter(initial=4, min_limit=1, max_limit=8, cooldown=60)
+    for _ in range(4):
+        limiter.on_success()
+    assert limiter.capacity == 4
+    limiter.on_success()
+    assert limiter.capacity == 5
+    limiter.on_rate_limit()
+    assert limiter.capacity == 2
+    # Rate limits reported by many files at once only count once
+    limiter.on_rate_limit()
+    assert limiter.capacity == 2
+    assert limiter.stats["rate_limits"] == 2
+
+
+def test_aimd_limiter_latency():
+    limiter = AIMDLimiter(initial=2, latency_factor=2)
+    limiter.on_success(1.0)
+    grown = limiter.limit
+    limiter.on_success(5.0)
+    assert limiter.limit == grown
+
+
+def test_page_budget_policies():
+    async def admitted(policy):
+        budget = PageBudget(10, policy)
+        await budget.acquire(10)
+        order = []
+
+        async def job(pages):
+            await budget.acquire(pages, key=pages)
+            order.append(pages)
+
+        tasks = [asyncio.create_task(job(p)) for p in [8, 2, 5]]
+        await asyncio.sleep(0)
+        budget.release(10)
+        await asyncio.sleep(0)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert budget.used == sum(order)
+        return order
+
+    assert asyncio.run(admitted("fifo")) == [8, 2]
+    assert asyncio.run(admitted("smallest")) == [2, 5]
+    assert asyncio.run(admitted("largest")) == [8]
+    assert asyncio.run(admitted("best_fit")) == [8, 2]
+
+
+def test_token_bucket():
+    async def main():
+        bucket = TokenBucket(rate=20, burst=2)
+        start = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        # 2 at once, then one every 50ms
+        assert 0.15 <= time.monotonic() - start < 0.5
+        bucket.penalize(0.1)
+        start = time.monotonic()
+        await bucket.acquire()
+        assert time.monotonic() - start >= 0.1
+
+        # A token granted to a cancelled request goes back, without passing the burst
+        bucket = TokenBucket(rate=20, burst=1)
+        await bucket.acquire()
+        task = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0)
+        time.sleep(0.06)
+        bucket._dispatch()
+        # Refilled before the granted request got to run
+        bucket.tokens = 1.0
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert bucket.tokens == 1
+
+    asyncio.run(main())
+
+
+def test_priorities():
+    async def order(queue, acquire, release, aging=False):
+        granted = []
+
+        async def job(name, **urgency):
+            await acquire(**urgency)
+            granted.append(name)
+
+        tasks = [
+            asyncio.create_task(job("bulk")),
+            asyncio.create_task(job("late", priority=1, deadline=20)),
+            asyncio.create_task(job("soon", priority=1, deadline=10)),
+            asyncio.create_task(job("old")),
+        ]
+        await asyncio.sleep(0)
+        if aging:
+            # The first bulk file waited long enough to catch up with the urgent ones
+            queue._waiters[0].since -= 2.5
+        for _ in tasks:
+            release()
+            await asyncio.sleep(0.06)
+        await asyncio.gather(*tasks)
+        return granted
+
+    async def main():
+        limiter = ConcurrencyLimiter(1, aging=1)
+        await limiter.acquire()
+        assert await order(limiter, limiter.acquire, limiter.release) == [
+            "soon",
+            "late",
+            "bulk",
+            "old",
+        ]
+
+        budget = PageBudget(1, aging=1)
+        await budget.acquire(1)
+        assert await order(
+            budget, lambda **u: budget.acquire(1, **u), lambda: budget.release(1), True
+        ) == ["bulk", "soon", "late", "old"]
+
+        bucket = TokenBucket(rate=20, aging=0)
+        await bucket.acquire()
+        assert await order(bucket, bucket.acquire, lambda: None) == [
+            "soon",
+            "late",
+            "bulk",
+            "old",
+        ]
+
+    asyncio.run(main())
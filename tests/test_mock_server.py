@@ -0,0 +1,106 @@
+import asyncio
+import os
+
+import httpx
+
+from pdfdeal import Doc2X
+from pdfdeal.Doc2X.ConvertV2 import Base_URL
+from pdfdeal.Doc2X.Poll import FixedPoll
+
+from .mock_doc2x import MockDoc2X, constant, synthetic_pdfs
+
+
+def test_mock_capacity(tmp_path):
+    server = MockDoc2X(seconds_per_page=constant(10), page_capacity=4, rps=4)
+    first, second = synthetic_pdfs(str(tmp_path), 2, pages=(3, 3))
+
+    async def main():
+        headers = {"Authorization": "Bearer sk-mock"}
+        async with httpx.AsyncClient(base_url=Base_URL, transport=server) as client:
+            codes = []
+            for path in (first, second):
+                data = (
+                    await client.post(
+                        "/v2/parse/preupload", headers=headers, json={"file_name": path}
+                    )
+                ).json()["data"]
+                with open(path, "rb") as f:
+                    await client.put(data["url"], content=f.read())
+                status = await client.get(
+                    "/v2/parse/status", headers=headers, params={"uid": data["uid"]}
+                )
+                codes.append(status.json()["code"])
+            # Four API requests were sent in this second already
+            limited = await client.get(
+                "/v2/parse/status", headers=headers, params={"uid": "mock0"}
+            )
+            return codes, limited.status_code
+
+    codes, limited = asyncio.run(main())
+    # 3 pages are parsing, the next 3 do not fit in 4
+    assert codes == ["success", "parse_concurrency_limit"]
+    assert limited == 429
+    assert server.peak_pages == 3
+    assert server.requests["oss"] == 2
+
+
+def test_offline_batch(tmp_path):
+    server = MockDoc2X(seconds_per_page=constant(0.01), page_capacity=20)
+    inputs = tmp_path / "in"
+    inputs.mkdir()
+    pdfs = synthetic_pdfs(str(inputs), 12, pages=(1, 5))
+    client = Doc2X(
+        apikey="sk-mock",
+        transport=server,
+        max_pages=20,
+        poll_policy=FixedPoll(0.05),
+        poll_rps=0,
+    )
+
+    result = asyncio.run(
+        client.pdf2file_back(
+            pdfs, output_path=str(tmp_path / "out"), output_format="md"
+        )
+    )
+    success, failed, has_error = result
+    assert not has_error
+    assert all(os.path.exists(path) for path in success)
+    assert result.stats.pages == sum(server.files[uid].pages for uid in server.files)
+    assert server.requests["preupload"] == 0
+    assert server.requests["upload"] == 12
+    assert server.requests["download"] == 12
+    assert server.peak_pages <= 20
+
+
+def test_offline_priorities(tmp_path):
+    server = MockDoc2X(seconds_per_page=constant(0.01), page_capacity=20)
+    inputs = tmp_path / "in"
+    inputs.mkdir()
+    pdfs = synthetic_pdfs(str(inputs), 12, pages=(1, 3))
+    client = Doc2X(
+        apikey="sk-mock",
+        transport=server,
+        thread=2,
+        max_pages=20,
+        poll_policy=FixedPoll(0.05),
+        poll_rps=0,
+    )
+    # The last three files are urgent, the bulk ones come first in the list
+    priorities = [0] * 9 + [1] * 3
+    deadlines = [None] * 9 + [30, 20, 10]
+
+    async def main():
+        order = []
+        async for item in client.pdf2file_stream(
+            pdfs,
+            output_path=str(tmp_path / "out"),
+            output_format="md",
+            priorities=priorities,
+            deadlines=deadlines,
+        ):
+            assert not item.failed
+            order.append(item.index)
+        return order
+
+    order = asyncio.run(main())
+    assert set(order[:3]) == {9, 10, 11}
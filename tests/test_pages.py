@@ -0,0 +1,109 @@
+import os
+
+import pytest
+from pypdf import PdfWriter
+
+from pdfdeal.Doc2X.Exception import RequestError
+from pdfdeal import Doc2X
+from pdfdeal.Doc2X.Pages import (
+    PageCountMemo,
+    default_memo_path,
+    fast_page_count,
+    get_pdf_page_count,
+)
+
+
+def test_fast_page_count(tmp_path):
+    assert fast_page_count("tests/pdf/sample.pdf") == 2
+    assert fast_page_count("tests/pdf/sample_bad.pdf") is None
+
+    writer = PdfWriter()
+    for _ in range(150):
+        writer.add_blank_page(100, 100)
+    writer.write(tmp_path / "blank.pdf")
+    assert fast_page_count(str(tmp_path / "blank.pdf")) == 150
+
+    # An incremental update with an xref stream, the newest page tree wins
+    writer = PdfWriter("tests/pdf/sample.pdf", incremental=True)
+    writer.add_blank_page(100, 100)
+    writer.write(tmp_path / "update.pdf")
+    assert fast_page_count(str(tmp_path / "update.pdf")) == 3
+
+
+def objstm_pdf(shift: int = 0) -> bytes:
+    """A one page PDF with its catalog and page tree in an object stream, `shift` moves its xref offset"""
+    catalog = b"<< /Type /Catalog /Pages 2 0 R >> "
+    objects = b"1 0 2 %d " % len(catalog)
+    stream = objects + catalog + b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>"
+    out = bytearray(b"%PDF-1.5\n")
+    offsets = [len(out)]
+    out += b"3 0 obj\n<< /Type /Page /Parent 2 0 R /MediaBox [0 0 100 100] >>\nendobj\n"
+    offsets.append(len(out))
+    out += b"4 0 obj\n<< /Type /ObjStm /N 2 /First %d /Length %d >>\nstream\n" % (
+        len(objects),
+        len(stream),
+    )
+    out += stream + b"\nendstream\nendobj\n"
+    offsets.append(len(out))
+    rows = [
+        b"\x00" * 5 + b"\xff",
+        b"\x02\x00\x00\x00\x04\x00",
+        b"\x02\x00\x00\x00\x04\x01",
+    ]
+    rows += [b"\x01" + offset.to_bytes(4, "big") + b"\x00" for offset in offsets]
+    rows[4] = b"\x01" + (offsets[1] + shift).to_bytes(4, "big") + b"\x00"
+    xref = b"".join(rows)
+    out += (
+        b"5 0 obj\n<< /Type /XRef /Size 6 /W [1 4 1] /Root 1 0 R /Length %d >>\nstream\n"
+        % len(xref)
+    )
+    out += xref + b"\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n" % offsets[2]
+    return bytes(out)
+
+
+def test_stale_offset(tmp_path):
+    pdf = tmp_path / "objstm.pdf"
+    pdf.write_bytes(objstm_pdf())
+    assert fast_page_count(str(pdf)) == 1
+
+    # The object stream is not where the xref says, pypdf still finds it
+    pdf.write_bytes(objstm_pdf(shift=-5))
+    assert fast_page_count(str(pdf)) is None
+    assert get_pdf_page_count(str(pdf), memo=False) == 1
+
+
+def test_page_count_limit():
+    assert get_pdf_page_count("tests/pdf/sample.pdf", memo=False) == 2
+    with pytest.raises(RequestError):
+        get_pdf_page_count("tests/pdf/sample.pdf", limit=1, memo=False)
+
+
+def test_page_count_memo(tmp_path):
+    pdf = tmp_path / "a.pdf"
+    pdf.write_bytes(open("tests/pdf/sample.pdf", "rb").read())
+    memo = PageCountMemo(str(tmp_path / "pages.sqlite"))
+    assert memo.get(str(pdf)) is None
+    memo.put(str(pdf), 2)
+    assert memo.get(str(pdf)) == 2
+
+    # A modified file is read again
+    os.utime(pdf, ns=(0, 0))
+    assert memo.get(str(pdf)) is None
+    assert get_pdf_page_count(str(pdf), memo=memo) == 2
+    assert memo.lookup(str(pdf)) == (2, False)
+    memo.close()
+
+
+def test_page_count_memo_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_memo_path() == str(tmp_path / "pdfdeal" / "pages.sqlite")
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    assert default_memo_path().endswith(
+        os.path.join(".cache", "pdfdeal", "pages.sqlite")
+    )
+
+    # Off unless asked for
+    assert Doc2X(apikey="sk-test").page_memo is None
+    client = Doc2X(apikey="sk-test", page_memo=str(tmp_path / "memo.sqlite"))
+    assert client.page_memo.path == str(tmp_path / "memo.sqlite")
+    client.page_memo.close()
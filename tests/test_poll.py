@@ -0,0 +1,59 @@
+import pytest
+
+from pdfdeal.Doc2X.Poll import AdaptivePoll, FixedPoll, PollPolicy, PollState, PollStats
+
+
+def test_fixed_poll():
+    policy = FixedPoll(3)
+    state = PollState("parse", 10)
+    assert policy.first_delay(state) == 0
+    assert policy.next_delay(state) == 3
+
+    # A policy must say how long to wait between polls
+    class NoDelay(PollPolicy):
+        pass
+
+    with pytest.raises(TypeError):
+        NoDelay()
+
+
+def test_adaptive_poll_first_delay():
+    policy = AdaptivePoll(min_interval=0.5, max_interval=10)
+    assert policy.first_delay(PollState("parse", 1)) == 0.5
+    assert policy.first_delay(PollState("parse", 10)) == 5
+    assert policy.first_delay(PollState("parse", 900)) == 10
+
+
+def test_adaptive_poll_progress_rate():
+    policy = AdaptivePoll(min_interval=0.5, max_interval=10)
+    state = PollState("parse", 100)
+    # Queued for 4 seconds, then 10% per second
+    state.samples = [(1, 0), (4, 0), (6, 20)]
+    assert policy.next_delay(state) == 8
+
+
+def test_adaptive_poll_backoff():
+    policy = AdaptivePoll(min_interval=0.5, max_interval=10, backoff=2)
+    state = PollState("convert")
+    assert policy.next_delay(state) == 0.5
+    state.last_delay = 4
+    assert policy.next_delay(state) == 8
+    state.last_delay = 8
+    assert policy.next_delay(state) == 10
+
+
+def test_poll_stats():
+    stats = PollStats()
+    stats.record("parse", "a.pdf", 3)
+    stats.record("parse", "b.pdf", 1)
+    stats.record("convert", "uid", 2)
+    assert stats.total() == 6
+    assert stats.total("parse") == 4
+    assert stats.per_file("parse") == 2
+
+    # Only the latest files keep their own count, the totals keep all of them
+    stats = PollStats(max_files=2)
+    for i in range(5):
+        stats.record("parse", f"{i}.pdf", 2)
+    assert list(stats.polls["parse"]) == ["3.pdf", "4.pdf"]
+    assert stats.total("parse") == 10 and stats.per_file("parse") == 2
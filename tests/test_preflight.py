@@ -0,0 +1,50 @@
+from pypdf import PdfWriter
+
+from pdfdeal.Doc2X.Cache import file_digest
+from pdfdeal.Doc2X.Preflight import preflight
+
+from .test_pages import objstm_pdf
+
+
+def encrypted_pdf(path, user_password):
+    writer = PdfWriter()
+    writer.add_blank_page(100, 100)
+    writer.encrypt(user_password, "owner", algorithm="RC4-128")
+    writer.write(path)
+    return str(path)
+
+
+def test_preflight():
+    check = preflight("tests/pdf/sample.pdf", digest=True)
+    assert check.error is None
+    assert check.pages == 2
+    assert check.digest == file_digest("tests/pdf/sample.pdf")
+    assert not check.encrypted
+
+    assert "parse_pdf_invalid" in preflight("tests/pdf/sample_bad.pdf").error
+    assert "parse_file_not_pdf" in preflight("tests/image/sample.png").error
+    assert preflight("tests/pdf/missing.pdf").error
+    assert "parse_file_too_large" in preflight("tests/pdf/sample.pdf", max_size=1).error
+    assert (
+        "parse_file_page_limit" in preflight("tests/pdf/sample.pdf", page_limit=1).error
+    )
+    assert preflight("tests/pdf/sample.pdf", page_limit=None).error is None
+
+
+def test_preflight_encrypted(tmp_path):
+    check = preflight(encrypted_pdf(tmp_path / "open.pdf", ""))
+    assert check.encrypted
+    assert check.error is None
+
+    check = preflight(encrypted_pdf(tmp_path / "locked.pdf", "secret"))
+    assert check.encrypted
+    assert "password" in check.error
+
+
+def test_preflight_fast_reader_fails(tmp_path):
+    # The fast reader gives up on a stale xref offset, pypdf reads the file
+    pdf = tmp_path / "stale.pdf"
+    pdf.write_bytes(objstm_pdf(shift=-5))
+    check = preflight(str(pdf))
+    assert check.error is None
+    assert check.pages == 1
@@ -0,0 +1,125 @@
+import asyncio
+import email.utils
+import os
+import time
+
+import httpx
+import pytest
+
+from pdfdeal import Doc2X
+from pdfdeal.Doc2X.Exception import RateLimit, RequestError
+from pdfdeal.Doc2X.Poll import FixedPoll
+from pdfdeal.Doc2X.Retry import (
+    RetryBudget,
+    RetryEngine,
+    RetryPolicy,
+    parse_retry_after,
+)
+
+from .mock_doc2x import MockDoc2X, constant, synthetic_pdfs
+
+
+def test_retry_policy():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    later = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < parse_retry_after(later) <= 30
+
+    policy = RetryPolicy(base=1, cap=10)
+    waits = [policy.backoff(2) for _ in range(200)]
+    assert all(1 <= wait <= 6 for wait in waits)
+    # Jittered, tasks failing together do not retry together
+    assert len(set(waits)) > 150
+    assert all(1 <= policy.backoff(100) <= policy.cap for _ in range(100))
+    assert 5 <= policy.delay(RateLimit(retry_after=5), 0) <= 6
+
+    upload = RetryPolicy(idempotent=False, throttled=False)
+    assert upload.retryable(httpx.ConnectError("refused"))
+    assert not upload.retryable(httpx.ReadTimeout("no answer"))
+    assert not upload.retryable(RateLimit())
+    assert policy.retryable(RateLimit())
+    assert not policy.retryable(RateLimit(code="parse_concurrency_limit"))
+    assert not policy.retryable(RequestError("parse_error"))
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2)
+    assert budget.allow() and budget.allow()
+    assert not budget.allow()
+    budget.on_request()
+    budget.on_request()
+    assert budget.allow()
+    assert budget.stats == {"requests": 2, "retries": 3, "denied": 1, "tokens": 0}
+
+
+def test_retry_engine():
+    fast = {"base": 0.01, "cap": 0.02}
+    engine = RetryEngine(
+        {
+            "upload": RetryPolicy(idempotent=False, **fast),
+            "status": RetryPolicy(attempts=4, **fast),
+        },
+        budget=RetryBudget(),
+    )
+
+    def flaky(*errors):
+        calls = []
+
+        async def call():
+            calls.append(time.monotonic())
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return len(calls)
+
+        return call, calls
+
+    async def main():
+        # An upload which may have reached the server is not sent again
+        call, calls = flaky(httpx.ReadTimeout("no answer"))
+        with pytest.raises(httpx.ReadTimeout):
+            await engine.call("upload", call)
+        assert len(calls) == 1
+        call, calls = flaky(httpx.ConnectError("refused"))
+        assert await engine.call("upload", call) == 2
+
+        # The wait the server asked for is kept
+        call, calls = flaky(RateLimit(retry_after=0.2), httpx.ReadTimeout("slow"))
+        assert await engine.call("status", call) == 3
+        assert calls[1] - calls[0] >= 0.2
+
+        # A spent budget stops the retries
+        engine.budget = RetryBudget(min_per_second=0, max_tokens=0)
+        call, calls = flaky(httpx.ConnectError("refused"))
+        with pytest.raises(httpx.ConnectError):
+            await engine.call("status", call)
+        assert len(calls) == 1 and engine.budget.stats["denied"] == 1
+
+    asyncio.run(main())
+
+
+def test_offline_throttled(tmp_path):
+    server = MockDoc2X(seconds_per_page=constant(0.05), rps=30)
+    inputs = tmp_path / "in"
+    inputs.mkdir()
+    pdfs = synthetic_pdfs(str(inputs), 8, pages=(1, 3))
+    budget = RetryBudget()
+    client = Doc2X(
+        apikey="sk-test",
+        transport=server,
+        poll_policy=FixedPoll(0.02),
+        poll_rps=0,
+        retry_budget=budget,
+    )
+
+    success, failed, has_error = asyncio.run(
+        client.pdf2file_back(
+            pdfs, output_path=str(tmp_path / "out"), output_format="md"
+        )
+    )
+    assert not has_error
+    assert all(os.path.exists(path) for path in success)
+    # The 429s were waited out, every file was uploaded once
+    assert server.rejected["429"] > 0
+    assert budget.stats["retries"] > 0
+    assert len(server.files) == len(pdfs)
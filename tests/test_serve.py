@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from pdfdeal import Doc2X
+from pdfdeal.Doc2X.Jobs import JobQueue
+from pdfdeal.Doc2X.Poll import FixedPoll
+from pdfdeal.Doc2X.Serve import ServeHTTPServer, Worker
+
+from .mock_doc2x import MockDoc2X, constant, synthetic_pdfs
+
+
+def test_job_queue(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    queue = JobQueue(path)
+    bulk = queue.submit("bulk.pdf")
+    urgent = queue.submit("urgent.pdf", output_format="md", priority=1)
+    soon = queue.submit("soon.pdf", deadline=10)
+    cancelled = queue.submit("cancelled.pdf")
+    assert queue.cancel(cancelled.id)
+    assert not queue.cancel(cancelled.id)
+
+    claimed = queue.claim(2)
+    assert [job.id for job in claimed] == [urgent.id, soon.id]
+    assert claimed[0].attempts == 1
+    queue.finish(urgent.id, ["a.zip", ""], ["", "failed"], True)
+    job = queue.get(urgent.id)
+    assert job.state == "failed" and job.result == ["a.zip", ""]
+
+    # A new worker on the same file gets the running job back
+    queue.close()
+    queue = JobQueue(path)
+    assert queue.recover() == 1
+    assert [job.id for job in queue.claim(5)] == [soon.id, bulk.id]
+    assert queue.get(soon.id).attempts == 2
+    assert queue.counts() == {
+        "queued": 0,
+        "running": 2,
+        "done": 0,
+        "failed": 1,
+        "cancelled": 1,
+    }
+    queue.close()
+
+
+def test_serve(tmp_path):
+    server = MockDoc2X(seconds_per_page=constant(0.01), page_capacity=20)
+    pdfs = synthetic_pdfs(str(tmp_path), 6, pages=(1, 3))
+    client = Doc2X(
+        apikey="sk-mock",
+        transport=server,
+        poll_policy=FixedPoll(0.05),
+        poll_rps=0,
+    )
+    root = str(tmp_path / "serve")
+    queue = JobQueue(os.path.join(root, "jobs.sqlite"))
+    worker = Worker(client, queue, root, max_jobs=4)
+    api = ServeHTTPServer(worker, port=0)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    loop_thread = threading.Thread(target=lambda: asyncio.run(worker.run()))
+    loop_thread.start()
+    url = f"http://127.0.0.1:{api.server_port}"
+
+    def call(method, path, body=None, headers=None):
+        request = urllib.request.Request(
+            url + path, data=body, method=method, headers=headers or {}
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    try:
+        ids = []
+        for pdf in pdfs[:5]:
+            status, body = call(
+                "POST",
+                "/jobs",
+                json.dumps({"path": pdf, "output_format": "md"}).encode(),
+            )
+            assert status == 201
+            ids.append(json.loads(body)["id"])
+        with open(pdfs[5], "rb") as f:
+            status, body = call(
+                "POST",
+                "/jobs?name=uploaded&format=texts&priority=2",
+                f.read(),
+                {"Content-Type": "application/pdf"},
+            )
+        assert status == 201
+        ids.append(json.loads(body)["id"])
+        assert call("POST", "/jobs", b'{"path": "missing.pdf"}')[0] == 400
+        for options in ({"output_name": "../escape"}, {"priority": "high"}):
+            body = json.dumps({"path": pdfs[0], **options}).encode()
+            assert call("POST", "/jobs", body)[0] == 400
+        pdf_type = {"Content-Type": "application/pdf"}
+        assert call("POST", "/jobs?name=a/b", b"%PDF-", pdf_type)[0] == 400
+        assert call("POST", "/jobs?deadline=soon", b"%PDF-", pdf_type)[0] == 400
+        # A failed submission removes its uploaded copy
+        spooled = os.listdir(os.path.join(root, "spool"))
+        submit = queue.submit
+        queue.submit = lambda *args, **kwargs: _raise(ValueError("queue is full"))
+        assert call("POST", "/jobs", b"%PDF-", pdf_type)[0] == 400
+        queue.submit = submit
+        assert os.listdir(os.path.join(root, "spool")) == spooled
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            states = [json.loads(call("GET", f"/jobs/{i}")[1])["state"] for i in ids]
+            if all(state == "done" for state in states):
+                break
+            time.sleep(0.05)
+        assert states == ["done"] * 6
+
+        status, body = call("GET", f"/jobs/{ids[0]}/result")
+        assert status == 200 and body[:2] == b"PK"
+        status, body = call("GET", f"/jobs/{ids[5]}/result")
+        assert json.loads(body)["result"][0].startswith("page 0")
+        stats = json.loads(call("GET", "/stats")[1])
+        assert stats["completed"] == 6 and stats["jobs"]["done"] == 6
+        assert call("DELETE", f"/jobs/{ids[0]}")[0] == 409
+        assert call("GET", "/jobs/nope")[0] == 404
+        # Finished jobs leave no journal or uploaded copy behind
+        assert not os.listdir(os.path.join(root, "journal"))
+        assert not os.listdir(os.path.join(root, "spool"))
+    finally:
+        worker.stop()
+        loop_thread.join(10)
+        api.shutdown()
+        api.server_close()
+        queue.close()
+    assert server.requests["upload"] == 6
+
+
+def _raise(error):
+    raise error
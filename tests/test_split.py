@@ -0,0 +1,84 @@
+import asyncio
+import zipfile
+
+import pytest
+from pypdf import PdfReader
+
+from pdfdeal.Doc2X.Exception import FileError
+from pdfdeal.Doc2X.Split import (
+    _relink,
+    in_process,
+    merge_outputs,
+    merge_parsed,
+    split_pdf,
+)
+
+
+def test_split_pdf(tmp_path):
+    parts = split_pdf("tests/pdf/sample.pdf", 1, str(tmp_path))
+    assert [(first, count) for _, first, count in parts] == [(0, 1), (1, 1)]
+    for path, _, count in parts:
+        assert len(PdfReader(path).pages) == count
+
+    assert len(split_pdf("tests/pdf/sample.pdf", 5, str(tmp_path))) == 1
+
+
+def test_split_in_process(tmp_path):
+    parts = asyncio.run(in_process("split", "tests/pdf/sample.pdf", 1, str(tmp_path)))
+    assert parts == split_pdf("tests/pdf/sample.pdf", 1, str(tmp_path))
+
+    with pytest.raises(FileError, match="FileNotFoundError"):
+        asyncio.run(in_process("split", str(tmp_path / "none.pdf"), 1, str(tmp_path)))
+
+
+def test_merge_parsed():
+    uids, texts, locations = merge_parsed(
+        [
+            ("u0", ["a", "b"], [{"page_idx": 0}, {"page_idx": 1}]),
+            ("u1", ["c"], [{"page_idx": 0, "page_width": 1}]),
+        ],
+        [0, 2],
+    )
+    assert uids == ["u0", "u1"]
+    assert texts == ["a", "b", "c"]
+    assert [location["page_idx"] for location in locations] == [0, 1, 2]
+    assert locations[2]["page_width"] == 1
+
+
+def test_merge_outputs(tmp_path):
+    paths = []
+    for number in (1, 2):
+        path = tmp_path / f"part{number}.zip"
+        with zipfile.ZipFile(path, "w") as z:
+            z.writestr(
+                "output.md",
+                f"part {number} ![](images/0.jpg) see images/0.jpg ![](old/images/0.jpg)",
+            )
+            z.writestr("images/0.jpg", f"IMG{number}")
+        paths.append(str(path))
+
+    md = merge_outputs("md", paths, str(tmp_path / "out"), "book.pdf")
+    with zipfile.ZipFile(md) as z:
+        assert z.read("book.md").decode() == (
+            "part 1 ![](images/0.jpg) see images/0.jpg ![](old/images/0.jpg)\n\n"
+            "part 2 ![](images/part2_0.jpg) see images/0.jpg ![](old/images/0.jpg)"
+        )
+        assert z.read("images/0.jpg") == b"IMG1"
+        assert z.read("images/part2_0.jpg") == b"IMG2"
+
+    tex = merge_outputs("tex", paths, str(tmp_path / "out"), "book.pdf")
+    assert tex != md
+    with zipfile.ZipFile(tex) as z:
+        assert sorted(z.namelist())[:2] == ["part1/images/0.jpg", "part1/output.md"]
+
+
+def test_relink():
+    renamed = {"images/0.jpg": "images/part2_0.jpg"}
+    text = (
+        '![a](images/0.jpg "title") [link](<images/0.jpg>) `images/0.jpg` '
+        '<img src="images/0.jpg"> ![](images/0.jpg.png)'
+    )
+    assert _relink(text, renamed) == (
+        '![a](images/part2_0.jpg "title") [link](<images/part2_0.jpg>) `images/0.jpg` '
+        '<img src="images/part2_0.jpg"> ![](images/0.jpg.png)'
+    )
@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from pdfdeal.Doc2X.Stats import BatchStats, bind, record_bytes, record_retry, timed
+
+
+def test_batch_stats():
+    stats = BatchStats()
+
+    async def work(index, seconds):
+        bind(stats.file(index, f"{index}.pdf"))
+        with timed("upload"):
+            await asyncio.sleep(seconds)
+        record_bytes(sent=100)
+
+        # Sub tasks record to the file of the task which created them
+        async def download():
+            with timed("download"):
+                record_retry()
+
+        await asyncio.create_task(download())
+        stats.file(index, f"{index}.pdf").pages = 2
+
+    async def main():
+        await asyncio.gather(work(0, 0.05), work(1, 0.1))
+        # Outside of a file task nothing is recorded
+        record_retry()
+
+    asyncio.run(main())
+    stats.finish()
+
+    data = json.loads(stats.to_json())
+    assert data["files"] == 2
+    assert data["pages"] == 4
+    assert data["retries"] == 2
+    assert data["bytes_sent"] == 200
+    assert data["stages"]["upload"]["total"] >= 0.15
+    assert data["per_file"][1]["timings"]["upload"] >= 0.1
+    assert "download" in data["per_file"][0]["timings"]
+
+    text = stats.to_prometheus()
+    assert 'pdfdeal_stage_seconds_total{stage="upload"}' in text
+    assert "pdfdeal_pages_total 4\n" in text
+    assert "# TYPE pdfdeal_batch_seconds gauge" in text
+
+
+def test_priority_latency():
+    stats = BatchStats()
+    for index, (priority, deadline, seconds) in enumerate(
+        [(1, 2, 1), (1, 2, 3), (0, None, 5), (0, None, 6)]
+    ):
+        f = stats.file(index, f"{index}.pdf")
+        f.priority, f.deadline = priority, deadline
+        f.finished = stats.started + seconds
+    stats.file(4, "running.pdf").priority = 2
+
+    priorities = stats.priorities()
+    assert list(priorities) == [1, 0]
+    assert priorities[1]["files"] == 2
+    assert priorities[1]["p50"] == 3
+    assert priorities[1]["missed_deadlines"] == 1
+    assert priorities[0]["p99"] == 6
+
+    data = json.loads(stats.to_json())
+    assert data["priorities"]["1"]["p95"] == 3
+    assert data["per_file"][0]["deadline"] == 2
+    text = stats.to_prometheus()
+    assert 'pdfdeal_file_latency_seconds{priority="0",quantile="0.50"} 6' in text
+    assert 'pdfdeal_missed_deadlines_total{priority="1"} 1' in text
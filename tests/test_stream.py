@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pdfdeal.Doc2X.Exception import iter_async, run_async
+from pdfdeal.Doc2X.Types import FileResult
+
+
+def test_iter_async():
+    closed = []
+
+    async def numbers(n):
+        try:
+            for i in range(n):
+                await asyncio.sleep(0.01)
+                yield FileResult(i, f"{i}.pdf", f"{i}.zip", "", False)
+        finally:
+            closed.append(n)
+
+    assert [r.index for r in iter_async(numbers(3))] == [0, 1, 2]
+
+    for item in iter_async(numbers(100)):
+        assert item.result == "0.zip" and item.cached is None
+        break
+    assert closed == [3, 100]
+
+
+def test_iter_async_error():
+    async def broken():
+        yield 1
+        raise ValueError("boom")
+
+    items = iter_async(broken())
+    assert next(items) == 1
+    try:
+        next(items)
+    except ValueError as e:
+        assert str(e) == "boom"
+    else:
+        raise AssertionError("the error of the generator was not raised")
+
+
+def test_run_async_background_loop():
+    async def current():
+        await asyncio.sleep(0.01)
+        return asyncio.get_running_loop(), threading.current_thread().name
+
+    first = run_async(current())
+    assert first[1] == "pdfdeal-loop"
+    # The loop is kept between calls and shared by concurrent callers
+    with ThreadPoolExecutor(4) as pool:
+        loops = list(pool.map(lambda _: run_async(current()), range(8)))
+    assert all(loop == first for loop in loops)
+
+    # Also from a thread which already runs a loop, like a notebook
+    async def nested():
+        return run_async(current())
+
+    assert asyncio.run(nested()) == first
@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+import pytest
+
+from pdfdeal import Doc2X
+from pdfdeal.Doc2X.Exception import run_async
+from pdfdeal.Doc2X.Trace import (
+    JsonlSpanExporter,
+    SpanExporter,
+    Tracer,
+    annotate,
+    set_attributes,
+    span,
+    start_tracing,
+    traced,
+)
+
+
+class ListExporter(SpanExporter):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+@traced("api.status")
+async def status(apikey, uid):
+    annotate(trace_id=f"trace-{uid}")
+    if uid == "bad":
+        raise ValueError("failed")
+    return uid
+
+
+def test_spans():
+    exporter = ListExporter()
+
+    async def main():
+        # Not traced, nothing is recorded
+        with span("stage.parse"):
+            await status("sk", "u0")
+        batch = start_tracing(Tracer(exporter))
+
+        async def file(path, uid):
+            set_attributes(path=path)
+            with span("stage.parse", uid=uid):
+                await status("sk", uid=uid)
+
+        await asyncio.gather(file("a.pdf", "u1"), file("b.pdf", "u2"))
+        with pytest.raises(ValueError):
+            await status("sk", "bad")
+        return batch
+
+    batch = asyncio.run(main())
+    assert len(exporter.spans) == 5
+    assert all(s["batch"] == batch for s in exporter.spans)
+    calls = [s for s in exporter.spans if s["name"] == "api.status"]
+    assert {(s.get("path"), s["uid"], s["trace_id"]) for s in calls} == {
+        ("a.pdf", "u1", "trace-u1"),
+        ("b.pdf", "u2", "trace-u2"),
+        (None, "bad", "trace-bad"),
+    }
+    assert calls[-1]["error"] == "ValueError: failed"
+    assert all(s["attempt"] == 1 and s["duration"] >= 0 for s in calls)
+
+
+def test_jsonl_exporter(tmp_path):
+    path = tmp_path / "trace" / "spans.jsonl"
+    exporter = JsonlSpanExporter(str(path), flush_interval=60)
+    tracer = Tracer(exporter)
+    tracer.emit("file", 0, 1.5, path="a.pdf", uid=None)
+    exporter.flush()
+    assert json.loads(path.read_text()) == {
+        "name": "file",
+        "start": 0,
+        "duration": 1.5,
+        "path": "a.pdf",
+    }
+    exporter.close()
+
+    # Closed with the client which opened it, and opened again by the next span
+    client = Doc2X(apikey="sk-test", trace=str(path))
+
+    async def main():
+        async with client:
+            client.tracer.emit("file", 0, 2, path="b.pdf")
+
+    asyncio.run(main())
+    assert client.tracer.exporter._thread is None
+    assert path.read_text().count("\n") == 2
+    client.tracer.emit("file", 0, 3, path="c.pdf")
+    client.close()
+    assert client.tracer.exporter._thread is None
+    assert path.read_text().count("\n") == 3
+
+    # The pool of another loop, here the one the synchronous methods keep, still traces
+    run_async(client._hold_client())
+    client.tracer.emit("file", 0, 4, path="d.pdf")
+    asyncio.run(main())
+    assert client.tracer.exporter._thread is not None
+    client.close()
+    assert client.tracer.exporter._thread is None
+    assert path.read_text().count("\n") == 5